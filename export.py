@@ -0,0 +1,193 @@
+"""
+把搜索结果直接从扫描写入文件，不经过界面的结果列表
+
+    searcher = LogSearcher(['error'])
+    with open_export('matches.jsonl.gz') as writer:
+        for match in searcher.search_files(paths):
+            writer.write(match)
+
+支持三种格式:
+  txt    与命令行输出相同的 grep 式文本，可带文件名和行号前缀
+  jsonl  每行一个 JSON 对象: 文件、行号、偏移、长度、是否匹配、命中的关键词和内容
+  csv    列与 jsonl 相同，第一行为表头
+
+写入经过大块缓冲(EXPORT_BUFFER_SIZE)，文件名以 .gz 结尾时用 gzip 压缩。结果逐条
+格式化后写出，不在内存中积累，导出几百万条结果的内存占用也是固定的。
+"""
+import io
+import os
+import csv
+import gzip
+import json
+from abc import ABC, abstractmethod
+
+EXPORT_FORMATS = ('txt', 'jsonl', 'csv')
+
+# 写入文件的缓冲区大小
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# gzip 压缩级别: 导出的瓶颈通常在压缩上，较低的级别速度快得多，压缩率相差不大
+EXPORT_GZIP_LEVEL = 1
+
+# 只编码字符串，避免每条结果都构造一个 JSONEncoder
+_json_string = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def export_format(path):
+    """ 按扩展名判断导出格式和是否压缩: 返回 (格式, 是否 gzip)，无法判断时格式为 txt """
+    name = path.lower()
+    compress = name.endswith('.gz')
+    if compress:
+        name = name[:-3]
+    ext = os.path.splitext(name)[1].lstrip('.')
+    return (ext if ext in EXPORT_FORMATS else 'txt'), compress
+
+
+def open_export(path, fmt=None, compress=None, keywords=(), show_path=True, line_number=True,
+                context=False):
+    """
+    打开导出文件，返回对应格式的 MatchWriter。fmt 和 compress 为 None 时按扩展名判断；
+    keywords 用于在 jsonl/csv 中把命中位掩码还原为关键词；show_path、line_number 和
+    context(是否带上下文行)只影响 txt 格式。
+    """
+    guessed, gz = export_format(path)
+    fmt = fmt or guessed
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    compress = gz if compress is None else compress
+    if compress:
+        raw = open(path, 'wb')
+        try:
+            binary = io.BufferedWriter(gzip.GzipFile(fileobj=raw, mode='wb',
+                                                     compresslevel=EXPORT_GZIP_LEVEL),
+                                       EXPORT_BUFFER_SIZE)
+        except BaseException:
+            raw.close()
+            raise
+    else:
+        raw = None
+        binary = open(path, 'wb', buffering=EXPORT_BUFFER_SIZE)
+    # csv 模块自己处理换行
+    stream = io.TextIOWrapper(binary, encoding='utf-8', errors='replace',
+                              newline='' if fmt == 'csv' else None)
+    if fmt == 'jsonl':
+        return JsonLinesWriter(stream, keywords, path=path, raw=raw)
+    if fmt == 'csv':
+        return CsvWriter(stream, keywords, path=path, raw=raw)
+    return TextWriter(stream, show_path, line_number, context, path=path, raw=raw)
+
+
+class MatchWriter(ABC):
+    """
+    逐条写出结果；count 为已写出的匹配数(不含上下文行)。path 为导出文件的路径，
+    raw 为 gzip 压缩时底层的文件，关闭 stream 后一并关闭
+    """
+
+    def __init__(self, stream, keywords=(), path=None, raw=None):
+        self.stream = stream
+        self.keywords = list(keywords)
+        self.path = path
+        self.count = 0
+        self._raw = raw
+        self._names = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, match):
+        if match.mask:
+            self.count += 1
+        self._write(match)
+
+    @abstractmethod
+    def _write(self, match):
+        """ 按格式写出一条结果或上下文行 """
+
+    def keyword_names(self, mask):
+        """ 命中位掩码对应的关键词，用 '|' 分隔；同一掩码只拼接一次 """
+        names = self._names.get(mask)
+        if names is None:
+            names = self._names[mask] = '|'.join(
+                k for i, k in enumerate(self.keywords) if mask >> i & 1)
+        return names
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            # GzipFile 不会关闭传入的文件对象
+            if self._raw is not None:
+                self._raw.close()
+
+
+class TextWriter(MatchWriter):
+    """ 与命令行输出相同: 匹配行用 ':'、上下文行用 '-' 分隔前缀，不连续的部分之间写 -- """
+
+    def __init__(self, stream, show_path=True, line_number=True, context=False, path=None,
+                 raw=None):
+        super().__init__(stream, path=path, raw=raw)
+        self.show_path = show_path
+        self.line_number = line_number
+        self.context = context
+        self._last = None
+
+    def _write(self, match):
+        if self.context:
+            last = self._last
+            if last is not None and (match.path != last.path
+                                     or match.line_number != last.line_number + 1):
+                self.stream.write("--\n")
+            self._last = match
+        sep = ":" if match.mask else "-"
+        prefix = f"{match.path}{sep}" if self.show_path else ""
+        if self.line_number:
+            prefix += f"{match.line_number}{sep}"
+        self.stream.write(prefix + match.text + "\n")
+
+
+class JsonLinesWriter(MatchWriter):
+    """ 每行一个 JSON 对象，字段见模块说明；上下文行的 match 为 false """
+
+    def __init__(self, stream, keywords=(), path=None, raw=None):
+        super().__init__(stream, keywords, path, raw)
+        self._path = None
+        self._path_json = 'null'
+        self._keywords_json = {}
+
+    def _write(self, match):
+        if match.path is not self._path:
+            self._path = match.path
+            self._path_json = 'null' if match.path is None else _json_string(match.path)
+        if match.mask:
+            keywords = self._keywords_json.get(match.mask)
+            if keywords is None:
+                keywords = self._keywords_json[match.mask] = json.dumps(
+                    [k for i, k in enumerate(self.keywords) if match.mask >> i & 1],
+                    ensure_ascii=False)
+            kind = 'true'
+        else:
+            keywords, kind = '[]', 'false'
+        self.stream.write(
+            f'{{"path":{self._path_json},"line":{match.line_number},"offset":{match.offset},'
+            f'"length":{match.length},"match":{kind},"keywords":{keywords},'
+            f'"text":{_json_string(match.text)}}}\n')
+
+
+class CsvWriter(MatchWriter):
+    """ 列: path, line, offset, length, match(1/0), keywords('|' 分隔), text """
+
+    HEADER = ['path', 'line', 'offset', 'length', 'match', 'keywords', 'text']
+
+    def __init__(self, stream, keywords=(), path=None, raw=None):
+        super().__init__(stream, keywords, path, raw)
+        self._writer = csv.writer(stream)
+        self._writer.writerow(self.HEADER)
+
+    def _write(self, match):
+        mask = match.mask
+        self._writer.writerow((match.path or '', match.line_number, match.offset, match.length,
+                               1 if mask else 0, self.keyword_names(mask) if mask else '',
+                               match.text))
@@ -0,0 +1,180 @@
+"""
+搜索结果按时间的分布: 在输出结果的同时按行首的时间戳计数
+
+    searcher = LogSearcher(['error'], histogram=True)
+    for match in searcher.search('app.log'):
+        ...
+    for line in format_histogram(searcher.stats.histogram):
+        print(line)
+
+计数保存在一个数组中，每个元素是一个时间段(秒、分钟、小时或天)的匹配数。
+从按秒计数开始，时间跨度超过 HISTOGRAM_MAX_BUCKETS 个时间段时自动改用更粗的
+粒度并合并已有的计数，内存占用与结果数无关。
+
+按时间戳计数是摊销的: 同一分钟内的结果只比较一次前缀，不重复解析时间戳。
+"""
+import re
+from array import array
+from datetime import date, datetime, timedelta
+
+# 行首的时间戳，与 time_window.TIMESTAMP_RE 的格式一致
+TIMESTAMP = re.compile(r'\[?(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})')
+
+# 可选的时间段长度(秒)及名称，从细到粗
+STEPS = [(1, '秒'), (60, '分钟'), (3600, '小时'), (86400, '天')]
+
+# 最多的时间段数，超过时改用更粗的粒度
+HISTOGRAM_MAX_BUCKETS = 1440
+
+
+def text_seconds(text):
+    """ 行首时间戳对应的秒数(见 to_datetime)，没有时间戳时返回 None """
+    m = TIMESTAMP.match(text)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second = map(int, m.groups())
+    try:
+        return date(year, month, day).toordinal() * 86400 + hour * 3600 + minute * 60 + second
+    except ValueError:
+        return None
+
+
+def to_datetime(seconds):
+    """ 把 text_seconds() 得到的秒数还原为 datetime """
+    return datetime.fromordinal(seconds // 86400) + timedelta(seconds=seconds % 86400)
+
+
+class TimeHistogram:
+    """
+    匹配数按时间段的分布。counts[i] 是从 origin + i * step 秒开始、长 step 秒的
+    时间段中的匹配数；行首没有时间戳的结果只计入 untimed。
+    """
+
+    def __init__(self, max_buckets=HISTOGRAM_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.step = 1
+        self.origin = 0
+        self.counts = array('Q')
+        self.untimed = 0
+        # 上一个时间戳的前缀及其所在的时间段
+        self._key = None
+        self._key_size = 0
+        self._index = 0
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    @property
+    def resolution(self):
+        """ 时间段的名称，如 分钟 """
+        return dict(STEPS).get(self.step, f'{self.step} 秒')
+
+    def bucket_range(self, index, factor=1):
+        """
+        第 index 个时间段的(开始, 结束)秒数，结束不包含在内；factor 为 rebin() 合并的
+        时间段数，此时 index 指合并后的第几段
+        """
+        step = self.step * factor
+        start = self.origin + index * step
+        return start, start + step
+
+    def add(self, text):
+        """ 按行首的时间戳计入一条结果 """
+        if text[:self._key_size] != self._key and not self._parse(text):
+            self.untimed += 1
+            return
+        self.counts[self._index] += 1
+
+    def _parse(self, text):
+        """ 解析时间戳，记下它所在的时间段，之后前缀相同的结果直接计入 """
+        m = TIMESTAMP.match(text)
+        if m is None:
+            return False
+        year, month, day, hour, minute, second = map(int, m.groups())
+        try:
+            seconds = date(year, month, day).toordinal() * 86400 + hour * 3600 + minute * 60
+        except ValueError:
+            return False
+        if self.step == 1:
+            seconds += second
+        # 数组可能扩展或改用更粗的粒度，之后再确定前缀的长度
+        self._index = self._slot(seconds)
+        # 按秒计数时前缀到秒为止，否则到分钟为止(可能带方括号)
+        self._key_size = m.end() if self.step == 1 else m.start(5) + 2
+        self._key = text[:self._key_size]
+        return True
+
+    def _slot(self, seconds):
+        """ seconds 所在时间段的下标，超出当前范围时扩展数组或改用更粗的粒度 """
+        counts = self.counts
+        if not counts:
+            self.origin = seconds - seconds % self.step
+            counts.append(0)
+        index = (seconds - self.origin) // self.step
+        if 0 <= index < len(counts):
+            return index
+        if 0 <= index < self.max_buckets:
+            counts.extend([0] * (index + 1 - len(counts)))
+            return index
+        self._relayout(min(seconds, self.origin),
+                       max(seconds + 1, self.origin + len(counts) * self.step))
+        return (seconds - self.origin) // self.step
+
+    def _relayout(self, low, high):
+        """ 让数组覆盖 [low, high) 秒，时间段数超过上限时合并为更粗的粒度 """
+        step = self.step
+        for size, _ in STEPS:
+            step = max(size, self.step)
+            if (high - (low - low % step) + step - 1) // step <= self.max_buckets:
+                break
+        origin = low - low % step
+        counts = array('Q', [0]) * ((high - origin + step - 1) // step)
+        for i, count in enumerate(self.counts):
+            if count:
+                counts[(self.origin + i * self.step - origin) // step] += count
+        self.step, self.origin, self.counts = step, origin, counts
+        # 缓存的时间段下标已失效
+        self._key = None
+
+    def rebin(self, max_bars):
+        """ 合并相邻的时间段，返回 (每段的秒数, 计数列表)，最多 max_bars 段 """
+        factor = max(1, -(-len(self.counts) // max(1, max_bars)))
+        if factor == 1:
+            return self.step, list(self.counts)
+        counts = self.counts
+        return self.step * factor, [sum(counts[i:i + factor])
+                                    for i in range(0, len(counts), factor)]
+
+
+def format_time(seconds, step):
+    """ 按时间段的粒度格式化时间段的开始时间 """
+    value = to_datetime(seconds)
+    if step % 86400 == 0:
+        return value.strftime('%Y-%m-%d')
+    if step % 60 == 0:
+        return value.strftime('%m-%d %H:%M')
+    return value.strftime('%m-%d %H:%M:%S')
+
+
+def format_histogram(histogram, max_bars=24, width=40):
+    """ 以文本条形图显示分布，每行一个时间段: 开始时间、条形和匹配数 """
+    step, counts = histogram.rebin(max_bars)
+    lines = []
+    if counts:
+        peak = max(counts) or 1
+        lines.append(f"匹配数按时间的分布(每行 {format_duration(step)}):")
+        for i, count in enumerate(counts):
+            bar = '█' * max(1 if count else 0, round(count / peak * width))
+            lines.append(f"{format_time(histogram.origin + i * step, step)}  {bar} {count}")
+    if histogram.untimed:
+        lines.append(f"另有 {histogram.untimed} 个结果的行首没有时间戳")
+    return lines
+
+
+def format_duration(seconds):
+    """ 时间段的长度，如 5 分钟 """
+    for size, name in reversed(STEPS):
+        if seconds % size == 0:
+            return f"{seconds // size} {name}"
+    return f"{seconds} 秒"
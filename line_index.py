@@ -0,0 +1,204 @@
+"""
+日志文件的行偏移索引
+
+LogSearcher 第一次完整扫描较大的文件时顺带记录检查点(行首偏移和此前的行数)，
+保存在倒排索引(见 log_index)旁边的 .lines 文件中。之后再搜索该文件时不必扫描
+就知道总行数，进度可以按行精确显示；也可以直接定位到任意行:
+
+    index = load_line_index('app.log')
+    with open('app.log', 'rb') as f:
+        offset = index.line_offset(f, 120000)
+
+检查点按字节间隔(而不是每行)记录，扫描时只需在每块中找几次换行符，
+几乎不增加扫描开销；定位时从最近的检查点向后最多读取一个间隔的数据。
+文件只在末尾追加了内容时，已有的检查点对原来的部分仍然有效。
+"""
+import os
+import sys
+import json
+import struct
+import bisect
+from array import array
+
+from search import RESUME_TAIL_SIZE, _hash_range, file_fingerprint
+from log_index import INDEX_DIR, index_path
+
+LINE_INDEX_MAGIC = b'LSTLINE1'
+LINE_INDEX_VERSION = 1
+
+# 检查点之间的字节间隔
+LINE_INDEX_STRIDE = 64 * 1024
+
+# 小于该大小的文件扫描一遍也很快，不保存行偏移索引
+LINE_INDEX_MIN_SIZE = 5 * 1024 * 1024
+
+
+def line_index_path(path):
+    return os.path.splitext(index_path(path))[0] + '.lines'
+
+
+class LineIndex:
+    """
+    行偏移索引: offsets[i] 是某一行的行首偏移，line_counts[i] 是该行之前的行数。
+
+    扫描时从 start(须位于行首)开始依次用 add_block() 或 checkpoint() 记录，
+    最后用 finish() 记下覆盖的字节数和总行数。
+    """
+
+    def __init__(self, start=0, stride=LINE_INDEX_STRIDE):
+        self.stride = stride
+        self.offsets = array('Q', [start])
+        self.line_counts = array('Q', [0])
+        self.size = 0               # 覆盖的字节数
+        self.lines = 0              # 总行数(含没有换行符的最后一行)
+        self.header = {}
+        self._newlines = 0          # 已记录的块中的换行符数
+        self.next_checkpoint = start + stride
+
+    def checkpoint(self, offset, line_count):
+        """ 记录一个检查点，返回下一个检查点的最小偏移 """
+        self.offsets.append(offset)
+        self.line_counts.append(line_count)
+        self.next_checkpoint = offset + self.stride
+        return self.next_checkpoint
+
+    def add_block(self, block, base_offset):
+        """
+        记录一块完整的行中的检查点，各块须从行首开始并依次相连。
+
+        返回块中的换行符数，调用方不必再数一遍。
+        """
+        size = len(block)
+        target = max(self.next_checkpoint - base_offset, 0)
+        lines = self._newlines
+        counted = 0
+        while target < size:
+            if target > 0:
+                # 检查点放在 target 处或之后的第一个行首
+                newline = block.find(b'\n', target - 1)
+                if newline < 0 or newline + 1 >= size:
+                    break
+                target = newline + 1
+            lines += block.count(b'\n', counted, target)
+            counted = target
+            self.checkpoint(base_offset + target, lines)
+            target += self.stride
+        newlines = lines - self._newlines + block.count(b'\n', counted)
+        self._newlines += newlines
+        return newlines
+
+    def extend(self, other, line_count):
+        """ 接上另一段(从 other.offsets[0] 开始)的检查点，line_count 为该段之前的行数 """
+        last = self.offsets[-1]
+        for offset, count in zip(other.offsets, other.line_counts):
+            if offset > last:
+                self.checkpoint(offset, count + line_count)
+        self._newlines = line_count + other._newlines
+
+    def finish(self, size, lines):
+        self.size = size
+        self.lines = lines
+
+    def line_offset(self, f, line_number):
+        """ 返回第 line_number 行(从1开始)的行首偏移，超出索引范围时返回 None """
+        if not 1 <= line_number <= self.lines:
+            return None
+        i = bisect.bisect_right(self.line_counts, line_number - 1) - 1
+        offset = self.offsets[i]
+        skip = line_number - 1 - self.line_counts[i]
+        if not skip:
+            return offset
+        stop = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+        f.seek(offset)
+        data = f.read(stop - offset)
+        pos = 0
+        for _ in range(skip):
+            pos = data.find(b'\n', pos) + 1
+        return offset + pos
+
+    def line_number_at(self, f, offset):
+        """ 返回偏移 offset 处所在的行号(从1开始) """
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        start = self.offsets[i]
+        f.seek(start)
+        return self.line_counts[i] + f.read(offset - start).count(b'\n') + 1
+
+    def is_fresh(self, path):
+        """ 索引是否与文件当前内容完全一致，此时 lines 就是文件的总行数 """
+        fingerprint = self.header.get('fingerprint')
+        # 扫描期间文件仍在增长时，索引只覆盖前一部分
+        if fingerprint is None or fingerprint['size'] != self.size:
+            return False
+        try:
+            return file_fingerprint(path) == fingerprint
+        except OSError:
+            return False
+
+    def covers(self, f):
+        """ 文件只在末尾追加了内容时，已有的检查点对覆盖的部分仍然有效 """
+        header = self.header
+        size = os.fstat(f.fileno()).st_size
+        if size < self.size or not self.size:
+            return False
+        fingerprint = file_fingerprint(f.name)
+        if fingerprint['head'] != header['fingerprint']['head']:
+            return False
+        return _hash_range(f, max(self.size - RESUME_TAIL_SIZE, 0), self.size) == header['tail']
+
+    def save(self, path, f):
+        """ 保存到 path 对应的 .lines 文件，f 为打开的日志文件 """
+        header = {
+            'version': LINE_INDEX_VERSION,
+            'byteorder': sys.byteorder,
+            'path': os.path.realpath(path),
+            'stride': self.stride,
+            'size': self.size,
+            'lines': self.lines,
+            'count': len(self.offsets),
+            'fingerprint': file_fingerprint(path),
+            'tail': _hash_range(f, max(self.size - RESUME_TAIL_SIZE, 0), self.size),
+        }
+        data = json.dumps(header).encode('utf-8')
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        target = line_index_path(path)
+        temp = f"{target}.{os.getpid()}.tmp"
+        with open(temp, 'wb') as out:
+            out.write(LINE_INDEX_MAGIC + struct.pack('<I', len(data)) + data)
+            out.write(self.offsets.tobytes())
+            out.write(self.line_counts.tobytes())
+        os.replace(temp, target)
+        self.header = header
+
+
+def load_line_index(path):
+    """ 读取文件的行偏移索引，没有或无法读取时返回 None(不检查是否最新) """
+    try:
+        with open(line_index_path(path), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    start = len(LINE_INDEX_MAGIC) + 4
+    if data[:len(LINE_INDEX_MAGIC)] != LINE_INDEX_MAGIC:
+        return None
+    (length,) = struct.unpack_from('<I', data, len(LINE_INDEX_MAGIC))
+    try:
+        header = json.loads(data[start:start + length])
+    except ValueError:
+        return None
+    if header.get('version') != LINE_INDEX_VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    count = header['count']
+    start += length
+    index = LineIndex(stride=header['stride'])
+    index.offsets = array('Q')
+    index.line_counts = array('Q')
+    try:
+        index.offsets.frombytes(data[start:start + count * 8])
+        index.line_counts.frombytes(data[start + count * 8:start + count * 16])
+    except ValueError:
+        return None
+    if len(index.offsets) != count or len(index.line_counts) != count:
+        return None
+    index.finish(header['size'], header['lines'])
+    index.header = header
+    return index
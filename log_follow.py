@@ -0,0 +1,343 @@
+"""
+跟踪仍在写入的日志文件，只读取并匹配新增的内容
+
+首次搜索结束后，从搜索到的位置开始跟踪:
+
+    followers = followers_for(searcher, searcher.file_stats)
+    for matches in follow(followers):
+        for match in matches:
+            print(match.line_number, match.text)
+
+Linux 上通过 inotify 等待文件所在目录的变化，新写入的内容几乎立即被读取；
+其他平台或 inotify 不可用时改为定时轮询。每次只读取上次位置之后的完整行，
+没有换行符的最后一行等写完再读取。日志被轮转(改名后重新创建同名文件)时先
+读完旧文件剩余的内容再改为跟踪新文件；被原地截断时从头开始。
+"""
+import os
+import sys
+import time
+import select
+import struct
+
+from search import SCAN_BLOCK_SIZE, Match, SearchStats, decode_line
+
+# 轮询方式下检查文件变化的间隔(秒)
+FOLLOW_POLL_INTERVAL = 0.5
+# 使用 inotify 时仍定期检查一次，网络文件系统等可能收不到事件
+FOLLOW_SAFETY_INTERVAL = 5.0
+# 等待期间检查是否已取消的间隔(秒)
+FOLLOW_CHECK_INTERVAL = 0.2
+# 每次最多读取的新增内容，大量追加时分块返回结果
+FOLLOW_BLOCK_SIZE = SCAN_BLOCK_SIZE
+
+# inotify 事件(见 inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+# struct inotify_event: wd, mask, cookie, len，之后是 len 字节的文件名
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """ 通过 ctypes 使用 libc 的 inotify 接口，不可用(非 Linux 等)时返回 None """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """
+    等待被跟踪的文件发生变化。
+
+    监视文件所在的目录而不是文件本身，这样文件被改名、删除后重新创建也能收到事件。
+    inotify 不可用时按 poll_interval 轮询。
+    """
+
+    def __init__(self, paths, poll_interval=FOLLOW_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._fd = None
+        self._watches = {}      # watch 描述符 -> 该目录下被跟踪的文件名
+        self._next_check = 0.0
+
+        dirs = {}
+        for path in paths:
+            directory, name = os.path.split(os.path.abspath(path))
+            dirs.setdefault(directory, set()).add(os.fsencode(name))
+        libc = _load_inotify()
+        if libc is None or not dirs:
+            return
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        for directory, names in dirs.items():
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                # 超过 max_user_watches 等情况下整体改为轮询
+                os.close(fd)
+                self._watches.clear()
+                return
+            self._watches[wd] = names
+        self._fd = fd
+        self.poll_interval = FOLLOW_SAFETY_INTERVAL
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def wait(self, timeout):
+        """
+        最多等待 timeout 秒。文件可能有变化(收到相关事件或到了轮询时间)时返回 True，
+        否则返回 False，调用方可借此定期检查是否已取消。
+        """
+        now = time.monotonic()
+        deadline = min(now + timeout, self._next_check)
+        if self._fd is None:
+            if deadline > now:
+                time.sleep(deadline - now)
+        else:
+            while True:
+                ready, _, _ = select.select([self._fd], [], [], max(deadline - time.monotonic(), 0))
+                if not ready:
+                    break
+                if self._read_events():
+                    self._next_check = time.monotonic() + self.poll_interval
+                    return True
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.poll_interval
+            return True
+        return False
+
+    def _read_events(self):
+        """ 读出所有待处理的事件，其中有被跟踪文件的事件时返回 True """
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = data[pos:pos + length].rstrip(b'\0')
+                pos += length
+                # 事件队列溢出时无法知道丢了哪些，当作有变化
+                if mask & IN_Q_OVERFLOW or name in self._watches.get(wd, ()):
+                    changed = True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LogFollower:
+    """
+    跟踪一个日志文件，只读取并匹配上次位置之后新增的完整行。
+
+    offset 和 line_number 是首次搜索结束时的位置和行数；offset 落在没有换行符的
+    最后一行中间时退回到该行行首，等这一行写完后重新匹配整行。reported 为首次搜索
+    最后一个结果的偏移，这一行之前已作为结果返回过的不会再返回。
+    """
+
+    def __init__(self, searcher, path, encoding, offset=0, line_number=0, reported=-1):
+        self.searcher = searcher
+        self.path = path
+        self.encoding = encoding
+        self.literals = searcher.matcher.byte_literals(encoding)
+        self.stats = SearchStats(path, 0)   # 记录解码错误
+        self.rotations = 0
+        self.truncations = 0
+        self._f = open(path, 'rb')
+        self.offset, self.line_number = self._line_start(offset, line_number)
+        self.reported = reported
+        # 需要上下文时跨块保留的窗口，首次搜索已输出的行不再作为上下文输出
+        self.context = searcher.context_window(path, self.line_number)
+
+    def _line_start(self, offset, line_number):
+        """ 返回 offset 所在行的行首偏移和此前的行数 """
+        if offset <= 0:
+            return 0, 0
+        f = self._f
+        pos = offset
+        while pos > 0:
+            size = min(pos, 64 * 1024)
+            f.seek(pos - size)
+            data = f.read(size)
+            newline = data.rfind(b'\n')
+            if newline == size - 1 and pos == offset:
+                return offset, line_number
+            if newline >= 0:
+                return pos - size + newline + 1, line_number - 1
+            pos -= size
+        return 0, line_number - 1
+
+    def read(self, on_replace=None):
+        """
+        依次返回新增内容中的匹配，每块一个 Match 列表。
+
+        文件被轮转时先读完旧文件(包括没有换行符的最后一行)，再调用
+        on_replace(path, old_file) 并改为从头跟踪新文件: old_file 交给调用方，
+        之前结果的行内容仍可从中读取。文件被原地截断时调用 on_replace(path, None)，
+        从头开始读取。没有 on_replace 时旧文件直接关闭。
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # 已经改名但还没创建新文件，继续读旧文件
+            st = None
+        current = os.fstat(self._f.fileno())
+        if st is not None and (st.st_ino, st.st_dev) != (current.st_ino, current.st_dev):
+            yield from self._read_new(final=True)
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return
+            old, self._f = self._f, f
+            self._restart()
+            self.rotations += 1
+            if on_replace is not None:
+                on_replace(self.path, old)
+            else:
+                old.close()
+        elif current.st_size < self.offset:
+            # 原地截断(如 copytruncate 方式的轮转)
+            self._restart()
+            self.truncations += 1
+            if on_replace is not None:
+                on_replace(self.path, None)
+        yield from self._read_new()
+
+    def _restart(self):
+        self.offset = 0
+        self.line_number = 0
+        self.reported = -1
+        self.context = self.searcher.context_window(self.path)
+
+    def _read_new(self, final=False):
+        """ 从 offset 开始按块读取完整的行并匹配；final 为真时最后一行没有换行符也读取 """
+        f = self._f
+        while True:
+            f.seek(self.offset)
+            data = f.read(FOLLOW_BLOCK_SIZE)
+            if not data:
+                return
+            end = data.rfind(b'\n') + 1
+            while end == 0:
+                # 一行超过一块时继续读到换行符为止
+                more = f.read(FOLLOW_BLOCK_SIZE)
+                if not more:
+                    break
+                newline = more.find(b'\n')
+                if newline >= 0:
+                    data += more[:newline + 1]
+                    end = len(data)
+                else:
+                    data += more
+            if end == 0 and not final:
+                # 最后一行还没写完，下次再读
+                return
+            block = data[:end] if end else data
+
+            matches = list(self._match_block(block))
+            if self.reported >= self.offset:
+                matches = [m for m in matches if m.offset > self.reported]
+            self.line_number += block.count(b'\n')
+            if not block.endswith(b'\n'):
+                self.line_number += 1
+            self.offset += len(block)
+            if matches:
+                yield matches
+            if not end:
+                return
+
+    def _match_block(self, block):
+        searcher = self.searcher
+        if self.literals is not None:
+            yield from searcher._scan_block(block, self.offset, self.line_number, self.encoding,
+                                            self.literals, self.stats, self.context)
+            return
+        # 无法做字节级预筛时逐行解码
+        match_line = searcher.matcher.match
+        context = self.context
+        offset = self.offset
+        for line_number, raw in enumerate(block.splitlines(keepends=True), self.line_number + 1):
+            line = decode_line(raw, self.encoding, self.stats)
+            mask = match_line(line)
+            if mask:
+                match = Match(line_number, offset, len(raw), mask, line.rstrip('\r\n'), self.path)
+                if context is not None:
+                    yield from context.matched(match, self.encoding, self.stats)
+                yield match
+            elif context is not None:
+                match = context.feed(line_number, offset, raw, line, self.encoding, self.stats)
+                if match is not None:
+                    yield match
+            offset += len(raw)
+
+    def close(self):
+        self._f.close()
+
+
+def followers_for(searcher, file_stats, reported=None):
+    """
+    为搜索完的文件创建 LogFollower，从各文件搜索到的位置开始跟踪。
+
+    reported 为各文件最后一个结果的偏移({路径: 偏移})。压缩文件和出错的文件不跟踪。
+    """
+    reported = reported or {}
+    followers = []
+    try:
+        for stats in file_stats:
+            if stats.error or stats.compression or stats.encoding is None:
+                continue
+            followers.append(LogFollower(searcher, stats.path, stats.encoding, stats.bytes_scanned,
+                                         stats.lines_scanned, reported.get(stats.path, -1)))
+    except OSError:
+        for follower in followers:
+            follower.close()
+        raise
+    return followers
+
+
+def follow(followers, cancelled=None, on_replace=None, poll_interval=FOLLOW_POLL_INTERVAL):
+    """
+    持续返回各文件新增内容中的匹配(Match 列表)，cancelled() 为真时结束。
+
+    on_replace 见 LogFollower.read()。结束时关闭所有 follower。
+    """
+    try:
+        with FileWatcher([f.path for f in followers], poll_interval) as watcher:
+            while True:
+                for follower in followers:
+                    yield from follower.read(on_replace)
+                while not watcher.wait(FOLLOW_CHECK_INTERVAL):
+                    if cancelled is not None and cancelled():
+                        return
+                if cancelled is not None and cancelled():
+                    return
+    finally:
+        for follower in followers:
+            follower.close()
@@ -0,0 +1,468 @@
+"""
+日志文件的持久化倒排索引
+
+同一个大文件需要反复搜索时，先建立一次索引:
+
+    info = build_index('app.log')
+    print(info['index_size'], info['elapsed'])
+
+之后 LogSearcher 搜索该文件时会自动使用索引，只读取可能匹配的行；
+文件被修改(大小、修改时间或文件头变化)后索引视为过期，搜索自动改为扫描。
+
+索引把每行按"词"(连续的字母、数字、下划线和非 ASCII 字节)切分，记录每个词
+出现在哪些行。关键词按同样的规则切分后，每一段必然是所在行中某个词的子串，
+所以在词表中查找包含该段的词，合并它们的行号即可得到候选行；候选行再交给
+KeywordMatcher 确认，结果与扫描完全一致。
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from search import (Match, PARALLEL_MIN_SIZE, SCAN_BLOCK_SIZE, decode_line, detect_compression,
+                    detect_encoding, file_fingerprint, split_ranges)
+
+# 索引文件保存在关键词文件旁边
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".log_search_tool", "index")
+
+INDEX_MAGIC = b'LSTIDX1\n'
+INDEX_VERSION = 1
+
+# 词: 连续的 ASCII 字母、数字、下划线以及非 ASCII 字节(多字节字符)
+TOKEN_RE = re.compile(rb'[0-9A-Za-z_\x80-\xff]+')
+
+# 每隔多少行记录一次行首偏移，读取候选行时从最近的记录点向后查找
+CHECKPOINT_INTERVAL = 64
+
+# 倒排表分段的头部: 起始行号、行数、数据字节数；字节数带 RAW_PIECE 标记时数据未压缩
+PIECE_HEADER = struct.Struct('<QII')
+RAW_PIECE = 1 << 31
+
+# 候选行超过总行数的该比例时，读取候选行不比顺序扫描快，改为扫描
+MAX_CANDIDATE_RATIO = 0.125
+
+
+# 索引文件路径，按日志文件的绝对路径区分
+def index_path(path):
+    name = hashlib.sha1(os.path.realpath(path).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(INDEX_DIR, name + '.idx')
+
+
+def _index_range(path, start, stop):
+    """
+    为文件中 [start, stop) 这一段建立倒排表，行号从0开始相对于 start 计算。
+
+    返回(行数, {词: (行数, 行号差值数据, 数据是否未压缩)}, 记录点行号, 记录点偏移)。
+    """
+    postings = {}
+    cp_lines = array('Q')
+    cp_offsets = array('Q')
+    line_number = 0
+    findall = TOKEN_RE.findall
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < stop:
+            end = min(pos + SCAN_BLOCK_SIZE, stop)
+            if end < stop:
+                newline = mm.rfind(b'\n', pos, end)
+                if newline < 0:
+                    newline = mm.find(b'\n', end)
+                end = stop if newline < 0 else newline + 1
+            lines = mm[pos:end].lower().split(b'\n')
+            if lines[-1] == b'':
+                lines.pop()
+            offset = pos
+            for line in lines:
+                if line_number % CHECKPOINT_INTERVAL == 0:
+                    cp_lines.append(line_number)
+                    cp_offsets.append(offset)
+                for token in set(findall(line)):
+                    posting = postings.get(token)
+                    if posting is None:
+                        posting = postings[token] = array('I')
+                    posting.append(line_number)
+                offset += len(line) + 1
+                line_number += 1
+            pos = end
+
+    compressed = {}
+    for token, lines in postings.items():
+        # 行号递增，存差值后压缩率很高
+        deltas = array('I', [lines[0]])
+        deltas.extend(b - a for a, b in zip(lines, lines[1:]))
+        raw = deltas.tobytes()
+        data = zlib.compress(raw, 1)
+        # 只出现几次的词(如请求ID)压缩后反而更大
+        compressed[token] = (len(lines), raw, True) if len(data) >= len(raw) else (len(lines), data, False)
+    return line_number, compressed, cp_lines, cp_offsets
+
+
+def build_index(path, encoding=None, workers=None, progress=None, cancelled=None):
+    """
+    为文件建立索引并写入 INDEX_DIR，返回索引信息(大小、耗时等)。
+
+    大文件分段交给多个进程建立；progress(done_bytes, total_bytes) 在每段完成后调用。
+    cancelled() 返回真时放弃建立，不写入索引并返回 None。
+    """
+    started = time.monotonic()
+    if detect_compression(path) is not None:
+        raise OSError(f"压缩文件不支持建立索引: {path}")
+    if encoding is None:
+        encoding = detect_encoding(path)
+        if encoding is None:
+            raise UnicodeError(f"无法以支持的编码格式打开文件 {path}")
+    if 'a\n'.encode(encoding) != b'a\n':
+        raise UnicodeError(f"{encoding} 编码的文件不支持建立索引")
+    fingerprint = file_fingerprint(path)
+    size = fingerprint['size']
+    workers = workers or os.cpu_count() or 1
+
+    with open(path, 'rb') as f:
+        ranges = split_ranges(f, size) if size else []
+
+    pieces = {}
+    counts = {}
+    cp_lines = array('Q')
+    cp_offsets = array('Q')
+    total_lines = 0
+
+    def merge(result, stop):
+        nonlocal total_lines
+        lines, compressed, chunk_cp_lines, chunk_cp_offsets = result
+        for token, (count, data, raw) in compressed.items():
+            length = len(data) | RAW_PIECE if raw else len(data)
+            pieces.setdefault(token, []).append(PIECE_HEADER.pack(total_lines, count, length) + data)
+            counts[token] = counts.get(token, 0) + count
+        cp_lines.extend(total_lines + n for n in chunk_cp_lines)
+        cp_offsets.extend(chunk_cp_offsets)
+        total_lines += lines
+        if progress is not None:
+            progress(stop, size)
+
+    if workers > 1 and size >= PARALLEL_MIN_SIZE:
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        pending = deque()
+        try:
+            for start, stop in ranges:
+                pending.append((pool.submit(_index_range, path, start, stop), stop))
+                if len(pending) >= workers * 2:
+                    future, done = pending.popleft()
+                    merge(future.result(), done)
+                    if cancelled is not None and cancelled():
+                        return None
+            while pending:
+                future, done = pending.popleft()
+                merge(future.result(), done)
+                if cancelled is not None and cancelled():
+                    return None
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+    else:
+        for start, stop in ranges:
+            merge(_index_range(path, start, stop), stop)
+            if cancelled is not None and cancelled():
+                return None
+
+    # 建立索引期间文件被修改则放弃，避免写入与文件不符的索引
+    if file_fingerprint(path) != fingerprint:
+        raise OSError(f"建立索引期间文件发生了变化: {path}")
+
+    vocabulary = sorted(pieces)
+    sections = {}
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    target = index_path(path)
+    temp = f"{target}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as out:
+        def write_section(name, data):
+            sections[name] = [out.tell(), len(data)]
+            out.write(data)
+
+        # 先写入定长的占位头部，各段写完后再回填
+        header_size = 4096
+        out.write(b'\0' * header_size)
+        write_section('vocab', b'\n'.join(vocabulary))
+        vocab_starts = array('Q', itertools.accumulate((len(t) + 1 for t in vocabulary), initial=0))
+        write_section('vocab_starts', vocab_starts.tobytes())
+        write_section('counts', array('Q', (counts[t] for t in vocabulary)).tobytes())
+        directory = array('Q', [0])
+        postings_start = out.tell()
+        for token in vocabulary:
+            for piece in pieces[token]:
+                out.write(piece)
+            directory.append(out.tell() - postings_start)
+        sections['postings'] = [postings_start, out.tell() - postings_start]
+        write_section('directory', directory.tobytes())
+        write_section('cp_lines', cp_lines.tobytes())
+        write_section('cp_offsets', cp_offsets.tobytes())
+        index_size = out.tell()
+
+        header = json.dumps({
+            'version': INDEX_VERSION,
+            'path': os.path.realpath(path),
+            'fingerprint': fingerprint,
+            'encoding': encoding,
+            'byteorder': sys.byteorder,
+            'lines': total_lines,
+            'tokens': len(vocabulary),
+            'sections': sections,
+        }).encode('utf-8')
+        if len(INDEX_MAGIC) + 4 + len(header) > header_size:
+            raise ValueError("索引头部过大")
+        out.seek(0)
+        out.write(INDEX_MAGIC + struct.pack('<I', len(header)) + header)
+    os.replace(temp, target)
+
+    return {'path': path, 'index_path': target, 'lines': total_lines, 'tokens': len(vocabulary),
+            'file_size': size, 'index_size': index_size, 'elapsed': time.monotonic() - started}
+
+
+def remove_index(path):
+    """ 删除文件的索引，返回是否存在 """
+    try:
+        os.remove(index_path(path))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class LogIndex:
+    """ 打开的索引文件，用 open_index() 获得 """
+
+    def __init__(self, path, index_file):
+        self.path = path
+        self._file = open(index_file, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise
+        if self._mm[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self.close()
+            raise ValueError("不是有效的索引文件")
+        (length,) = struct.unpack_from('<I', self._mm, len(INDEX_MAGIC))
+        start = len(INDEX_MAGIC) + 4
+        self.header = json.loads(self._mm[start:start + length])
+        self.encoding = self.header['encoding']
+        self.lines = self.header['lines']
+        self._vocab = self._section('vocab')
+        self._vocab_starts = self._array('vocab_starts')
+        self._counts = self._array('counts')
+        self._directory = self._array('directory')
+        self._postings_start = self.header['sections']['postings'][0]
+        self._cp_lines = self._array('cp_lines')
+        self._cp_offsets = self._array('cp_offsets')
+
+    def _section(self, name):
+        start, length = self.header['sections'][name]
+        return self._mm[start:start + length]
+
+    def _array(self, name):
+        values = array('Q')
+        values.frombytes(self._section(name))
+        return values
+
+    def is_fresh(self):
+        """ 索引是否与文件当前内容一致 """
+        header = self.header
+        if header.get('version') != INDEX_VERSION or header.get('byteorder') != sys.byteorder:
+            return False
+        try:
+            return file_fingerprint(self.path) == header['fingerprint']
+        except OSError:
+            return False
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _tokens_containing(self, part):
+        """ 返回词表中包含 part 的词的序号 """
+        vocab = self._vocab
+        starts = self._vocab_starts
+        found = []
+        i = vocab.find(part)
+        while i >= 0:
+            token = bisect.bisect_right(starts, i) - 1
+            found.append(token)
+            # 同一个词只需找到一次
+            i = vocab.find(part, starts[token + 1])
+        return found
+
+    def _lines_of(self, token):
+        """ 解压一个词的倒排表，依次返回行号(从0开始) """
+        start = self._postings_start + self._directory[token]
+        stop = self._postings_start + self._directory[token + 1]
+        mm = self._mm
+        pos = start
+        while pos < stop:
+            base, count, length = PIECE_HEADER.unpack_from(mm, pos)
+            pos += PIECE_HEADER.size
+            raw = length & RAW_PIECE
+            length &= ~RAW_PIECE
+            data = mm[pos:pos + length]
+            deltas = array('I')
+            deltas.frombytes(data if raw else zlib.decompress(data))
+            pos += length
+            yield from itertools.islice(itertools.accumulate(deltas, initial=base), 1, None)
+
+    def _keyword_parts(self, keyword, case_sensitive):
+        """ 关键词按词的规则切成若干段，无法用索引时返回 None """
+        if not case_sensitive and any(ord(c) > 127 and c.lower() != c.upper() for c in keyword):
+            # 索引只对 ASCII 字母做了大小写折叠
+            return None
+        try:
+            raw = keyword.encode(self.encoding)
+        except UnicodeEncodeError:
+            # 该编码无法表示的关键词不可能出现在文件中
+            return []
+        return TOKEN_RE.findall(raw.lower()) or None
+
+    def _keyword_lines(self, keyword, case_sensitive, limit):
+        """
+        包含关键词的候选行号集合。
+
+        关键词的每一段都要出现，取各段候选的交集；从最少的一段开始。
+        候选数超过 limit 的段不参与计算，全部超过时返回 None 表示索引帮助不大。
+        """
+        parts = self._keyword_parts(keyword, case_sensitive)
+        if parts is None:
+            return None
+        if not parts:
+            return set()
+        estimates = []
+        for part in set(parts):
+            tokens = self._tokens_containing(part)
+            estimates.append((sum(self._counts[t] for t in tokens), tokens))
+        estimates.sort(key=lambda item: item[0])
+        result = None
+        for estimate, tokens in estimates:
+            if estimate > limit:
+                break
+            lines = set()
+            for token in tokens:
+                lines.update(self._lines_of(token))
+            result = lines if result is None else result & lines
+            if not result:
+                break
+        return result
+
+    def _group_lines(self, group, case_sensitive, limit):
+        """ 包含一组字面量中任一个的候选行号集合，无法缩小范围时返回 None """
+        result = set()
+        for keyword in group:
+            lines = self._keyword_lines(keyword, case_sensitive, limit)
+            if lines is None:
+                return None
+            result |= lines
+            if len(result) > limit:
+                return None
+        return result
+
+    def candidates(self, terms, case_sensitive):
+        """
+        返回可能匹配的行号(从0开始)升序列表；索引无法缩小范围时返回 None，应改为扫描。
+
+        terms 见 KeywordMatcher.index_terms(): 每组字面量至少出现其一，各组都要满足。
+        """
+        limit = max(int(self.lines * MAX_CANDIDATE_RATIO), 1)
+        result = None
+        for group in terms:
+            lines = self._group_lines(group, case_sensitive, limit)
+            if lines is None:
+                # 其他组仍可缩小范围
+                continue
+            result = lines if result is None else result & lines
+            if not result:
+                return []
+        return None if result is None else sorted(result)
+
+    def read_lines(self, mm, line_numbers):
+        """ 从映射的日志文件中依次读取指定行，返回(行号, 偏移, 原始字节) """
+        cp_lines = self._cp_lines
+        cp_offsets = self._cp_offsets
+        current_line = -1
+        current_pos = 0
+        size = len(mm)
+        for line_number in line_numbers:
+            if current_line < 0 or line_number < current_line or \
+                    line_number - current_line > CHECKPOINT_INTERVAL:
+                # 从最近的记录点开始向后查找
+                i = bisect.bisect_right(cp_lines, line_number) - 1
+                current_line = cp_lines[i]
+                current_pos = cp_offsets[i]
+            while current_line < line_number:
+                current_pos = mm.find(b'\n', current_pos) + 1
+                current_line += 1
+            end = mm.find(b'\n', current_pos)
+            end = size if end < 0 else end + 1
+            yield line_number, current_pos, mm[current_pos:end]
+
+
+# 打开文件的索引，不存在或无法读取时返回 None；是否过期由 is_fresh() 判断
+def open_index(path):
+    index_file = index_path(path)
+    if not os.path.exists(index_file):
+        return None
+    try:
+        return LogIndex(path, index_file)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def search_index(index, searcher, f, encoding, stats, progress=None):
+    """ 用索引搜索已打开的文件: 只读取候选行，交给 matcher 确认，依次返回 Match """
+    terms = searcher.matcher.index_terms()
+    if terms is None:
+        return None
+    candidates = index.candidates(terms, searcher.case_sensitive)
+    if candidates is None:
+        return None
+    return _read_candidates(index, searcher, f, encoding, candidates, stats, progress)
+
+
+def _read_candidates(index, searcher, f, encoding, candidates, stats, progress):
+    match_line = searcher.matcher.match
+    stats.total_lines = index.lines
+    if not candidates:
+        stats.lines_scanned = index.lines
+        stats.bytes_scanned = stats.file_size
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for count, (line_number, offset, raw) in enumerate(index.read_lines(mm, candidates), 1):
+            if searcher._cancelled:
+                stats.cancelled = True
+                return
+            line = decode_line(raw, encoding, stats)
+            mask = match_line(line)
+            if mask:
+                yield Match(line_number + 1, offset, len(raw), mask, line.rstrip('\r\n'), stats.path)
+            if progress is not None and count % searcher.progress_interval == 0:
+                stats.lines_scanned = line_number
+                stats.bytes_scanned = offset
+                progress(stats)
+    stats.lines_scanned = index.lines
+    stats.bytes_scanned = stats.file_size
+
+
+# 建立索引的报告: 文件名、行数、词数、索引大小和耗时
+def format_index_info(info):
+    return (f"已建立索引 {os.path.basename(info['path'])}: {info['lines']} 行，{info['tokens']} 个词，"
+            f"索引 {info['index_size'] / 1024 / 1024:.2f} MB"
+            f"(文件 {info['file_size'] / 1024 / 1024:.2f} MB)，耗时 {info['elapsed']:.2f} 秒")
@@ -1,13 +1,29 @@
 import os
+import re
 import sys
-import codecs
+import time
+import multiprocessing
+from array import array
 import pyperclip
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QPushButton, QLabel, QComboBox, 
-                            QLineEdit, QTextEdit, QFileDialog, QMessageBox,
-                            QDialog, QListWidget, QCheckBox)  # 添加 QCheckBox
-from PyQt5.QtCore import Qt, QMimeData
-from PyQt5.QtGui import QDragEnterEvent, QDropEvent
+                            QLineEdit, QPlainTextEdit, QFileDialog, QMessageBox,
+                            QDialog, QListWidget, QTableView, QHeaderView, QCheckBox,
+                            QAction, QAbstractItemView, QProgressBar, QSpinBox,
+                            QTableWidget, QTableWidgetItem)
+from PyQt5.QtCore import (Qt, QMimeData, QObject, QThread, QAbstractListModel, QModelIndex,
+                          pyqtSignal, pyqtSlot)
+from PyQt5.QtGui import QColor, QDragEnterEvent, QDropEvent, QKeySequence, QPainter
+from search import (LogSearcher, MAX_RESULTS, PROGRESS_INTERVAL, Progress, ResultStore, SearchCache,
+                    compile_regex, detect_compression, detect_encoding, format_file_stats,
+                    format_keyword_counts, format_progress, iter_log_files, parse_keywords)
+from log_index import build_index, format_index_info, remove_index
+from log_follow import follow, followers_for
+from query import QueryError, combine_query, parse_query, query_terms
+from records import RECORD_MAX_SIZE, RECORD_START
+from time_window import TimeWindow
+from histogram import format_duration, format_time, text_seconds
+from export import open_export
 
 # 获取资源文件路径的辅助函数
 def resource_path(relative_path):
@@ -140,12 +156,605 @@ class KeywordDialog(QDialog):
     def get_keywords(self):
         return self.keywords
 
+class KeywordStatsDialog(QDialog):
+    """ 关键词命中统计: 两两同时命中的行数矩阵(对角线为各关键词的命中行数)和命中组合 """
+
+    def __init__(self, counts, result_count, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('关键词统计')
+        self.resize(600, 500)
+        keywords = counts.keywords
+        total = counts.total
+        
+        layout = QVBoxLayout()
+        text = f"共 {total} 行匹配"
+        if total > result_count:
+            text += f"，其中 {total - result_count} 行超出结果数上限没有显示"
+        layout.addWidget(QLabel(text))
+        
+        # 同时命中的行数矩阵
+        matrix = counts.matrix()
+        matrix_table = QTableWidget(len(keywords), len(keywords))
+        matrix_table.setHorizontalHeaderLabels(keywords)
+        matrix_table.setVerticalHeaderLabels(keywords)
+        matrix_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        for i, row in enumerate(matrix):
+            for j, count in enumerate(row):
+                item = QTableWidgetItem(str(count))
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                if i == j:
+                    font = item.font()
+                    font.setBold(True)
+                    item.setFont(font)
+                matrix_table.setItem(i, j, item)
+        matrix_table.resizeColumnsToContents()
+        layout.addWidget(QLabel('同时命中的行数(对角线为各关键词的命中行数):'))
+        layout.addWidget(matrix_table, 1)
+        
+        # 各命中组合的行数，行数多的在前
+        combinations = counts.combinations()
+        combination_table = QTableWidget(len(combinations), 2)
+        combination_table.setHorizontalHeaderLabels(['命中组合', '行数'])
+        combination_table.verticalHeader().hide()
+        combination_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        combination_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for row, (mask, count) in enumerate(combinations):
+            names = [k for i, k in enumerate(keywords) if mask >> i & 1]
+            combination_table.setItem(row, 0, QTableWidgetItem(' + '.join(names) or '(不含关键词)'))
+            item = QTableWidgetItem(str(count))
+            item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            combination_table.setItem(row, 1, item)
+        layout.addWidget(QLabel('命中组合:'))
+        layout.addWidget(combination_table, 1)
+        
+        close_button = QPushButton('关闭')
+        close_button.clicked.connect(self.accept)
+        layout.addWidget(close_button)
+        self.setLayout(layout)
+
+# 文件信息: 单个文件显示大小和压缩格式，多个文件显示数量和总大小
+def format_file_info(file_count, total_size, compression=None):
+    if file_count > 1:
+        return f"文件数量: {file_count}，总大小: {total_size / 1024 / 1024:.2f} MB"
+    file_info = f"文件大小: {total_size / 1024 / 1024:.2f} MB"
+    if compression:
+        # 压缩文件边解压边搜索，不会在磁盘上生成解压后的文件
+        file_info += f" ({compression} 压缩)"
+    return file_info
+
+class SearchWorker(QObject):
+    """
+    在后台线程中执行日志搜索，通过信号把结果分批送回界面。
+
+    匹配结果和状态信息走不同的信号: results 只包含 Match，message 只用于显示，
+    progress 按固定的间隔送回进度快照(Progress)，结束时 finished 送回统计信息
+    (SearchStats)，由界面自行格式化。
+
+    follow 为真时搜索完成后继续跟踪文件新增的内容，此时先发送 following，
+    取消后才发送 finished。
+    """
+    message = pyqtSignal(str)     # 搜索条件等状态信息
+    progress = pyqtSignal(object) # 进度快照(Progress)，最多每 PROGRESS_INTERVAL 秒一次
+    files = pyqtSignal(list)      # 实际要搜索的文件列表，在结果之前发送
+    results = pyqtSignal(list)    # 一批匹配结果(Match)
+    finished = pyqtSignal(dict)   # 搜索结束(完成、取消或出错)，见 run()
+    following = pyqtSignal(dict)  # 首次搜索完成、开始跟踪新增内容，内容同 finished
+    replaced = pyqtSignal(str, object)  # 跟踪的文件被轮转(路径, 旧文件)或截断(路径, None)
+
+    # 每批最多发送的结果数和最长间隔(秒)
+    batch_size = 5000
+    batch_interval = 0.1
+
+    def __init__(self, paths, keywords, is_and_mode, is_case_sensitive, max_results=MAX_RESULTS,
+                 include=None, exclude=None, cache=None, follow=False, regex=False, query=None,
+                 context=0, record_start=None, time_window=None):
+        super().__init__()
+        self.paths = paths
+        self.include = include
+        self.exclude = exclude
+        self.follow = follow
+        self.searcher = LogSearcher(keywords, is_and_mode, is_case_sensitive, max_results, cache=cache,
+                                    regex=regex, query=query, before_context=context,
+                                    after_context=context, record_start=record_start,
+                                    time_window=time_window, histogram=True, keyword_counts=True)
+        self._reported = {}         # 各文件最后一个结果的偏移，跟踪时不再重复返回
+        self._cancelled = False
+
+    def cancel(self):
+        """ 请求停止搜索(可从界面线程调用) """
+        self._cancelled = True
+        self.searcher.cancel()
+
+    @pyqtSlot()
+    def run(self):
+        # files: 搜索的文件列表；stats: 汇总统计；file_stats: 各文件的统计；error: 出错信息；
+        # followed: 跟踪期间新增的结果数，没有跟踪时为 None；plan: 查询表达式的求值顺序
+        summary = {'files': [], 'stats': None, 'file_stats': [], 'error': None, 'followed': None,
+                   'plan': None}
+        try:
+            self._search(summary)
+            stats = summary['stats']
+            if (self.follow and stats is not None and not summary['error']
+                    and not stats.cancelled and not stats.limit_reached):
+                self.following.emit(dict(summary))
+                self._follow(summary)
+        except Exception as e:
+            summary['error'] = f"读取文件时出错: {e}"
+        self.finished.emit(summary)
+
+    def _follow(self, summary):
+        """ 跟踪各文件新增的内容直到取消，新的结果逐块送回界面 """
+        searcher = self.searcher
+        if searcher.record_start is not None:
+            # 新增的内容可能还是上一条记录的续行，按块跟踪无法判断记录是否已结束
+            self.message.emit("多行记录模式下不跟踪新增内容")
+            return
+        if searcher.time_window is not None and searcher.time_window.end_text:
+            # 新增的内容都晚于结束时间
+            self.message.emit("指定了结束时间，不跟踪新增内容")
+            return
+        followers = followers_for(searcher, summary['file_stats'], self._reported)
+        if not followers:
+            self.message.emit("没有可以跟踪的文件(压缩文件不跟踪)")
+            return
+        self.message.emit(f"正在跟踪 {len(followers)} 个文件的新增内容，点击取消停止跟踪")
+        max_results = searcher.max_results
+        total = summary['stats'].result_count
+        summary['followed'] = 0
+        for matches in follow(followers, lambda: self._cancelled, self.replaced.emit):
+            # 上下文行不计入结果数
+            count = 0
+            for i, match in enumerate(matches):
+                if match.mask:
+                    count += 1
+                    if max_results and total + count >= max_results:
+                        matches = matches[:i + 1]
+                        break
+            self.results.emit(matches)
+            total += count
+            summary['followed'] += count
+            if max_results and total >= max_results:
+                self.message.emit(f"已达到最大结果数限制({max_results})，停止跟踪。")
+                break
+
+    def _search(self, summary):
+        searcher = self.searcher
+        keywords = searcher.keywords
+        is_and_mode = searcher.and_mode
+
+        files = list(iter_log_files(self.paths, self.include, self.exclude))
+        if not files:
+            summary['error'] = "没有找到要搜索的文件"
+            return
+        multiple = len(files) > 1
+        summary['files'] = files
+        self.files.emit(files)
+
+        encoding = None
+        if not multiple:
+            self.message.emit("正在检测文件编码...")
+            encoding = detect_encoding(files[0])
+            if encoding is None:
+                summary['error'] = f"无法以支持的编码格式打开文件 {files[0]}"
+                return
+            self.message.emit(f"使用 {encoding} 编码成功打开文件\n")
+
+        # 添加搜索模式信息
+        if searcher.query is not None:
+            mode_info = f"查询表达式: {searcher.query}\n"
+        else:
+            mode_info = f"搜索模式: {'与模式(必须包含所有关键词)' if is_and_mode else '或模式(包含任一关键词即可)'}\n"
+        mode_info += f"大小写敏感: {'是' if searcher.case_sensitive else '否'}\n"
+        if searcher.regex:
+            mode_info += "关键词为正则表达式\n"
+        if searcher.record_start is not None:
+            mode_info += f"多行记录模式: 以匹配 {searcher.record_start} 的行开始一条记录，按整条记录匹配\n"
+        elif searcher.before_context:
+            mode_info += f"同时显示每个匹配前后各 {searcher.before_context} 行(灰色)\n"
+        if searcher.time_window is not None:
+            mode_info += f"时间范围: {searcher.time_window}\n"
+        self.message.emit(mode_info)
+
+        # 添加关键词信息 - 优化显示格式
+        if searcher.query is None:
+            keywords_str = "', '".join(keywords)
+            keywords_info = f"搜索条件: {len(keywords)}个关键词 ['{keywords_str}']\n"
+            if is_and_mode and len(keywords) > 1:
+                keywords_info += f"匹配规则: 必须同时包含所有关键词\n"
+            elif not is_and_mode and len(keywords) > 1:
+                keywords_info += f"匹配规则: 包含任一关键词即可\n"
+            self.message.emit(keywords_info)
+
+        # 添加文件信息
+        total_size = sum(os.path.getsize(path) for path in files if os.path.isfile(path))
+        compression = None if multiple else detect_compression(files[0])
+        self.message.emit(format_file_info(len(files), total_size, compression))
+        self.message.emit("开始搜索...")
+
+        batch = []
+        last_emit = time.monotonic()
+        last_progress = 0.0
+
+        def report_progress(stats):
+            nonlocal batch, last_emit, last_progress
+            # 顺便送出积压的结果
+            now = time.monotonic()
+            if batch:
+                self.results.emit(batch)
+                batch = []
+                last_emit = now
+            # 进度按固定的间隔发送，与扫描了多少行无关
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                self.progress.emit(stats.snapshot())
+
+        reported = self._reported
+        for match in searcher.search_files(files, encoding, report_progress):
+            batch.append(match)
+            reported[match.path] = match.offset
+
+            # 攒够一批或间隔足够长时把结果送回界面
+            now = time.monotonic()
+            if len(batch) >= self.batch_size or now - last_emit >= self.batch_interval:
+                self.results.emit(batch)
+                batch = []
+                last_emit = now
+
+        if batch:
+            self.results.emit(batch)
+        if searcher.query is not None:
+            # 按样本估计的命中率调整后的求值顺序
+            summary['plan'] = searcher.matcher.describe()
+
+        summary['stats'] = searcher.stats
+        summary['file_stats'] = searcher.file_stats
+
+class ExportWorker(QObject):
+    """
+    在后台线程中按上次搜索的条件重新扫描，把结果直接写入文件: 不经过结果列表，
+    也不受界面显示的结果数上限限制
+    """
+    message = pyqtSignal(str)
+    progress = pyqtSignal(object) # 进度快照(Progress)
+    finished = pyqtSignal(list)   # 导出报告
+
+    def __init__(self, output, paths, keywords, is_and_mode, is_case_sensitive, include=None,
+                 exclude=None, regex=False, query=None, context=0, record_start=None,
+                 time_window=None):
+        super().__init__()
+        self.output = output
+        self.paths = paths
+        self.include = include
+        self.exclude = exclude
+        self.searcher = LogSearcher(keywords, is_and_mode, is_case_sensitive, 0, regex=regex,
+                                    query=query, before_context=context, after_context=context,
+                                    record_start=record_start, time_window=time_window)
+
+    def cancel(self):
+        self.searcher.cancel()
+
+    @pyqtSlot()
+    def run(self):
+        reports = []
+        try:
+            self._export(reports)
+        except Exception as e:
+            reports.append(f"导出时出错: {e}")
+        self.finished.emit(reports)
+
+    def _export(self, reports):
+        searcher = self.searcher
+        files = list(iter_log_files(self.paths, self.include, self.exclude))
+        if not files:
+            reports.append("没有找到要搜索的文件")
+            return
+        last_progress = 0.0
+
+        def report_progress(stats):
+            nonlocal last_progress
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                self.progress.emit(stats.snapshot())
+
+        self.message.emit(f"正在把结果导出到 {self.output}...")
+        with open_export(self.output, keywords=searcher.keywords, show_path=len(files) > 1,
+                         context=bool(searcher.before_context)) as writer:
+            for match in searcher.search_files(files, progress=report_progress):
+                writer.write(match)
+        stats = searcher.stats
+        size = os.path.getsize(self.output)
+        if stats.cancelled:
+            reports.append(f"导出已取消，已写入 {writer.count} 个结果")
+        else:
+            reports.append(f"已把 {writer.count} 个结果导出到 {self.output}")
+        reports.append(f"文件大小 {size / 1024 / 1024:.2f} MB，耗时 {stats.elapsed:.2f} 秒，"
+                       f"平均 {stats.throughput:.1f} MB/s")
+
+class IndexWorker(QObject):
+    """ 在后台线程中为选中的文件建立索引，之后搜索这些文件时只读取候选行 """
+    message = pyqtSignal(str)
+    progress = pyqtSignal(object) # 当前文件的进度快照(Progress)
+    finished = pyqtSignal(list)   # 各文件的索引报告
+
+    def __init__(self, paths, include=None, exclude=None):
+        super().__init__()
+        self.paths = paths
+        self.include = include
+        self.exclude = exclude
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @pyqtSlot()
+    def run(self):
+        reports = []
+        try:
+            for path in iter_log_files(self.paths, self.include, self.exclude):
+                if self._cancelled:
+                    break
+                name = os.path.basename(path)
+                if detect_compression(path) is not None:
+                    reports.append(f"{name}: 压缩文件不建立索引")
+                    continue
+                self.message.emit(f"正在为 {name} 建立索引...")
+                started = time.monotonic()
+                try:
+                    info = build_index(path, progress=lambda done, total: self.progress.emit(
+                        Progress(done, total, 0, 0, time.monotonic() - started, 0)),
+                        cancelled=lambda: self._cancelled)
+                except (OSError, UnicodeError) as e:
+                    reports.append(f"{name}: 建立索引失败 - {e}")
+                    continue
+                if info is not None:
+                    reports.append(format_index_info(info))
+        except Exception as e:
+            reports.append(f"建立索引时出错: {e}")
+        if self._cancelled:
+            reports.append("已取消建立索引")
+        self.finished.emit(reports)
+
+class ResultListModel(QAbstractListModel):
+    """
+    搜索结果列表模型: 视图只请求可见的行，行内容按需从 ResultStore 读取。
+
+    可以只显示某个时间段内的结果(set_time_filter)，此时视图中的行号经 _store_row()
+    换算为 ResultStore 中的下标。各行行首时间戳对应的秒数在加入时记下，筛选时不必
+    读取文件。
+    """
+
+    # 缓存最近显示过的行，来回滚动时不必反复读文件
+    cache_size = 2000
+    context_color = QColor(Qt.gray)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.store = ResultStore()
+        self.multiple_files = False
+        self._rows = 0
+        self._cache = {}
+        # 各行行首时间戳的秒数(见 histogram.text_seconds)，上下文行和没有时间戳的行为 -1
+        self._times = array('q')
+        self._time_key = None
+        self._time_seconds = -1
+        # 按时间段筛选时显示的行在 ResultStore 中的下标
+        self.time_filter = None
+        self._shown = None
+
+    def rowCount(self, parent=QModelIndex()):
+        # 视图会频繁调用，直接返回记录的行数
+        return 0 if parent.isValid() else self._rows
+
+    def _store_row(self, row):
+        return row if self._shown is None else self._shown[row]
+
+    def data(self, index, role=Qt.DisplayRole):
+        # 上下文行(不匹配的行)用灰色显示
+        if role == Qt.ForegroundRole and index.isValid():
+            return None if self.store.mask(self._store_row(index.row())) else self.context_color
+        # 过长的行在列表中截断显示，悬停提示中显示完整内容
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole) or not index.isValid():
+            return None
+        row = self._store_row(index.row())
+        text = self._cache.get(row)
+        if text is None:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            text = self._cache[row] = self.format_result(self.store[row])
+        if role == Qt.DisplayRole and '\n' in text:
+            # 多行记录在列表中只显示首行，悬停提示和复制时是完整的记录
+            first, rest = text.split('\n', 1)
+            more = rest.count('\n') + 1
+            return f"{first.rstrip()}  (另有 {more} 行)"
+        return text
+
+    def format_result(self, match):
+        # 不再限制行长度，显示完整内容；多个文件时标明来源
+        if self.multiple_files:
+            return f"[{os.path.basename(match.path)}:{match.line_number}] {match.text.strip()}"
+        return match.text.strip()
+
+    def clear(self):
+        self.beginResetModel()
+        self.store.close()
+        self.store = ResultStore()
+        self.multiple_files = False
+        self._rows = 0
+        self._cache.clear()
+        self._times = array('q')
+        self._time_key = None
+        self.time_filter = self._shown = None
+        self.endResetModel()
+
+    def append(self, matches):
+        if not matches:
+            return
+        self._times.extend(self._match_time(match) for match in matches)
+        if self._shown is not None:
+            # 按时间段筛选时新的结果(跟踪新增内容)只显示落在该时间段内的
+            first = len(self.store)
+            self.store.extend(matches)
+            start, end = self.time_filter
+            rows = [row for row in range(first, len(self.store)) if start <= self._times[row] < end]
+            if rows:
+                self.beginInsertRows(QModelIndex(), self._rows, self._rows + len(rows) - 1)
+                self._shown.extend(rows)
+                self._rows = len(self._shown)
+                self.endInsertRows()
+            return
+        first = self._rows
+        self.beginInsertRows(QModelIndex(), first, first + len(matches) - 1)
+        self.store.extend(matches)
+        self._rows = len(self.store)
+        self.endInsertRows()
+
+    def set_encodings(self, encodings):
+        """ 搜索结束后记录各文件实际使用的编码 """
+        for path, encoding in encodings.items():
+            self.store.set_encoding(path, encoding)
+        self._cache.clear()
+
+    def lines(self, rows=None):
+        """ 返回视图中指定行(默认全部)的显示内容 """
+        if rows is None:
+            rows = range(self._rows)
+        return [self.format_result(self.store[self._store_row(row)]) for row in rows]
+
+    def _match_time(self, match):
+        """ 匹配行行首时间戳的秒数，上下文行和没有时间戳的行返回 -1 """
+        if not match.mask:
+            return -1
+        # 同一秒内的结果前缀相同，不必重复解析
+        key = match.text[:20]
+        if key != self._time_key:
+            seconds = text_seconds(match.text)
+            self._time_key = key
+            self._time_seconds = -1 if seconds is None else seconds
+        return self._time_seconds
+
+    def set_time_filter(self, start=None, end=None):
+        """
+        只显示行首时间戳在 [start, end) 秒(见 histogram.text_seconds)之内的匹配行，
+        start 为空时取消筛选。逐行比较加入时记下的秒数，多个文件的结果或不按时间
+        顺序写入的日志也能正确筛选；上下文行不显示，行数与柱条的结果数一致。
+        """
+        self.beginResetModel()
+        self._cache.clear()
+        if start is None:
+            self.time_filter = self._shown = None
+            self._rows = len(self.store)
+        else:
+            self.time_filter = (start, end)
+            self._shown = array('Q', (row for row, seconds in enumerate(self._times)
+                                      if start <= seconds < end))
+            self._rows = len(self._shown)
+        self.endResetModel()
+
+
+class HistogramView(QWidget):
+    """
+    结果按时间分布的条形图(histogram.TimeHistogram)，相邻的时间段按宽度合并显示。
+    悬停显示时间段和结果数；点击一根柱条发出 bucket_clicked(开始秒数, 结束秒数)，
+    再次点击选中的柱条发出 bucket_clicked(None, None)。
+    """
+    bucket_clicked = pyqtSignal(object, object)
+
+    bar_color = QColor('#4CAF50')
+    selected_color = QColor('#1565C0')
+    # 每根柱条至少占的像素宽度
+    min_bar_width = 4
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.histogram = None
+        self.selected = None        # 选中的时间段(开始秒数, 结束秒数)
+        self._step = 0
+        self._counts = []
+        self.setMouseTracking(True)
+        self.setFixedHeight(60)
+
+    def set_histogram(self, histogram):
+        if histogram is not self.histogram:
+            self.histogram = histogram
+            self.selected = None
+        self.refresh()
+
+    def refresh(self):
+        """ 分布中的计数有变化(如跟踪到新的结果)后重新合并和绘制，选中的时间段不变 """
+        self._rebin()
+        self.update()
+
+    def resizeEvent(self, event):
+        self._rebin()
+        super().resizeEvent(event)
+
+    def _rebin(self):
+        if self.histogram is None:
+            self._step, self._counts = 0, []
+        else:
+            self._step, self._counts = self.histogram.rebin(self.width() // self.min_bar_width)
+
+    def _bucket_at(self, x):
+        """ x 坐标处柱条的时间段(开始秒数, 结束秒数, 结果数)，没有时返回 None """
+        if not self._counts or self.width() <= 0:
+            return None
+        i = min(int(x * len(self._counts) / self.width()), len(self._counts) - 1)
+        start, end = self.histogram.bucket_range(i, self._step // self.histogram.step)
+        return start, end, self._counts[i]
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+        if not self._counts:
+            return
+        peak = max(self._counts) or 1
+        width = self.width() / len(self._counts)
+        height = self.height() - 2
+        origin = self.histogram.origin
+        for i, count in enumerate(self._counts):
+            if not count:
+                continue
+            start = origin + i * self._step
+            selected = self.selected is not None and self.selected[0] <= start < self.selected[1]
+            bar = max(1, round(count / peak * height))
+            painter.fillRect(int(i * width), self.height() - bar, max(1, int(width) - 1), bar,
+                             self.selected_color if selected else self.bar_color)
+
+    def mouseMoveEvent(self, event):
+        bucket = self._bucket_at(event.x())
+        if bucket is None:
+            self.setToolTip('')
+            return
+        start, end, count = bucket
+        self.setToolTip(f"{format_time(start, self._step)} 起 {format_duration(self._step)}: "
+                        f"{count} 个结果")
+
+    def mousePressEvent(self, event):
+        bucket = self._bucket_at(event.x())
+        if event.button() != Qt.LeftButton or bucket is None:
+            return
+        start, end, count = bucket
+        if self.selected == (start, end) or not count:
+            self.selected = None
+            self.bucket_clicked.emit(None, None)
+        else:
+            self.selected = (start, end)
+            self.bucket_clicked.emit(start, end)
+        self.update()
+
 class LogSearchTool(QMainWindow):
     def __init__(self):
         super().__init__()
         self.initUI()
-        self.log_file_path = ""
-        self.search_results = ""
+        self.log_paths = []
+        self.search_keywords = []
+        self.search_query = None
+        self.result_count = 0
+        self.search_thread = None
+        self.search_worker = None
+        # 再次搜索仍在增长的日志时只搜索新增的部分
+        self.search_cache = SearchCache()
         
     # 在 LogSearchTool 类中添加 container_clicked 方法
     def container_clicked(self, event):
@@ -169,7 +778,7 @@ class LogSearchTool(QMainWindow):
         file_layout.setSpacing(10)
         
         # 添加提示标签 - 将用于显示文件路径
-        self.drop_label = QLabel('点击此区域选择文件或直接拖放文件到此处')
+        self.drop_label = QLabel('点击此区域选择文件或直接拖放文件/目录到此处(可多选)')
         self.drop_label.setAlignment(Qt.AlignCenter)
         self.drop_label.setWordWrap(True)  # 允许文本换行
         
@@ -198,6 +807,26 @@ class LogSearchTool(QMainWindow):
         # 使容器可点击
         self.file_container.mousePressEvent = self.container_clicked
         
+        # 目录搜索选项: 选择目录按钮和文件名过滤
+        dir_layout = QHBoxLayout()
+        self.browse_dir_button = QPushButton('选择目录')
+        self.browse_dir_button.clicked.connect(self.browse_directory)
+        # 为反复搜索的大文件建立索引，之后的搜索只读取候选行
+        self.build_index_button = QPushButton('建立索引')
+        self.build_index_button.clicked.connect(self.build_log_index)
+        self.remove_index_button = QPushButton('删除索引')
+        self.remove_index_button.clicked.connect(self.remove_log_index)
+        self.include_pattern = QLineEdit()
+        self.include_pattern.setPlaceholderText('包含文件(如 *.log *.log.*)，默认全部')
+        self.exclude_pattern = QLineEdit()
+        self.exclude_pattern.setPlaceholderText('排除文件(如 *.gz)')
+        dir_layout.addWidget(self.browse_dir_button)
+        dir_layout.addWidget(QLabel('目录中:'))
+        dir_layout.addWidget(self.include_pattern)
+        dir_layout.addWidget(self.exclude_pattern)
+        dir_layout.addWidget(self.build_index_button)
+        dir_layout.addWidget(self.remove_index_button)
+        
         # 关键词选择区域
         keyword_layout = QVBoxLayout()
         
@@ -260,6 +889,20 @@ class LogSearchTool(QMainWindow):
         
         # 添加大小写敏感选项
         self.case_sensitive = QCheckBox('区分大小写')
+        # 关键词按正则表达式匹配(此时只按空白分隔多个表达式)
+        self.regex_check = QCheckBox('正则表达式')
+        # 自定义关键词作为布尔查询表达式，选中的预设关键词按与/或模式与之组合
+        self.query_check = QCheckBox('查询表达式')
+        self.query_check.setToolTip('支持 AND/OR/NOT、括号和引号短语，'
+                                    '如 (timeout OR refused) AND NOT healthcheck')
+        self.query_check.toggled.connect(self.on_query_toggled)
+        # 搜索完成后继续跟踪文件新增的内容，直到点击取消
+        self.follow_check = QCheckBox('跟踪新增内容')
+        # 同时显示每个匹配前后的若干行(类似 grep -C)
+        self.context_label = QLabel('上下文行数:')
+        self.context_spin = QSpinBox()
+        self.context_spin.setRange(0, 100)
+        self.context_spin.setToolTip('同时显示每个匹配前后的行数，重叠的部分只显示一次')
         
         # 将选项添加到布局
         options_layout.addWidget(self.search_mode_label)
@@ -267,10 +910,38 @@ class LogSearchTool(QMainWindow):
         options_layout.addWidget(self.search_mode_or)
         options_layout.addStretch(1)  # 添加弹性空间
         options_layout.addWidget(self.case_sensitive)
+        options_layout.addWidget(self.regex_check)
+        options_layout.addWidget(self.query_check)
+        options_layout.addWidget(self.follow_check)
+        options_layout.addWidget(self.context_label)
+        options_layout.addWidget(self.context_spin)
         
         keyword_layout.addLayout(options_layout)
         
-        # 搜索按钮 - 整行显示
+        # 多行记录模式: 异常堆栈等续行与前面的首行合成一条记录，按整条记录匹配
+        record_layout = QHBoxLayout()
+        self.record_check = QCheckBox('多行记录')
+        self.record_check.setToolTip('以匹配右侧正则表达式的行开始一条记录，之后的续行(如异常堆栈)'
+                                     '归入这条记录，按整条记录匹配')
+        self.record_start_edit = QLineEdit()
+        self.record_start_edit.setPlaceholderText(f'记录开始行的正则表达式，默认 {RECORD_START}')
+        self.record_start_edit.setEnabled(False)
+        self.record_check.toggled.connect(self.record_start_edit.setEnabled)
+        record_layout.addWidget(self.record_check)
+        record_layout.addWidget(self.record_start_edit, 1)
+        # 时间范围: 在按时间顺序写入的日志中二分查找边界，只扫描这一段
+        self.time_label = QLabel('时间范围:')
+        self.time_start_edit = QLineEdit()
+        self.time_start_edit.setPlaceholderText('开始，如 14:02 或 2024-05-01 14:02')
+        self.time_end_edit = QLineEdit()
+        self.time_end_edit.setPlaceholderText('结束(包含)，留空表示不限')
+        record_layout.addWidget(self.time_label)
+        record_layout.addWidget(self.time_start_edit)
+        record_layout.addWidget(QLabel('至'))
+        record_layout.addWidget(self.time_end_edit)
+        keyword_layout.addLayout(record_layout)
+        
+        # 搜索按钮
         self.search_button = QPushButton('搜索')
         self.search_button.clicked.connect(self.search_log)
         # 设置搜索按钮为绿色
@@ -290,7 +961,16 @@ class LogSearchTool(QMainWindow):
                 background-color: #3d8b40;
             }
         """)
-        keyword_layout.addWidget(self.search_button)
+        
+        # 取消按钮 - 搜索进行中才可用
+        self.cancel_button = QPushButton('取消')
+        self.cancel_button.clicked.connect(self.cancel_search)
+        self.cancel_button.setEnabled(False)
+        
+        search_buttons_layout = QHBoxLayout()
+        search_buttons_layout.addWidget(self.search_button, 1)
+        search_buttons_layout.addWidget(self.cancel_button)
+        keyword_layout.addLayout(search_buttons_layout)
         
         # 移除原来的编辑关键词按钮布局
         # button_layout = QHBoxLayout()
@@ -299,20 +979,83 @@ class LogSearchTool(QMainWindow):
         # button_layout.addWidget(self.edit_keywords_button)
         # keyword_layout.addLayout(button_layout)
         
-        # 结果显示区域
-        self.result_text = QTextEdit()
-        self.result_text.setReadOnly(True)
+        # 状态信息区域: 搜索条件、进度和汇总信息
+        self.status_text = QPlainTextEdit()
+        self.status_text.setReadOnly(True)
+        self.status_text.setMaximumBlockCount(500)
+        self.status_text.setMaximumHeight(120)
+        
+        # 结果显示区域 - 只绘制可见的行，结果再多也能流畅滚动。
+        # 使用单列的 QTableView 而不是 QListView: 固定行高时追加行不需要重新布局，
+        # QListView 每次插入都会对全部行重新布局
+        self.result_model = ResultListModel(self)
+        self.result_view = QTableView()
+        self.result_view.setModel(self.result_model)
+        self.result_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.result_view.verticalHeader().setDefaultSectionSize(self.result_view.fontMetrics().height() + 6)
+        self.result_view.verticalHeader().hide()
+        self.result_view.horizontalHeader().setStretchLastSection(True)
+        self.result_view.horizontalHeader().hide()
+        self.result_view.setShowGrid(False)
+        self.result_view.setWordWrap(False)
+        self.result_view.setAlternatingRowColors(True)
+        self.result_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.result_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.result_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        copy_action = QAction(self.result_view)
+        copy_action.setShortcut(QKeySequence.Copy)
+        copy_action.triggered.connect(self.copy_to_clipboard)
+        self.result_view.addAction(copy_action)
+        
+        # 结果按时间的分布，点击柱条只显示该时间段的结果
+        self.histogram_label = QLabel()
+        self.show_all_button = QPushButton('显示全部结果')
+        self.show_all_button.clicked.connect(self.show_all_results)
+        self.histogram_view = HistogramView()
+        self.histogram_view.bucket_clicked.connect(self.filter_results_by_time)
+        histogram_layout = QHBoxLayout()
+        histogram_layout.addWidget(self.histogram_label, 1)
+        histogram_layout.addWidget(self.show_all_button)
+        self.result_label = QLabel('搜索结果:')
+        self.set_histogram(None)
         
         # 复制按钮
         self.copy_button = QPushButton('复制到剪贴板')
         self.copy_button.clicked.connect(self.copy_to_clipboard)
+        # 关键词统计按钮，搜索结束后可用
+        self.keyword_stats = None
+        self.keyword_stats_button = QPushButton('关键词统计')
+        self.keyword_stats_button.clicked.connect(self.show_keyword_stats)
+        self.keyword_stats_button.setEnabled(False)
+        # 导出按钮: 按上次搜索的条件把全部结果写入文件
+        self.export_options = None
+        self.export_button = QPushButton('导出结果...')
+        self.export_button.clicked.connect(self.export_results)
+        self.export_button.setEnabled(False)
+        bottom_layout = QHBoxLayout()
+        bottom_layout.addWidget(self.copy_button, 1)
+        bottom_layout.addWidget(self.export_button)
+        bottom_layout.addWidget(self.keyword_stats_button)
         
         # 添加所有布局到主布局
         main_layout.addWidget(self.file_container)
+        main_layout.addLayout(dir_layout)
         main_layout.addLayout(keyword_layout)  # 使用新的关键词布局
-        main_layout.addWidget(QLabel('搜索结果:'))
-        main_layout.addWidget(self.result_text)
-        main_layout.addWidget(self.copy_button)
+        main_layout.addWidget(self.status_text)
+        main_layout.addLayout(histogram_layout)
+        main_layout.addWidget(self.histogram_view)
+        main_layout.addWidget(self.result_label)
+        main_layout.addWidget(self.result_view, 1)
+        main_layout.addLayout(bottom_layout)
+        
+        # 状态栏: 按字节计算的进度、速度和预计剩余时间
+        self.progress_label = QLabel()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setMaximumWidth(200)
+        self.statusBar().addWidget(self.progress_label, 1)
+        self.statusBar().addPermanentWidget(self.progress_bar)
         
         # 设置拖放功能
         self.setAcceptDrops(True)
@@ -325,21 +1068,34 @@ class LogSearchTool(QMainWindow):
     
     def dropEvent(self, event: QDropEvent):
         urls = event.mimeData().urls()
-        if urls and len(urls) > 0:
-            file_path = urls[0].toLocalFile()
-            if os.path.isfile(file_path):
-                self.log_file_path = file_path
-                # 修复这里：使用 drop_label 而不是不存在的 file_path
-                self.drop_label.setText(f"已选择文件: {file_path}")
-            else:
-                QMessageBox.warning(self, "警告", "请拖放一个有效的文件")
+        # 接受拖入的所有文件和目录
+        paths = [url.toLocalFile() for url in urls]
+        paths = [path for path in paths if os.path.isfile(path) or os.path.isdir(path)]
+        if paths:
+            self.set_log_paths(paths)
+        else:
+            QMessageBox.warning(self, "警告", "请拖放有效的文件或目录")
     
     def browse_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "选择日志文件", "", "所有文件 (*)")
-        if file_path:
-            self.log_file_path = file_path
-            # 修复这里：使用 drop_label 而不是不存在的 file_path
-            self.drop_label.setText(f"已选择文件: {file_path}")
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "选择日志文件", "", "所有文件 (*)")
+        if file_paths:
+            self.set_log_paths(file_paths)
+    
+    def browse_directory(self):
+        dir_path = QFileDialog.getExistingDirectory(self, "选择日志目录")
+        if dir_path:
+            self.set_log_paths([dir_path])
+    
+    def set_log_paths(self, paths):
+        self.log_paths = paths
+        if len(paths) == 1 and os.path.isfile(paths[0]):
+            self.drop_label.setText(f"已选择文件: {paths[0]}")
+        elif len(paths) == 1:
+            self.drop_label.setText(f"已选择目录: {paths[0]}")
+        else:
+            names = ', '.join(os.path.basename(path) for path in paths[:5])
+            more = " 等" if len(paths) > 5 else ""
+            self.drop_label.setText(f"已选择 {len(paths)} 个文件/目录: {names}{more}")
     
     def on_combo_changed(self, index):
         # 如果选择了"自定义..."选项
@@ -348,6 +1104,12 @@ class LogSearchTool(QMainWindow):
         else:
             self.custom_keyword.setVisible(False)
     
+    def on_query_toggled(self, checked):
+        if checked:
+            self.custom_keyword.setPlaceholderText('输入查询表达式，如 (timeout OR refused) AND NOT healthcheck')
+        else:
+            self.custom_keyword.setPlaceholderText('输入自定义关键词(空格或|分隔多个关键词)')
+    
     # 添加获取选中关键词的方法
     def get_selected_keywords(self):
         # 获取所有选中的预设关键词
@@ -359,256 +1121,440 @@ class LogSearchTool(QMainWindow):
         # 获取自定义关键词
         custom_keyword = self.custom_keyword.text().strip()
         
-        # 处理自定义关键词
-        if custom_keyword:
-            if '|' in custom_keyword:
-                custom_keywords = [k.strip() for k in custom_keyword.split('|') if k.strip()]
-            else:
-                custom_keywords = [k.strip() for k in custom_keyword.split() if k.strip()]
-            selected_keywords.extend(custom_keywords)
+        # 处理自定义关键词(查询表达式另行解析)
+        if custom_keyword and not self.query_check.isChecked():
+            selected_keywords.extend(parse_keywords(custom_keyword, self.regex_check.isChecked()))
         
         return selected_keywords
     
     # 添加搜索日志的方法
     def search_log(self):
-        if not self.log_file_path:
-            QMessageBox.warning(self, "警告", "请先选择日志文件")
+        if self.search_thread is not None:
+            return
+
+        if not self.log_paths:
+            QMessageBox.warning(self, "警告", "请先选择日志文件或目录")
             return
         
         keywords = self.get_selected_keywords()
-        if not keywords:
+        expression = self.custom_keyword.text().strip() if self.query_check.isChecked() else ''
+        if not keywords and not expression:
             QMessageBox.warning(self, "警告", "请选择或输入至少一个关键词")
             return
         
-        self.result_text.clear()
-        self.search_results = ""
-        
-        # 显示搜索中的提示
-        self.result_text.append("正在搜索中，请稍候...\n")
-        QApplication.processEvents()  # 处理待处理的事件，使界面保持响应
-        
-        try:
-            # 尝试使用不同的编码打开文件
-            encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1', 'iso-8859-1']  # 添加更多编码支持
-            file_size = os.path.getsize(self.log_file_path)
-            
-            # 移除大文件警告逻辑
-            
-            # 使用界面上的选项而不是弹窗
-            is_and_mode = self.search_mode_and.isChecked()
-            is_case_sensitive = self.case_sensitive.isChecked()
-            
-            # 添加调试信息
-            self.result_text.clear()
-            self.result_text.append("开始搜索...\n")
-            self.result_text.append(f"文件路径: {self.log_file_path}\n")
-            self.result_text.append(f"搜索关键词: {', '.join(keywords)}\n")
-            self.result_text.append(f"搜索模式: {'与模式' if is_and_mode else '或模式'}\n")
-            self.result_text.append(f"大小写敏感: {'是' if is_case_sensitive else '否'}\n")
-            QApplication.processEvents()  # 更新界面
-            
-            # 预处理关键词
-            processed_keywords = []
-            for keyword in keywords:
-                if not is_case_sensitive:
-                    processed_keywords.append(keyword.lower())
-                else:
-                    processed_keywords.append(keyword)
-            
-            # 尝试打开文件并搜索
-            file_opened = False
-            
-            for encoding in encodings:
+        # 使用界面上的选项而不是弹窗
+        is_and_mode = self.search_mode_and.isChecked()
+        is_case_sensitive = self.case_sensitive.isChecked()
+        is_regex = self.regex_check.isChecked()
+        query = None
+        patterns = keywords
+        if expression:
+            query = combine_query(keywords, expression, is_and_mode)
+            try:
+                patterns = query_terms(parse_query(query))
+            except QueryError as e:
+                QMessageBox.warning(self, "警告", f"查询表达式有误: {e}")
+                return
+        record_start = None
+        if self.record_check.isChecked():
+            record_start = self.record_start_edit.text().strip() or RECORD_START
+            try:
+                re.compile(record_start)
+            except re.error as e:
+                QMessageBox.warning(self, "警告", f"记录开始的正则表达式有误: {e}")
+                return
+        time_window = None
+        time_start = self.time_start_edit.text().strip()
+        time_end = self.time_end_edit.text().strip()
+        if time_start or time_end:
+            try:
+                time_window = TimeWindow(time_start, time_end)
+            except ValueError as e:
+                QMessageBox.warning(self, "警告", f"时间范围有误: {e}")
+                return
+        if is_regex:
+            # 编译结果会被缓存，搜索时不必重新编译
+            for keyword in patterns:
                 try:
-                    self.result_text.append(f"\n尝试使用 {encoding} 编码打开文件...\n")
-                    QApplication.processEvents()  # 更新界面
-                    
-                    with codecs.open(self.log_file_path, 'r', encoding=encoding) as file:
-                        file_opened = True
-                        self.result_text.clear()
-                        self.search_results = f"使用 {encoding} 编码成功打开文件\n"
-                        
-                        # 添加搜索模式信息
-                        mode_info = f"搜索模式: {'与模式(必须包含所有关键词)' if is_and_mode else '或模式(包含任一关键词即可)'}\n"
-                        mode_info += f"大小写敏感: {'是' if is_case_sensitive else '否'}\n"
-                        self.result_text.append(mode_info)
-                        self.search_results += mode_info
-                        
-                        # 添加关键词信息 - 优化显示格式
-                        keywords_str = "', '".join(keywords)
-                        keywords_info = f"搜索条件: {len(keywords)}个关键词 ['{keywords_str}']\n"
-                        if is_and_mode and len(keywords) > 1:
-                            keywords_info += f"匹配规则: 必须同时包含所有关键词\n"
-                        elif not is_and_mode and len(keywords) > 1:
-                            keywords_info += f"匹配规则: 包含任一关键词即可\n"
-                        self.result_text.append(keywords_info)
-                        self.search_results += keywords_info
-                        
-                        # 添加文件信息
-                        file_info = f"文件大小: {file_size / 1024 / 1024:.2f} MB\n"
-                        self.result_text.append(file_info)
-                        self.search_results += file_info
-                        
-                        found = False
-                        line_count = 0
-                        total_lines = 0
-                        
-                        # 计算总行数（仅对较小文件）
-                        if file_size < 5 * 1024 * 1024:  # 降低到5MB
-                            total_lines = sum(1 for _ in file)
-                            file.seek(0)  # 重置文件指针
-                            self.result_text.append(f"文件总行数: {total_lines}\n")
-                            self.search_results += f"文件总行数: {total_lines}\n"
-                        
-                        # 每处理1000行更新一次界面
-                        update_frequency = 1000 if file_size > 10 * 1024 * 1024 else 100
-                        
-                        # 添加结果计数器
-                        result_count = 0
-                        max_results = 5000  # 最大结果数限制
-                        
-                        # 添加一些调试信息
-                        self.result_text.append("\n开始逐行搜索...\n")
-                        QApplication.processEvents()  # 更新界面
-                        
-                        for line_number, line in enumerate(file, start=1):
-                            line_count += 1
-                            
-                            # 处理行内容 - 确保是字符串类型
-                            if not isinstance(line, str):
-                                line = str(line)
-                                
-                            line_to_check = line if is_case_sensitive else line.lower()
-                            
-                            # 改进的关键词匹配逻辑
-                            matched_keywords = []
-                            for i, keyword in enumerate(processed_keywords):
-                                if keyword in line_to_check:
-                                    matched_keywords.append(keywords[i])
-                            
-                            # 根据搜索模式判断是否匹配
-                            line_matched = False
-                            if is_and_mode:
-                                # 与模式：必须包含所有关键词
-                                line_matched = len(matched_keywords) == len(keywords)
-                            else:
-                                # 或模式：包含任一关键词即可
-                                line_matched = len(matched_keywords) > 0
-                            
-                            if line_matched:
-                                # 不再限制行长度，显示完整内容
-                                line_display = line.strip()
-                                
-                                # 直接显示匹配内容，不添加行号和关键词信息
-                                result_line = line_display + "\n"
-                                self.result_text.append(result_line)
-                                self.search_results += result_line
-                                found = True
-                                result_count += 1
-                                
-                                # 不再弹窗询问是否继续，只在状态栏显示进度
-                                if result_count % 500 == 0:
-                                    progress_msg = f"已找到 {result_count} 个结果，继续搜索中...\n"
-                                    self.result_text.append(progress_msg)
-                                    self.search_results += progress_msg
-                                    QApplication.processEvents()  # 更新界面
-                                
-                                # 如果结果超过最大限制，自动停止但不弹窗
-                                if result_count >= max_results:
-                                    limit_msg = f"\n已达到最大结果数限制({max_results})，搜索已停止。\n"
-                                    self.result_text.append(limit_msg)
-                                    self.search_results += limit_msg
-                                    break
-                            
-                            # 定期更新界面
-                            if line_count % update_frequency == 0:
-                                progress = f"已处理 {line_number} 行"
-                                if total_lines > 0:
-                                    progress += f" ({line_number/total_lines*100:.1f}%)"
-                                progress += f"，找到 {result_count} 个结果"
-                                self.result_text.append(f"{progress}...\n")
-                                QApplication.processEvents()  # 处理待处理的事件
-                        
-                        # 移除进度提示
-                        self.result_text.clear()
-                        self.result_text.append(f"使用 {encoding} 编码成功打开文件\n")
-                        self.result_text.append(file_info)
-                        if total_lines > 0:
-                            self.result_text.append(f"文件总行数: {total_lines}\n")
-                        
-                        if found:
-                            self.result_text.append(f"搜索完成，共找到结果在 {result_count} 行\n")
-                            self.search_results += f"搜索完成，共找到结果在 {result_count} 行\n"
-                            
-                            # 修复搜索结果不显示问题
-                            # 从搜索结果中提取实际的日志内容行
-                            result_lines = []
-                            for line in self.search_results.split('\n'):
-                                # 排除所有非日志内容的行
-                                if not (line.startswith("搜索") or 
-                                       line.startswith("文件") or 
-                                       line.startswith("使用") or 
-                                       line.startswith("大小写") or 
-                                       line.startswith("匹配规则") or 
-                                       line.startswith("已找到") or 
-                                       line.startswith("已达到") or 
-                                       line.startswith("搜索条件") or 
-                                       line.startswith("未找到") or 
-                                       line == ""):
-                                    result_lines.append(line)
-                            
-                            # 限制显示的结果数量
-                            if len(result_lines) > 1000:
-                                self.result_text.append("结果过多，仅显示前1000行：\n")
-                                for line in result_lines[:1000]:
-                                    self.result_text.append(line)
-                                    # 添加空行实现隔行显示
-                                    self.result_text.append("")
-                                self.result_text.append(f"\n... 还有 {len(result_lines) - 1000} 行结果未显示 ...\n")
-                            else:
-                                for line in result_lines:
-                                    self.result_text.append(line)
-                                    # 添加空行实现隔行显示
-                                    self.result_text.append("")
-                        else:
-                            keywords_str = "', '".join(keywords)
-                            no_result = f"未找到包含关键词 '{keywords_str}' 的内容\n"
-                            self.result_text.append(no_result)
-                            self.search_results += no_result
+                    compile_regex(keyword, is_case_sensitive)
+                except re.error as e:
+                    QMessageBox.warning(self, "警告", f"正则表达式 '{keyword}' 有误: {e}")
                     return
-                except UnicodeDecodeError:
-                    continue
-            
-            error_msg = f"无法以支持的编码格式打开文件 {self.log_file_path}\n"
-            self.result_text.append(error_msg)
-            self.search_results += error_msg
-            
-        except Exception as e:
-            error_msg = f"读取文件时出错: {e}\n"
-            self.result_text.append(error_msg)
-            self.search_results += error_msg
+        
+        self.status_text.clear()
+        self.result_model.clear()
+        self.set_histogram(None)
+        self.keyword_stats = None
+        self.keyword_stats_button.setEnabled(False)
+        self.result_count = 0
+        
+        # 添加调试信息
+        self.show_status("开始搜索...")
+        self.show_status(f"文件路径: {', '.join(self.log_paths)}")
+        if query is not None:
+            self.show_status(f"查询表达式: {query}")
+        else:
+            self.show_status(f"搜索关键词: {', '.join(keywords)}")
+            self.show_status(f"搜索模式: {'与模式' if is_and_mode else '或模式'}")
+        self.show_status(f"大小写敏感: {'是' if is_case_sensitive else '否'}")
+        
+        # 在后台线程中执行搜索，界面线程只负责显示
+        self.search_keywords = keywords
+        self.search_query = query
+        self.search_thread = QThread(self)
+        self.search_worker = SearchWorker(self.log_paths, keywords, is_and_mode, is_case_sensitive,
+                                          include=self.include_pattern.text().split(),
+                                          exclude=self.exclude_pattern.text().split(),
+                                          cache=self.search_cache,
+                                          follow=self.follow_check.isChecked(),
+                                          regex=is_regex, query=query,
+                                          context=self.context_spin.value(),
+                                          record_start=record_start,
+                                          time_window=time_window)
+        self.search_worker.moveToThread(self.search_thread)
+        self.export_options = dict(paths=list(self.log_paths), keywords=keywords,
+                                   is_and_mode=is_and_mode, is_case_sensitive=is_case_sensitive,
+                                   include=self.include_pattern.text().split(),
+                                   exclude=self.exclude_pattern.text().split(),
+                                   regex=is_regex, query=query,
+                                   context=self.context_spin.value(),
+                                   record_start=record_start, time_window=time_window)
+        
+        self.search_thread.started.connect(self.search_worker.run)
+        self.search_worker.message.connect(self.on_search_message)
+        self.search_worker.progress.connect(self.on_search_progress)
+        self.search_worker.files.connect(self.on_search_files)
+        self.search_worker.results.connect(self.on_search_results)
+        self.search_worker.following.connect(self.on_search_finished)
+        self.search_worker.replaced.connect(self.on_file_replaced)
+        self.search_worker.finished.connect(self.on_search_finished)
+        self.search_worker.finished.connect(self.search_thread.quit)
+        self.search_thread.finished.connect(self.search_worker.deleteLater)
+        self.search_thread.finished.connect(self.search_thread.deleteLater)
+        self.search_thread.finished.connect(self.on_thread_finished)
+        
+        self.set_searching(True)
+        self.search_thread.start()
+    
+    def build_log_index(self):
+        if self.search_thread is not None:
+            return
+        if not self.log_paths:
+            QMessageBox.warning(self, "警告", "请先选择日志文件或目录")
+            return
+        
+        self.status_text.clear()
+        # 和搜索共用后台线程和取消按钮
+        self.search_thread = QThread(self)
+        self.search_worker = IndexWorker(self.log_paths, self.include_pattern.text().split(),
+                                         self.exclude_pattern.text().split())
+        self.search_worker.moveToThread(self.search_thread)
+        
+        self.search_thread.started.connect(self.search_worker.run)
+        self.search_worker.message.connect(self.on_search_message)
+        self.search_worker.progress.connect(self.on_index_progress)
+        self.search_worker.finished.connect(self.on_index_finished)
+        self.search_worker.finished.connect(self.search_thread.quit)
+        self.search_thread.finished.connect(self.search_worker.deleteLater)
+        self.search_thread.finished.connect(self.search_thread.deleteLater)
+        self.search_thread.finished.connect(self.on_thread_finished)
+        
+        self.set_searching(True)
+        self.search_thread.start()
+    
+    def export_results(self):
+        if self.search_thread is not None or self.export_options is None:
+            return
+        path, selected = QFileDialog.getSaveFileName(
+            self, "导出结果", "matches.txt",
+            "文本 (*.txt);;JSON Lines (*.jsonl);;CSV (*.csv);;"
+            "gzip 压缩的文本 (*.txt.gz);;gzip 压缩的 JSON Lines (*.jsonl.gz);;gzip 压缩的 CSV (*.csv.gz)")
+        if not path:
+            return
+        # 没有写扩展名时使用所选格式的扩展名，格式和是否压缩都按扩展名判断
+        extension = re.search(r'\*(\.[\w.]+)', selected)
+        if extension and not os.path.splitext(path)[1]:
+            path += extension.group(1)
+        
+        # 和搜索共用后台线程和取消按钮
+        self.search_thread = QThread(self)
+        self.search_worker = ExportWorker(path, **self.export_options)
+        self.search_worker.moveToThread(self.search_thread)
+        
+        self.search_thread.started.connect(self.search_worker.run)
+        self.search_worker.message.connect(self.on_search_message)
+        self.search_worker.progress.connect(self.on_export_progress)
+        self.search_worker.finished.connect(self.on_export_finished)
+        self.search_worker.finished.connect(self.search_thread.quit)
+        self.search_thread.finished.connect(self.search_worker.deleteLater)
+        self.search_thread.finished.connect(self.search_thread.deleteLater)
+        self.search_thread.finished.connect(self.on_thread_finished)
+        
+        self.set_searching(True)
+        self.search_thread.start()
+    
+    def on_export_progress(self, progress):
+        self.show_progress(progress, f"正在导出，{format_progress(progress)}，"
+                                     f"已写入 {progress.results} 个结果")
+    
+    def on_export_finished(self, reports):
+        self.progress_label.setText("导出完成")
+        for line in reports:
+            self.show_status(line)
+    
+    def remove_log_index(self):
+        if self.search_thread is not None:
+            return
+        if not self.log_paths:
+            QMessageBox.warning(self, "警告", "请先选择日志文件或目录")
+            return
+        
+        self.status_text.clear()
+        removed = 0
+        for path in iter_log_files(self.log_paths, self.include_pattern.text().split(),
+                                   self.exclude_pattern.text().split()):
+            try:
+                if remove_index(path):
+                    removed += 1
+                    self.show_status(f"已删除 {os.path.basename(path)} 的索引")
+            except OSError as e:
+                self.show_status(f"{os.path.basename(path)}: 删除索引失败 - {e}")
+        if not removed:
+            self.show_status("选中的文件没有索引")
+    
+    def on_index_progress(self, progress):
+        self.show_progress(progress, format_progress(progress))
+    
+    def on_index_finished(self, reports):
+        self.progress_label.setText("索引建立完成")
+        self.status_text.clear()
+        for line in reports:
+            self.show_status(line)
+    
+    def set_searching(self, searching):
+        """ 切换搜索中/空闲状态下的按钮可用性 """
+        if searching:
+            self.progress_bar.setValue(0)
+            self.progress_label.setText("正在准备...")
+        self.search_button.setEnabled(not searching)
+        self.browse_dir_button.setEnabled(not searching)
+        self.build_index_button.setEnabled(not searching)
+        self.remove_index_button.setEnabled(not searching)
+        self.export_button.setEnabled(not searching and self.export_options is not None)
+        self.cancel_button.setEnabled(searching)
+        self.edit_keywords_button.setEnabled(not searching)
+        self.follow_check.setEnabled(not searching)
+        self.regex_check.setEnabled(not searching)
+        self.query_check.setEnabled(not searching)
+        self.context_spin.setEnabled(not searching)
+        self.record_check.setEnabled(not searching)
+        self.record_start_edit.setEnabled(not searching and self.record_check.isChecked())
+        self.time_start_edit.setEnabled(not searching)
+        self.time_end_edit.setEnabled(not searching)
+    
+    def cancel_search(self):
+        if self.search_worker is not None:
+            self.cancel_button.setEnabled(False)
+            self.search_worker.cancel()
+    
+    def show_status(self, text):
+        self.status_text.appendPlainText(text.strip('\n'))
+    
+    def on_search_message(self, text):
+        self.show_status(text)
+    
+    def show_progress(self, progress, text):
+        if progress.bytes_total > 0:
+            self.progress_bar.setValue(int(progress.bytes_done / progress.bytes_total * 1000))
+        self.progress_label.setText(text)
+    
+    def on_search_progress(self, progress):
+        self.show_progress(progress, f"{format_progress(progress)}，找到 {progress.results} 个结果")
+    
+    def on_search_files(self, files):
+        self.result_model.multiple_files = len(files) > 1
+    
+    def on_search_results(self, matches):
+        # 结果只保存位置信息，视图需要显示时再从文件读取行内容
+        # 进度和结果数显示在状态栏中
+        self.result_model.append(matches)
+        self.result_count += sum(1 for match in matches if match.mask)
+        histogram = self.histogram_view.histogram
+        if histogram is not None:
+            # 开始跟踪后才有分布，之后跟踪到的结果也计入，柱条的结果数与筛选的行数一致
+            for match in matches:
+                if match.mask:
+                    histogram.add(match.text)
+            self.refresh_histogram()
+    
+    def on_file_replaced(self, path, old_file):
+        # 之前的结果改为从轮转前的旧文件读取，新结果来自新文件
+        self.result_model.store.detach(path, old_file)
+        name = os.path.basename(path)
+        if old_file is None:
+            self.show_status(f"{name} 已被截断，从头开始跟踪")
+        else:
+            self.show_status(f"{name} 已被轮转，开始跟踪新文件")
+    
+    def on_thread_finished(self):
+        # 后台线程完全退出后才允许开始新的搜索
+        self.search_worker = None
+        self.search_thread = None
+        self.set_searching(False)
+    
+    def on_search_finished(self, summary):
+        stats = summary['stats']
+        if summary['error'] or stats is None:
+            self.show_status(summary['error'] or "搜索未完成")
+            self.progress_label.setText("搜索未完成")
+            return
+        if stats.histogram is not None and summary['followed'] is None:
+            # 停止跟踪时分布已随跟踪到的结果更新，不再重新设置，以免取消正在使用的筛选
+            self.set_histogram(stats.histogram)
+        if stats.keyword_counts is not None and stats.keyword_counts.total:
+            self.keyword_stats = (stats.keyword_counts, stats.result_count)
+            self.keyword_stats_button.setEnabled(True)
+        if summary['followed'] is not None:
+            # 首次搜索的汇总信息在开始跟踪时已经显示
+            self.show_status(f"已停止跟踪，跟踪期间新增 {summary['followed']} 个结果")
+            self.progress_label.setText(f"已停止跟踪，共 {self.result_count} 个结果")
+            return
+        if stats.cancelled:
+            self.progress_label.setText(f"已取消，{format_progress(stats.snapshot())}")
+        else:
+            self.progress_bar.setValue(self.progress_bar.maximum())
+            self.progress_label.setText(f"耗时 {stats.elapsed:.2f} 秒，平均 {stats.throughput:.1f} MB/s，"
+                                        f"共 {stats.result_count} 个结果")
+        file_stats = summary['file_stats']
+        multiple = len(summary['files']) > 1
+        # 界面按偏移从文件读取结果内容时使用各文件的编码
+        self.result_model.set_encodings({s.path: s.encoding for s in file_stats if s.encoding})
+        
+        # 移除进度提示，结果已全部在列表中，不需要重新填充
+        self.status_text.clear()
+        if not multiple:
+            self.show_status(f"使用 {stats.encoding} 编码成功打开文件")
+        self.show_status(format_file_info(len(summary['files']), stats.file_size, stats.compression))
+        if stats.total_lines > 0:
+            self.show_status(f"文件总行数: {stats.total_lines}")
+        if summary['plan']:
+            self.show_status(f"查询求值顺序(方括号中为估计的命中率): {summary['plan']}")
+        if stats.decode_errors:
+            encoding = "" if multiple else f"按 {stats.encoding} "
+            self.show_status(f"有 {stats.decode_errors} 行含无法{encoding}解码的字节，已替换显示")
+        if multiple:
+            # 各文件的吞吐量和总耗时
+            for s in file_stats:
+                self.show_status(format_file_stats(s))
+            self.show_status(f"共搜索 {len(file_stats)} 个文件，总耗时 {stats.elapsed:.2f} 秒，"
+                             f"平均 {stats.throughput:.1f} MB/s")
+        for s in file_stats:
+            name = os.path.basename(s.path)
+            if s.resumed_from:
+                self.show_status(f"{name} 自上次搜索后只在末尾追加了内容，本次只搜索了新增的 "
+                                 f"{(s.bytes_scanned - s.resumed_from) / 1024 / 1024:.2f} MB")
+            elif s.cache_reset:
+                self.show_status(f"{name} 已被截断或轮转，重新搜索了整个文件")
+            if s.window is not None:
+                start, stop = s.window
+                self.show_status(f"{name} 中的时间范围位于 {start / 1024 / 1024:.1f} MB 至 "
+                                 f"{stop / 1024 / 1024:.1f} MB，只扫描了这一段")
+        if stats.relative_lines:
+            self.show_status("没有最新的行偏移索引，行号从时间范围的开始处计；"
+                             "不限时间范围完整搜索一次后会记录行偏移")
+        if any(s.index_used for s in file_stats):
+            self.show_status("已使用索引，只读取了可能匹配的行")
+        stale = [os.path.basename(s.path) for s in file_stats if s.index_stale]
+        if stale:
+            self.show_status(f"{', '.join(stale)} 的索引已过期，已改为扫描，可重新建立索引")
+        if stats.truncated_records:
+            self.show_status(f"有 {stats.truncated_records} 条记录超过 {RECORD_MAX_SIZE // 1024} KB，"
+                             f"只匹配和显示了开头部分")
+        if stats.limit_reached:
+            # 如果结果超过最大限制，不再显示更多结果但不弹窗
+            self.show_status(f"已达到最大结果数限制({MAX_RESULTS})，之后的结果不再显示。")
+        if self.keyword_stats is not None:
+            # 各关键词的命中行数，包括超出上限的部分；完整的矩阵见关键词统计
+            counts = stats.keyword_counts
+            for line in format_keyword_counts(counts, stats.result_count)[:len(counts.keywords) + 1]:
+                self.show_status(line)
+        
+        if stats.cancelled:
+            self.show_status(f"搜索已取消，已找到 {self.result_count} 个结果")
+        
+        if self.result_count > 0:
+            if not stats.cancelled:
+                self.show_status(f"搜索完成，共找到结果在 {self.result_count} 行")
+        elif not stats.cancelled and self.search_query is not None:
+            self.show_status(f"未找到符合查询表达式 '{self.search_query}' 的内容")
+        elif not stats.cancelled:
+            keywords_str = "', '".join(self.search_keywords)
+            self.show_status(f"未找到包含关键词 '{keywords_str}' 的内容")
+    
+    def show_keyword_stats(self):
+        if self.keyword_stats is not None:
+            KeywordStatsDialog(*self.keyword_stats, parent=self).exec_()
+    
+    def set_histogram(self, histogram):
+        """ 显示结果的时间分布，为空或还没有带时间戳的结果时隐藏；换成另一个分布时取消筛选 """
+        if histogram is not self.histogram_view.histogram and self.result_model.time_filter is not None:
+            self.show_all_results()
+        self.histogram_view.set_histogram(histogram)
+        self.refresh_histogram()
+    
+    def refresh_histogram(self):
+        histogram = self.histogram_view.histogram
+        visible = histogram is not None and histogram.total > 0
+        self.histogram_view.setVisible(visible)
+        self.histogram_label.setVisible(visible)
+        self.show_all_button.setVisible(visible)
+        if visible:
+            self.histogram_view.refresh()
+            text = f"结果的时间分布(按{histogram.resolution}统计，点击柱条只显示该时间段的结果)"
+            if histogram.untimed:
+                text += f"，另有 {histogram.untimed} 个结果的行首没有时间戳"
+            self.histogram_label.setText(text)
+        time_filter = self.result_model.time_filter
+        self.show_all_button.setEnabled(time_filter is not None)
+        if time_filter is not None:
+            start, end = time_filter
+            step = end - start
+            self.result_label.setText(f"搜索结果(只显示 {format_time(start, step)} 起 "
+                                      f"{format_duration(step)}内的 {self.result_model.rowCount()} 行):")
+    
+    def filter_results_by_time(self, start, end):
+        if start is None:
+            self.show_all_results()
+            return
+        self.result_model.set_time_filter(start, end)
+        self.refresh_histogram()
+    
+    def show_all_results(self):
+        self.histogram_view.selected = None
+        self.histogram_view.update()
+        self.result_model.set_time_filter(None)
+        self.result_label.setText('搜索结果:')
+        self.show_all_button.setEnabled(False)
+    
+    def closeEvent(self, event):
+        # 关闭窗口前停止后台搜索
+        if self.search_thread is not None:
+            self.search_worker.cancel()
+            self.search_thread.quit()
+            self.search_thread.wait()
+        self.result_model.store.close()
+        self.search_cache.clear()
+        super().closeEvent(event)
     
     def copy_to_clipboard(self):
-        if self.search_results:
-            # 提取所有匹配的行（现在直接是日志内容）
-            matched_lines = []
-            for line in self.search_results.split('\n'):
-                # 排除进度信息和其他非日志内容
-                if not (line.startswith("搜索") or 
-                       line.startswith("文件") or 
-                       line.startswith("使用") or 
-                       line.startswith("大小写") or 
-                       line.startswith("匹配规则") or 
-                       line.startswith("已找到") or 
-                       line.startswith("已达到") or 
-                       line.startswith("搜索条件") or 
-                       line.startswith("未找到") or 
-                       line == ""):
-                    matched_lines.append(line)
+        if self.result_model.rowCount():
+            # 选中了结果时只复制选中的行，否则复制全部；行内容从文件中读取
+            rows = sorted(index.row() for index in self.result_view.selectionModel().selectedIndexes())
+            matched_lines = self.result_model.lines(rows or None)
             
             # 将匹配的日志内容合并为一个字符串，确保保留换行格式
             # 使用双换行符来保持隔行显示的格式
-            clipboard_content = "\n\n".join(matched_lines)
+            clipboard_content = "\n\n".join(line for line in matched_lines if line)
             
             if clipboard_content:
                 pyperclip.copy(clipboard_content)
@@ -652,6 +1598,8 @@ class LogSearchTool(QMainWindow):
                 QMessageBox.warning(self, "警告", f"保存关键词失败: {message}")
 
 def main():
+    # 打包后的程序启动并行搜索子进程时需要
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     ex = LogSearchTool()
     sys.exit(app.exec_())
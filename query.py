@@ -0,0 +1,434 @@
+"""
+布尔查询表达式: AND / OR / NOT、括号和引号短语
+
+    searcher = LogSearcher([], query='(timeout OR refused) AND NOT healthcheck')
+    for match in searcher.search('app.log'):
+        print(match.line_number, match.text)
+
+运算符只认大写的 AND、OR、NOT，优先级 NOT > AND > OR；相邻的两个条件之间
+省略运算符时按 AND 处理。其余不含空白和括号的词都是关键词，含空格、括号或
+与运算符同名的关键词用双引号括起来("connection reset"、"AND")，短语中的
+双引号和反斜杠用反斜杠转义。
+
+表达式被编译成求值计划: 各条件的命中率先按关键词长度粗略估计，搜索时再用文件
+样本(与检测编码相同的抽样)实际统计。AND 中最可能不命中且代价低的条件排在前面，
+OR 中最可能命中的排在前面，这样多数行只需检查一两个条件就能判定。
+"""
+import re
+from collections import namedtuple
+
+from search import KeywordMatcher, compile_regex
+
+QUERY_OPERATORS = ('AND', 'OR', 'NOT')
+
+# 表达式最多嵌套的层数(括号和 NOT)
+MAX_QUERY_DEPTH = 64
+
+# 估计命中率时最多使用的样本行数
+QUERY_SAMPLE_LINES = 20000
+
+# 每个条件在一行上的相对代价: 子串查找 / 执行正则
+TERM_COST = 1.0
+REGEX_COST = 5.0
+
+# 按关键词长度估计的命中率下限(没有样本时)
+MIN_SELECTIVITY = 0.001
+
+# 样本中预筛字面量出现在超过该比例的行中时，字节级预筛反而比逐行匹配慢，不再预筛
+PREFILTER_MAX_HIT_RATE = 0.25
+
+# 词法单元: 左右括号、双引号短语(可能缺少结尾的引号)、普通词
+TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)("?)|([^\s()"]+))')
+
+# 表达式树的节点: op 为 'term'、'and'、'or' 或 'not'；term 为关键词(仅 'term' 节点)
+QueryNode = namedtuple('QueryNode', ['op', 'children', 'term'])
+
+
+class QueryError(ValueError):
+    """ 查询表达式有语法错误 """
+
+
+def _tokenize(text):
+    """ 返回 (类型, 值, 位置) 列表，类型为 '(' ')' 'op' 'term' """
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = TOKEN_RE.match(text, pos)
+        start = m.start() + len(m.group()) - len(m.group().lstrip())
+        if m.group(1):
+            tokens.append(('(', '(', start))
+        elif m.group(2):
+            tokens.append((')', ')', start))
+        elif m.group(5) is not None:
+            word = m.group(5)
+            tokens.append(('op' if word in QUERY_OPERATORS else 'term', word, start))
+        else:
+            if not m.group(4):
+                raise QueryError(f"第 {start + 1} 个字符处的引号没有闭合")
+            phrase = re.sub(r'\\(.)', r'\1', m.group(3))
+            if not phrase:
+                raise QueryError(f"第 {start + 1} 个字符处的短语为空")
+            tokens.append(('term', phrase, start))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    """ 递归下降: or_expr := and_expr (OR and_expr)*，and_expr := not_expr ([AND] not_expr)* """
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.depth = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("查询表达式为空")
+        node = self.parse_or()
+        token = self.peek()
+        if token is not None:
+            # 只有多余的右括号会停在这里
+            raise QueryError(f"第 {token[2] + 1} 个字符处有多余的右括号")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() is not None and self.peek()[:2] == ('op', 'OR'):
+            self.operand('OR')
+            children.append(self.parse_and())
+        return _combine('or', children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while True:
+            token = self.peek()
+            if token is None or token[0] == ')' or token[:2] == ('op', 'OR'):
+                break
+            if token[:2] == ('op', 'AND'):
+                self.operand('AND')
+            children.append(self.parse_not())
+        return _combine('and', children)
+
+    def parse_not(self):
+        token = self.peek()
+        if token is not None and token[:2] == ('op', 'NOT'):
+            self.operand('NOT')
+            self.enter(token)
+            child = self.parse_not()
+            self.depth -= 1
+            # NOT NOT x 即 x
+            if child.op == 'not':
+                return child.children[0]
+            return QueryNode('not', (child,), None)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token is None:
+            raise QueryError("查询表达式不完整")
+        kind, value, pos = token
+        if kind == 'term':
+            self.pos += 1
+            return QueryNode('term', (), value)
+        if kind == '(':
+            self.pos += 1
+            self.enter(token)
+            if self.peek() is not None and self.peek()[0] == ')':
+                raise QueryError(f"第 {pos + 1} 个字符处的括号中缺少查询条件")
+            node = self.parse_or()
+            if self.peek() is None:
+                raise QueryError(f"第 {pos + 1} 个字符处的左括号缺少对应的右括号")
+            self.pos += 1
+            self.depth -= 1
+            return node
+        if kind == ')':
+            raise QueryError(f"第 {pos + 1} 个字符处的右括号前缺少查询条件")
+        raise QueryError(f"第 {pos + 1} 个字符处的 {value} 前缺少查询条件")
+
+    def operand(self, op):
+        """ 跳过运算符，并检查其后还有条件 """
+        token = self.peek()
+        self.pos += 1
+        following = self.peek()
+        if following is None or following[0] == ')' or following[:2] in (('op', 'AND'), ('op', 'OR')):
+            raise QueryError(f"第 {token[2] + 1} 个字符处的 {op} 后缺少查询条件")
+
+    def enter(self, token):
+        self.depth += 1
+        if self.depth > MAX_QUERY_DEPTH:
+            raise QueryError(f"第 {token[2] + 1} 个字符处嵌套过深(最多 {MAX_QUERY_DEPTH} 层)")
+
+
+def _combine(op, children):
+    """ 合并为 AND/OR 节点，同类的子节点展开，使求值顺序可以整体调整 """
+    if len(children) == 1:
+        return children[0]
+    flat = []
+    for child in children:
+        flat.extend(child.children if child.op == op else (child,))
+    return QueryNode(op, tuple(flat), None)
+
+
+def parse_query(text):
+    """ 解析查询表达式，返回 QueryNode 树；有语法错误时抛出 QueryError """
+    return _Parser(text).parse()
+
+
+def query_terms(node, positive=False):
+    """ 按出现顺序返回表达式中的关键词(去重)；positive 为真时不包括 NOT 之下的 """
+    terms = []
+
+    def walk(node):
+        if node.op == 'term':
+            if node.term not in terms:
+                terms.append(node.term)
+        elif not (positive and node.op == 'not'):
+            for child in node.children:
+                walk(child)
+
+    walk(node)
+    return terms
+
+
+def _map_terms(node, func):
+    if node.op == 'term':
+        return node._replace(term=func(node.term))
+    return node._replace(children=tuple(_map_terms(child, func) for child in node.children))
+
+
+def quote_term(term):
+    """ 把关键词写成表达式中的一项，必要时加引号 """
+    if term in QUERY_OPERATORS or not term or re.search(r'[\s()"]', term):
+        return '"' + re.sub(r'(["\\])', r'\\\1', term) + '"'
+    return term
+
+
+def combine_query(keywords, expression, and_mode=True):
+    """ 把选中的关键词和表达式按与/或模式组合成一个查询 """
+    parts = [quote_term(keyword) for keyword in keywords]
+    if expression.strip():
+        parts.append(f"({expression})" if parts else expression)
+    return (' AND ' if and_mode else ' OR ').join(parts)
+
+
+def format_query(node, selectivity=None):
+    """ 把表达式树写回文本，selectivity 不为空时在每个关键词后标注估计的命中率 """
+    if node.op == 'term':
+        text = quote_term(node.term)
+        if selectivity is not None and node.term in selectivity:
+            text += f"[{selectivity[node.term] * 100:.2g}%]"
+        return text
+    if node.op == 'not':
+        child = node.children[0]
+        text = format_query(child, selectivity)
+        return f"NOT ({text})" if child.op in ('and', 'or') else f"NOT {text}"
+    parts = []
+    for child in node.children:
+        text = format_query(child, selectivity)
+        # AND 比 OR 优先，AND 中的 OR 需要括号
+        parts.append(f"({text})" if node.op == 'and' and child.op == 'or' else text)
+    return f" {node.op.upper()} ".join(parts)
+
+
+def _guess_selectivity(literal):
+    """ 没有样本时按长度估计命中率: 越长的关键词越罕见 """
+    return max(0.5 ** len(literal), MIN_SELECTIVITY)
+
+
+def _optimize(node, selectivity, costs):
+    """
+    按估计的命中率和代价重排子节点，返回(新节点, 命中率, 每行的期望代价)。
+
+    AND 在第一个不满足的条件处结束，按 代价 / 不命中率 升序排列时期望代价最小；
+    OR 在第一个满足的条件处结束，按 代价 / 命中率 升序排列。
+    """
+    if node.op == 'term':
+        return node, selectivity[node.term], costs[node.term]
+    if node.op == 'not':
+        child, p, cost = _optimize(node.children[0], selectivity, costs)
+        return node._replace(children=(child,)), 1.0 - p, cost
+
+    planned = [_optimize(child, selectivity, costs) for child in node.children]
+    if node.op == 'and':
+        planned.sort(key=lambda c: c[2] / (1.0 - c[1]) if c[1] < 1.0 else float('inf'))
+    else:
+        planned.sort(key=lambda c: c[2] / c[1] if c[1] > 0.0 else float('inf'))
+    # reach: 求值到某个子节点的概率
+    reach = 1.0
+    cost = 0.0
+    for _, p, child_cost in planned:
+        cost += reach * child_cost
+        reach *= p if node.op == 'and' else 1.0 - p
+    p = reach if node.op == 'and' else 1.0 - reach
+    return node._replace(children=tuple(c[0] for c in planned)), p, cost
+
+
+class QueryMatcher(KeywordMatcher):
+    """
+    按布尔查询表达式匹配的 KeywordMatcher。
+
+    求值计划编译成一个由 and/or/not 组成的 Python 表达式(lambda)，按计划的顺序
+    短路求值，比逐个节点递归判断快得多。keywords 是不在 NOT 之下的关键词，
+    匹配时返回其中出现在行中的位掩码；只靠 NOT 条件匹配、没有命中任何关键词的行
+    返回 1 << len(keywords)，保证匹配的行掩码不为0。
+
+    regex 为真时每个关键词是一个正则表达式(见 compile_regex)，表达式有误时抛出 re.error。
+    """
+
+    def __init__(self, query, case_sensitive=False, regex=False):
+        tree = parse_query(query) if isinstance(query, str) else query
+        self.query = query if isinstance(query, str) else format_query(tree)
+        self.case_sensitive = case_sensitive
+        self.regex = regex
+        self.and_mode = True
+        self.keywords = query_terms(tree, positive=True)
+        self.full_mask = (1 << len(self.keywords)) - 1
+        self._matched = 1 << len(self.keywords)
+
+        # 扫描时是否需要把数据转为小写(见 KeywordMatcher)；不区分大小写的子串查找在
+        # 小写的行上进行，正则自行忽略大小写
+        self.fold_case = not case_sensitive and (
+            regex or any(k.lower() != k.upper() for k in query_terms(tree)))
+        self._lower = self.fold_case and not regex
+        if self._lower:
+            tree = _map_terms(tree, str.lower)
+        self.tree = tree
+        keys = query_terms(tree)
+        self._regexes = {}
+        if regex:
+            for key in keys:
+                self._regexes[key] = compile_regex(key, case_sensitive)
+        self._positive = [(self._key(keyword), 1 << i) for i, keyword in enumerate(self.keywords)]
+
+        self._costs = {key: REGEX_COST if regex else TERM_COST for key in keys}
+        self._selectivity = {key: self._guess(key) for key in keys}
+        self.estimated = False
+        self._build()
+
+    def _key(self, keyword):
+        return keyword.lower() if self._lower else keyword
+
+    def _guess(self, key):
+        if not self.regex:
+            return _guess_selectivity(key)
+        literals = self._regexes[key][1]
+        if not literals:
+            return 0.5
+        return min(sum(map(_guess_selectivity, literals)), 1.0)
+
+    def _build(self):
+        """ 按当前的命中率估计生成求值计划、匹配函数和预筛字面量 """
+        # hit_rate 和 cost 为整个查询的估计命中率和每行的期望代价
+        self.plan, self.hit_rate, self.cost = _optimize(self.tree, self._selectivity, self._costs)
+        self._test = self._compile(self.plan)
+        self._groups = self._required(self.tree)
+        prefilter = min(self._groups, key=self._group_selectivity, default=None)
+        if (prefilter is not None and self.estimated
+                and self._group_selectivity(prefilter) > PREFILTER_MAX_HIT_RATE):
+            prefilter = None
+        self._prefilter = prefilter
+
+    def _compile(self, plan):
+        names = {}
+        namespace = {}
+
+        def source(node):
+            if node.op == 'term':
+                if node.term not in names:
+                    names[node.term] = name = f"_t{len(names)}"
+                    namespace[name] = (self._regexes[node.term][0].search if self.regex
+                                       else node.term)
+                name = names[node.term]
+                return f"{name}(line) is not None" if self.regex else f"{name} in line"
+            if node.op == 'not':
+                return f"not ({source(node.children[0])})"
+            return f" {node.op} ".join(f"({source(child)})" for child in node.children)
+
+        return eval(f"lambda line: {source(plan)}", namespace)
+
+    def _required(self, node):
+        """
+        匹配的行必然满足的字面量条件: 返回若干组，每组至少出现其一，各组都要满足。
+        NOT 之下的条件不提供任何信息。
+        """
+        if node.op == 'term':
+            if not self.regex:
+                return [[node.term]]
+            literals = self._regexes[node.term][1]
+            return [literals] if literals else []
+        if node.op == 'not':
+            return []
+        groups = [self._required(child) for child in node.children]
+        if node.op == 'and':
+            return [group for child in groups for group in child]
+        if not all(groups):
+            return []
+        # OR: 每个分支各取最有区分度的一组，合起来至少出现其一
+        best = [min(child, key=self._group_selectivity) for child in groups]
+        return [sorted({literal for group in best for literal in group})]
+
+    def _group_selectivity(self, group):
+        selectivity = self._selectivity
+        return sum(selectivity[l] if l in selectivity else _guess_selectivity(l) for l in group)
+
+    def estimate(self, samples, encoding):
+        """ 用文件样本(read_samples 的结果)统计各关键词的命中率，重新生成求值计划 """
+        lines = []
+        for block in samples:
+            lines.extend(block.decode(encoding, 'replace').splitlines())
+            if len(lines) >= QUERY_SAMPLE_LINES:
+                break
+        lines = lines[:QUERY_SAMPLE_LINES]
+        self.estimated = True
+        if not lines:
+            return
+        if self._lower:
+            lines = [line.lower() for line in lines]
+        count = len(lines)
+        for key in self._selectivity:
+            if self.regex:
+                search = self._regexes[key][0].search
+                hits = sum(1 for line in lines if search(line) is not None)
+            else:
+                hits = sum(1 for line in lines if key in line)
+            # 样本中没有出现的关键词也不当作不可能出现
+            self._selectivity[key] = (hits + 0.5) / (count + 1)
+        self._build()
+
+    def describe(self):
+        """ 按求值顺序写出的计划，每个关键词后标注估计的命中率 """
+        return format_query(self.plan, self._selectivity)
+
+    def index_terms(self):
+        return self._groups or None
+
+    def match(self, line):
+        """ 返回命中关键词的位掩码，不满足查询条件时返回0 """
+        if self._lower:
+            line = line.lower()
+        if not self._test(line):
+            return 0
+        mask = 0
+        if self.regex:
+            for key, bits in self._positive:
+                if self._regexes[key][0].search(line) is not None:
+                    mask |= bits
+        else:
+            for key, bits in self._positive:
+                if key in line:
+                    mask |= bits
+        return mask or self._matched
+
+    def __getstate__(self):
+        # 编译出的匹配函数无法序列化，交给子进程时重新生成
+        state = self.__dict__.copy()
+        del state['_test']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._test = self._compile(self.plan)
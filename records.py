@@ -0,0 +1,199 @@
+"""
+多行记录模式: 把异常堆栈等续行和它前面的首行合成一条记录，按整条记录匹配关键词
+
+    searcher = LogSearcher(['exception'], record_start=RECORD_START)
+    for match in searcher.search('app.log'):
+        print(match.line_number, match.text)     # text 为整条记录，可能有多行
+
+以匹配 record_start 正则表达式(从行首开始匹配，默认是时间戳)的行作为一条记录的
+开始，直到下一个这样的行之前都属于这条记录；文件开头不匹配的行自成一条记录。
+Match 的行号、偏移和长度都指整条记录。
+
+仍然只扫描一遍: 按块做字节级预筛，只在关键词出现的位置向前、向后逐行找到
+所在记录的边界，没有命中的记录不必拆分和解码，速度与按行搜索相当。跨块的记录
+只保留最多 RECORD_MAX_SIZE 字节，超长的记录(如数兆字节的堆栈)只按开头的部分
+匹配和显示，内存占用有上限。
+"""
+import re
+import functools
+
+from search import Match, decode_line
+
+# 默认的记录开始: 行首的日期时间，如 2024-05-01 12:00:00 或 [2024-05-01T12:00:00
+RECORD_START = r'\[?\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}'
+
+# 一条记录最多保留的字节数，超过的部分不参与匹配也不显示
+RECORD_MAX_SIZE = 1024 * 1024
+
+
+@functools.lru_cache(maxsize=16)
+def compile_record_start(pattern, encoding):
+    """ 把记录开始的正则表达式编译为在原始字节上匹配的形式，有误时抛出 re.error """
+    return re.compile(pattern.encode(encoding))
+
+
+def align_ranges(data, ranges, start_re):
+    """
+    并行搜索时把各段的边界从行首后移到记录开始处，保证每条记录完整地落在一段中。
+    ranges 为 split_ranges() 的结果，后移后为空的段被合并掉。
+    """
+    size = len(data)
+    bounds = [ranges[0][0]] if ranges else []
+    for _, stop in ranges:
+        pos = stop
+        while pos < size and start_re.match(data, pos) is None:
+            pos = data.find(b'\n', pos) + 1 or size
+        if pos > bounds[-1]:
+            bounds.append(pos)
+    return list(zip(bounds, bounds[1:]))
+
+
+class RecordAssembler:
+    """
+    在逐块扫描的同时把行合成记录并匹配，块须以完整的行结束。
+
+    块末尾的记录可能延续到下一块，保存到下一块中出现新的记录开始为止(最多
+    RECORD_MAX_SIZE 字节)；扫描结束后调用 finish() 输出最后一条记录。
+    """
+
+    def __init__(self, start_re, matcher, encoding, path=None, max_size=RECORD_MAX_SIZE):
+        self.start_re = start_re
+        self.matcher = matcher
+        self.encoding = encoding
+        self.path = path
+        self.max_size = max_size
+        # 延续到下一块的记录: 偏移、起始行号、保留的内容、总长度、是否可能命中
+        self._offset = None
+        self._line = 0
+        self._data = bytearray()
+        self._size = 0
+        self._hit = False
+
+    def _is_start(self, block, pos):
+        return self.start_re.match(block, pos) is not None
+
+    def _record_start(self, block, pos):
+        """ pos(行首)所在记录在块中的开始位置，记录开始于之前的块时返回 -1 """
+        while not self._is_start(block, pos):
+            if pos == 0:
+                return -1
+            pos = block.rfind(b'\n', 0, pos - 1) + 1
+        return pos
+
+    def _next_start(self, block, pos):
+        """ pos 所在行之后的第一个记录开始位置，没有时返回块的长度 """
+        size = len(block)
+        while True:
+            pos = block.find(b'\n', pos) + 1
+            if pos == 0 or pos >= size:
+                return size
+            if self._is_start(block, pos):
+                return pos
+
+    def block(self, block, base_offset, base_line, literals, stats):
+        """
+        处理一块(行号从 base_line + 1 开始计)，依次返回其中结束的记录中匹配的。
+        literals 为预筛用的字面量(见 KeywordMatcher.byte_literals)，为空时检查每条记录。
+        """
+        size = len(block)
+        if not size:
+            return
+        # 块中第一条记录开始之前的部分属于上一块末尾的记录；最后一条记录可能延续到下一块
+        first = 0 if self._is_start(block, 0) else self._next_start(block, 0)
+        last = size
+        if first < size:
+            last = self._record_start(block, block.rfind(b'\n', 0, size - 1) + 1)
+
+        records = {}        # 块中完整的、可能命中的记录: 开始 -> 结束
+        head_hit = tail_hit = literals is None
+        if literals is None:
+            start = first
+            while start < last:
+                records[start] = start = self._next_start(block, start)
+        else:
+            haystack = block.lower() if self.matcher.fold_case else block
+            is_start = self.start_re.match
+            for literal in literals:
+                i = haystack.find(literal)
+                while i >= 0:
+                    if i < first:
+                        head_hit = True
+                        i = haystack.find(literal, first)
+                        continue
+                    if i >= last:
+                        tail_hit = True
+                        break
+                    # 多数记录只有一行，先直接检查所在行和下一行
+                    start = block.rfind(b'\n', 0, i) + 1
+                    if is_start(block, start) is None:
+                        start = self._record_start(block, start)
+                    end = block.find(b'\n', i) + 1
+                    if not 0 < end < size or is_start(block, end) is None:
+                        end = self._next_start(block, i)
+                    records[start] = end
+                    # 同一条记录只需找到一次
+                    i = haystack.find(literal, end)
+
+        if first:
+            if self._offset is None:
+                # 文件(或本段)开头不以记录开始的行自成一条记录
+                self._begin(base_offset, base_line + 1, b'')
+            self._extend(block[:first])
+            self._hit = self._hit or head_hit
+            if first < size:
+                yield from self.finish(stats)
+        elif self._offset is not None:
+            yield from self.finish(stats)
+
+        emit = self._emit
+        line_number = base_line
+        counted = 0
+        for start in sorted(records):
+            line_number += block.count(b'\n', counted, start)
+            counted = start
+            end = records[start]
+            match = emit(base_offset + start, line_number + 1, block[start:end], end - start, stats)
+            if match is not None:
+                yield match
+        if last < size:
+            line_number += block.count(b'\n', counted, last)
+            self._begin(base_offset + last, line_number + 1, block[last:])
+            self._hit = tail_hit
+
+    def _begin(self, offset, line_number, data):
+        self._offset = offset
+        self._line = line_number
+        self._data = bytearray(data[:self.max_size])
+        self._size = len(data)
+        self._hit = False
+
+    def _extend(self, data):
+        room = self.max_size - len(self._data)
+        if room > 0:
+            self._data += data[:room]
+        self._size += len(data)
+
+    def finish(self, stats):
+        """ 输出延续中的记录(如果匹配)，扫描结束时调用 """
+        if self._offset is None:
+            return
+        offset, data, hit = self._offset, bytes(self._data), self._hit
+        self._offset = None
+        self._data = bytearray()
+        if hit:
+            match = self._emit(offset, self._line, data, self._size, stats)
+            if match is not None:
+                yield match
+
+    def _emit(self, offset, line_number, data, size, stats):
+        """ 匹配一条记录(原始字节 data，总长度 size)，匹配时返回 Match """
+        if size > self.max_size:
+            # 超长的记录只保留开头的完整行
+            data = data[:self.max_size]
+            data = data[:data.rfind(b'\n') + 1 or len(data)]
+            stats.truncated_records += 1
+        text = decode_line(data, self.encoding, stats)
+        mask = self.matcher.match(text)
+        if mask:
+            return Match(line_number, offset, len(data), mask, text.rstrip('\r\n'), self.path)
+        return None
@@ -0,0 +1,2243 @@
+"""
+日志搜索核心模块
+
+不依赖 PyQt5，图形界面和命令行共用同一套搜索逻辑:
+
+    searcher = LogSearcher(['error', 'timeout'], and_mode=False)
+    for match in searcher.search('app.log'):
+        print(match.line_number, match.text)
+
+命令行用法见 main() 或 `log-search --help`。
+"""
+import io
+import os
+import re
+import bz2
+import sys
+import gzip
+import lzma
+import mmap
+import time
+import queue
+import fnmatch
+import hashlib
+import argparse
+import functools
+import itertools
+import threading
+import unicodedata
+import multiprocessing
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+try:
+    from re import _parser as sre_parse     # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# 依次尝试的文件编码
+ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'latin-1', 'iso-8859-1']
+
+# 界面默认的最大结果数(结果只保存位置信息，每条约 32 字节)
+MAX_RESULTS = 1000000
+
+# 检测编码时抽取的样本数和每块样本大小
+SAMPLE_COUNT = 8
+SAMPLE_SIZE = 64 * 1024
+
+# 内存映射扫描时每块的大小(会对齐到换行符)
+SCAN_BLOCK_SIZE = 4 * 1024 * 1024
+
+# 解压缩时每次读取的解压后数据大小，以及后台线程最多预先解压的块数
+DECOMPRESS_BLOCK_SIZE = 4 * 1024 * 1024
+DECOMPRESS_QUEUE_DEPTH = 4
+
+# 按文件头魔数识别的压缩格式
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+
+# 不小于该大小的文件切成 CHUNK_SIZE 左右的段，交给多个进程并行搜索
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# 计算文件指纹时哈希的文件头大小
+FINGERPRINT_HEAD_SIZE = 4096
+
+# 增量搜索时核对已搜索部分末尾的字节数，以及最多记住的(文件, 查询)数
+RESUME_TAIL_SIZE = 4096
+SEARCH_CACHE_SIZE = 8
+
+# 搜索目录时默认包含的文件
+DEFAULT_INCLUDE = ['*']
+
+# 最多缓存多少个编译好的正则表达式
+REGEX_CACHE_SIZE = 64
+
+# 界面和命令行刷新进度的间隔(秒)，与行数和扫描速度无关
+PROGRESS_INTERVAL = 0.2
+
+# 关键词不超过这么多个时，各命中组合的计数按位掩码直接索引数组
+KEYWORD_COUNTS_ARRAY_BITS = 12
+
+# 一条匹配结果: 行号(从1开始)、行首字节偏移、行字节长度、命中关键词位掩码、行内容、所在文件
+Match = namedtuple('Match', ['line_number', 'offset', 'length', 'mask', 'text', 'path'])
+
+# 进度快照: 已处理和总字节数、已扫描行数、结果数、已用时间(秒)，
+# skipped 为增量搜索时跳过的字节数(不计入速度)
+Progress = namedtuple('Progress', ['bytes_done', 'bytes_total', 'lines', 'results', 'elapsed',
+                                   'skipped'])
+
+
+# 解析关键词输入(空格或|分隔多个关键词)，正则表达式中的 | 是选择，只按空白分隔
+def parse_keywords(text, regex=False):
+    text = text.strip()
+    if not text:
+        return []
+    if '|' in text and not regex:
+        return [k.strip() for k in text.split('|') if k.strip()]
+    return [k.strip() for k in text.split() if k.strip()]
+
+
+# 从文件头、尾和中间均匀抽取若干块样本，每块都裁剪到完整的行
+def read_samples(f, size):
+    if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+        f.seek(0)
+        return [f.read()]
+    samples = []
+    step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    for i in range(SAMPLE_COUNT):
+        start = i * step
+        f.seek(start)
+        block = f.read(SAMPLE_SIZE)
+        if start > 0:
+            # 丢掉可能从多字节字符中间开始的第一行
+            block = block[block.find(b'\n') + 1:]
+        if start + SAMPLE_SIZE < size:
+            block = block[:block.rfind(b'\n') + 1]
+        samples.append(block)
+    return samples
+
+
+# 按自然顺序排序文件名，使 app.log.2 排在 app.log.10 之前
+def natural_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+# 展开文件和目录列表，目录会递归查找符合 include 且不符合 exclude 的文件
+def iter_log_files(paths, include=None, exclude=None):
+    include = include or DEFAULT_INCLUDE
+    exclude = exclude or []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in names:
+                    if (any(fnmatch.fnmatch(name, pattern) for pattern in include)
+                            and not any(fnmatch.fnmatch(name, pattern) for pattern in exclude)):
+                        found.append(os.path.join(root, name))
+            found.sort(key=natural_key)
+        else:
+            # 明确指定的文件不受 include/exclude 限制
+            found = [path]
+        for file_path in found:
+            if file_path not in seen:
+                seen.add(file_path)
+                yield file_path
+
+
+# 把文件从 start(须位于行首)开始切成约 CHUNK_SIZE 大小、边界在行首的若干段
+def split_ranges(f, size, start=0, chunk_size=CHUNK_SIZE):
+    ranges = []
+    while start < size:
+        f.seek(start + chunk_size)
+        f.readline()
+        stop = min(f.tell(), size)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+# 文件指纹: 大小、修改时间和文件头的哈希，用于判断索引等缓存是否仍然有效
+def file_fingerprint(path):
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        head = hashlib.sha1(f.read(FINGERPRINT_HEAD_SIZE)).hexdigest()
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'head': head}
+
+
+# 根据文件头的魔数判断压缩格式，未压缩时返回 None
+def detect_compression(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    for magic, compression in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _open_zstd(f):
+    try:
+        import zstandard
+    except ImportError:
+        try:
+            from compression import zstd    # Python 3.14+
+        except ImportError:
+            raise OSError("读取 .zst 文件需要安装 zstandard: pip install zstandard") from None
+        return zstd.ZstdFile(f)
+    return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+
+
+# 在已打开的压缩文件上创建解压后的数据流
+def open_decompressed(f, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=f)
+    if compression == 'bz2':
+        return bz2.BZ2File(f)
+    if compression == 'xz':
+        return lzma.LZMAFile(f)
+    if compression == 'zstd':
+        return _open_zstd(f)
+    raise ValueError(f"不支持的压缩格式: {compression}")
+
+
+class PrefetchReader(io.RawIOBase):
+    """
+    在后台线程中按块解压，解压和匹配同时进行。
+
+    zlib/bz2/lzma 解压时会释放 GIL，所以后台线程解压下一块时主线程可以继续匹配；
+    队列长度有限，内存占用不超过 DECOMPRESS_QUEUE_DEPTH 个块。
+    """
+
+    def __init__(self, stream, block_size=DECOMPRESS_BLOCK_SIZE, depth=DECOMPRESS_QUEUE_DEPTH):
+        super().__init__()
+        self._queue = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._error = None
+        self._buffer = b''
+        self._pos = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, args=(stream, block_size), daemon=True)
+        self._thread.start()
+
+    def _run(self, stream, block_size):
+        try:
+            while not self._stop.is_set():
+                data = stream.read(block_size)
+                self._put(data)
+                if not data:
+                    return
+        except Exception as e:
+            self._error = e
+            self._put(b'')
+
+    def _put(self, data):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """ 返回最多 size 字节，每次最多一个解压块；size 为负时读到结尾 """
+        if size is None or size < 0:
+            return self.readall()
+        if self._pos >= len(self._buffer):
+            if self._eof:
+                return b''
+            data = self._queue.get()
+            if not data:
+                self._eof = True
+                if self._error is not None:
+                    raise OSError(f"解压失败: {self._error}") from self._error
+                return b''
+            self._buffer = data
+            self._pos = 0
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+# 按候选顺序找出能解码样本的编码，不再整文件试读
+def detect_encoding(path, encodings=ENCODINGS):
+    compression = detect_compression(path)
+    with open(path, 'rb') as f:
+        if compression is None:
+            samples = read_samples(f, os.fstat(f.fileno()).st_size)
+        else:
+            # 压缩文件无法随机读取，只取开头一段解压后的数据
+            try:
+                with open_decompressed(f, compression) as stream:
+                    block = stream.read(SAMPLE_SIZE * SAMPLE_COUNT)
+            except Exception as e:
+                # 各解压库数据损坏时抛出的异常不同(zlib.error、LZMAError、ZstdError 等)
+                raise OSError(f"解压失败: {e}") from e
+            samples = [block[:block.rfind(b'\n') + 1] or block]
+    # 纯 ASCII 的行任何候选编码都能解码，只需检查其余的行
+    lines = [line for block in samples for line in block.split(b'\n') if not line.isascii()]
+    # 每100行样本容忍1行坏字节，避免个别脏数据把整个文件判成 latin-1
+    tolerance = len(lines) // 100
+    for encoding in encodings:
+        bad = 0
+        for line in lines:
+            try:
+                line.decode(encoding)
+            except UnicodeDecodeError:
+                bad += 1
+                if bad > tolerance:
+                    break
+        if bad <= tolerance:
+            return encoding
+    return None
+
+
+# 解码一行，个别无法解码的字节用替换字符代替并计数，不会因此重新扫描整个文件
+def decode_line(raw, encoding, stats):
+    try:
+        return raw.decode(encoding)
+    except UnicodeDecodeError:
+        stats.decode_errors += 1
+        return raw.decode(encoding, 'replace')
+
+
+def _overlaps(a, b):
+    """ a 的结尾与 b 的开头是否可以重叠(如 abc 与 bcd) """
+    return any(a[-k:] == b[:k] for k in range(1, min(len(a), len(b))))
+
+
+def _best_literals(choices):
+    """ 从多组"至少出现其一"的字面量中选出最有区分度的一组: 最短的一个越长越好 """
+    choices = [c for c in choices if c]
+    if not choices:
+        return None
+    return max(choices, key=lambda c: (min(map(len, c)), -len(c)))
+
+
+def _required_literals(items, ignore_case):
+    """
+    从解析后的正则中找出匹配时必然出现的字面量，返回一组"至少出现其一"的字符串；
+    找不到时返回 None。分组、重复至少一次的部分和各分支都有字面量的选择会被展开。
+    """
+    choices = []
+    run = []
+
+    def end_run():
+        if run:
+            choices.append([''.join(run)])
+            run.clear()
+
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av).lower() if ignore_case else chr(av))
+            continue
+        if op is sre_parse.SUBPATTERN:
+            add_flags, del_flags, sub = av[1], av[2], av[3]
+            if (add_flags | del_flags) & re.IGNORECASE:
+                # 局部改变大小写规则的部分不参与预筛
+                end_run()
+                continue
+            if all(sub_op is sre_parse.LITERAL for sub_op, _ in sub):
+                # 纯字面量的分组接在前后的字面量上
+                run.extend(chr(c).lower() if ignore_case else chr(c) for _, c in sub)
+                continue
+            end_run()
+            choices.append(_required_literals(sub, ignore_case))
+        elif op is sre_parse.BRANCH:
+            end_run()
+            branches = [_required_literals(sub, ignore_case) for sub in av[1]]
+            if all(branches):
+                choices.append(sorted({literal for branch in branches for literal in branch}))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+                    getattr(sre_parse, 'POSSESSIVE_REPEAT', None)) and av[0] >= 1:
+            end_run()
+            choices.append(_required_literals(av[2], ignore_case))
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            end_run()
+            choices.append(_required_literals(av, ignore_case))
+        else:
+            end_run()
+    end_run()
+    return _best_literals(choices)
+
+
+@functools.lru_cache(maxsize=REGEX_CACHE_SIZE)
+def compile_regex(pattern, case_sensitive):
+    """
+    编译正则表达式并提取必然出现的字面量，结果按(表达式, 大小写规则)缓存。
+
+    返回(编译后的正则, 字面量列表或 None)；不区分大小写时字面量为小写。
+    表达式有误时抛出 re.error。
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    compiled = re.compile(pattern, flags)
+    parsed = sre_parse.parse(pattern, flags)
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+    if case_sensitive and ignore_case:
+        # 表达式用 (?i) 自行忽略大小写，区分大小写的预筛不适用
+        return compiled, None
+    return compiled, _required_literals(parsed, ignore_case)
+
+
+class KeywordMatcher:
+    """
+    多关键词匹配器: 把所有关键词编译成一个交替正则，扫描一遍就能得到整行的命中情况。
+
+    或模式在第一个命中处即可判定；与模式从最长(通常也最罕见)的关键词开始逐个用
+    子串查找确认，缺少任何一个即可判定不匹配，全部出现时掩码必然是 full_mask。
+
+    不区分大小写时只有关键词中有大小写字母才把行转为小写，只有数字、汉字等的
+    关键词直接在原始行上查找，块扫描时也不必把整块转为小写(见 fold_case)。
+
+    regex 为真时每个关键词是一个正则表达式(见 compile_regex)，从中提取的必然出现的
+    字面量用于字节级预筛，正则只在包含这些字面量的行上执行。
+    """
+
+    def __init__(self, keywords, and_mode=True, case_sensitive=False, regex=False):
+        self.keywords = list(keywords)
+        self.and_mode = and_mode
+        self.case_sensitive = case_sensitive
+        self.regex = regex
+        self.full_mask = (1 << len(self.keywords)) - 1
+        # 扫描时是否需要把数据转为小写: 关键词都没有大小写时不必转换；
+        # 正则自行忽略大小写，但预筛用的字面量是小写的。数据按块转为小写时，
+        # 字面量也要经过同样的字节转换(见 byte_literals)，调用方不必另做处理
+        self.fold_case = not case_sensitive and (
+            regex or any(k.lower() != k.upper() for k in self.keywords))
+        if regex:
+            self._init_regex()
+            return
+
+        # 相同的关键词共用一个位掩码
+        bits = {}
+        for i, keyword in enumerate(self.keywords):
+            if not case_sensitive:
+                keyword = keyword.lower()
+            bits[keyword] = bits.get(keyword, 0) | 1 << i
+        self._bits = bits
+
+        # 较长的关键词排在前面，同一位置优先匹配长的
+        ordered = sorted(bits, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(k) for k in ordered))
+        self._anchor = ordered[0]
+
+        # 命中一个关键词时，包含在其中的较短关键词也必然出现
+        self._implied = {}
+        for keyword in ordered:
+            mask = 0
+            for other in ordered:
+                if other in keyword:
+                    mask |= bits[other]
+            self._implied[keyword] = mask
+
+        # 与模式逐个确认的关键词: 包含在更长关键词中的不必再查
+        self._required = [k for k in ordered
+                          if not any(k != other and k in other for other in ordered)]
+
+        # 关键词首尾可能重叠时，单次扫描会漏掉被"吃掉"的那个，需要逐个补查
+        self._recheck = [(k, bits[k]) for k in ordered]
+        self._needs_recheck = any(
+            a != b and _overlaps(a, b) for a in ordered for b in ordered)
+
+        # 字节级预筛: 与模式下只看锚点，或模式下任一关键词
+        self._prefilter = [self._anchor] if and_mode else list(bits)
+
+    def _init_regex(self):
+        # 相同的表达式共用一个位掩码
+        bits = {}
+        for i, pattern in enumerate(self.keywords):
+            bits[pattern] = bits.get(pattern, 0) | 1 << i
+        regexes = []
+        for pattern, mask in bits.items():
+            compiled, literals = compile_regex(pattern, self.case_sensitive)
+            regexes.append((mask, compiled, literals))
+        # 与模式下先检查字面量最有区分度的表达式，尽早排除不匹配的行
+        regexes.sort(key=lambda r: min(map(len, r[2])) if r[2] else 0, reverse=True)
+        self._regexes = regexes
+
+        literals = [r[2] for r in regexes]
+        if self.and_mode:
+            self._prefilter = _best_literals(literals)
+        elif all(literals):
+            self._prefilter = sorted({literal for group in literals for literal in group})
+        else:
+            self._prefilter = None
+
+    def index_terms(self):
+        """
+        用于倒排索引的查询: 返回若干组字面量，每组至少出现其一，各组都要满足；
+        无法用字面量缩小范围时返回 None。
+        """
+        if not self.regex:
+            if self.and_mode:
+                return [[keyword] for keyword in self.keywords]
+            return [list(self.keywords)]
+        if self.and_mode:
+            return [r[2] for r in self._regexes if r[2]] or None
+        return [self._prefilter] if self._prefilter else None
+
+    def _collect(self, line, pos=0):
+        """ 从 pos 开始收集整行命中的关键词位掩码 """
+        mask = 0
+        implied = self._implied
+        full_mask = self.full_mask
+        for m in self._pattern.finditer(line, pos):
+            mask |= implied[m.group()]
+            if mask == full_mask:
+                return mask
+        if self._needs_recheck and mask:
+            for keyword, bits in self._recheck:
+                if not mask & bits and keyword in line:
+                    mask |= bits
+        return mask
+
+    def byte_literals(self, encoding):
+        """
+        返回用于字节级预筛的编码后关键词: 匹配的行必然包含其中至少一个。
+
+        不区分大小写时预筛在 bytes.lower() 后的数据上进行，它只转换 ASCII 字母，
+        所以关键词里有非 ASCII 的大小写字母(如 É)时无法预筛，返回 None。
+        编码不兼容 ASCII 换行(如 UTF-16)时同样返回 None。
+
+        fold_case 为真时编码后的关键词同样经过 bytes.lower()，与数据做相同的转换:
+        GBK 等编码的双字节字符的第二个字节可能落在 ASCII 字母范围内(如 連 为 df 42)，
+        只转换数据会漏掉这些字符。
+        """
+        if 'a\n'.encode(encoding) != b'a\n' or self._prefilter is None:
+            return None
+        keywords = self._prefilter
+        literals = []
+        for keyword in keywords:
+            if not self.case_sensitive and any(
+                    ord(c) > 127 and c.lower() != c.upper() for c in keyword):
+                return None
+            try:
+                literal = keyword.encode(encoding)
+            except UnicodeEncodeError:
+                # 该编码无法表示的关键词不可能出现在文件中
+                continue
+            literals.append(literal.lower() if self.fold_case else literal)
+        return literals
+
+    def _match_regex(self, line):
+        mask = 0
+        for bits, pattern, literals in self._regexes:
+            # 区分大小写时先用字面量排除，不必执行正则
+            if (literals is not None and self.case_sensitive
+                    and not any(literal in line for literal in literals)):
+                found = False
+            else:
+                found = pattern.search(line) is not None
+            if found:
+                mask |= bits
+            elif self.and_mode:
+                return 0
+        return mask
+
+    def match(self, line):
+        """ 返回命中关键词的位掩码，不满足与/或条件时返回0 """
+        if self.regex:
+            return self._match_regex(line)
+        if self.fold_case:
+            line = line.lower()
+        if self.and_mode:
+            # 与模式: 缺少任何一个关键词即可判定不匹配，不必收集命中的位置
+            for keyword in self._required:
+                if keyword not in line:
+                    return 0
+            return self.full_mask
+        # 或模式: 找到第一个命中即可判定匹配，再从该处收集全部命中
+        m = self._pattern.search(line)
+        if m is None:
+            return 0
+        return self._collect(line, m.start())
+
+
+class SearchStats:
+    """ 一次搜索的统计信息，path 为空时表示多个文件的汇总 """
+
+    def __init__(self, path, file_size=None):
+        self.path = path
+        self.encoding = None
+        self.file_size = os.path.getsize(path) if file_size is None else file_size
+        self.total_lines = 0        # 文件总行数: 有最新的行偏移索引时预先得知，否则扫描完才知道
+        self.lines_scanned = 0
+        self.bytes_scanned = 0
+        self.result_count = 0
+        self.decode_errors = 0      # 含无法解码字节的行数(只统计实际解码过的行)
+        self.truncated_records = 0  # 多行记录模式下超过 RECORD_MAX_SIZE、只匹配了开头部分的记录数
+        self.compression = None     # 压缩格式，如 gzip
+        self.index_used = False     # 是否使用了索引
+        self.index_stale = False    # 文件有索引但已过期，改为扫描
+        self.resumed_from = 0       # 增量搜索时从该偏移开始扫描，之前的结果来自上次搜索
+        self.cache_reset = False    # 上次的结果因文件被截断或轮转而作废，重新搜索整个文件
+        self.window = None          # 按时间范围搜索时实际扫描的字节范围(开始, 结束)
+        self.relative_lines = False # 时间窗口不从文件开头开始且没有行偏移索引，行号从窗口开始处计
+        self.histogram = None       # 输出的结果按时间的分布(histogram.TimeHistogram)
+        self.keyword_counts = None  # 各关键词的命中数及组合(KeywordCounts)，包括超出结果数上限的
+        self.limit_reached = False
+        self.cancelled = False
+        self.error = None           # 多文件搜索时记录单个文件的错误，不中断其他文件
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """ 扫描速度(MB/s)，增量搜索时只计算新扫描的部分 """
+        scanned = self.bytes_scanned - (self.window[0] if self.window else self.resumed_from)
+        return scanned / 1024 / 1024 / self.elapsed if self.elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """ 当前进度(Progress)，可以安全地交给其他线程；按时间范围搜索时只计窗口内的部分 """
+        elapsed = self.elapsed or time.monotonic() - self.started
+        if self.window is not None:
+            start, stop = self.window
+            return Progress(min(max(self.bytes_scanned - start, 0), stop - start), stop - start,
+                            self.lines_scanned, self.result_count, elapsed, 0)
+        return Progress(min(self.bytes_scanned, self.file_size), self.file_size, self.lines_scanned,
+                        self.result_count, elapsed, self.resumed_from)
+
+
+class KeywordCounts:
+    """
+    各命中组合的匹配数: masks[命中位掩码] 为命中这些关键词的匹配行数。每个匹配
+    只需一次计数，各关键词的命中数和两两同时出现的次数在结束后由组合推算。
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.full_mask = (1 << len(self.keywords)) - 1
+        # 关键词不多时按位掩码直接索引数组，否则用 Counter
+        if len(self.keywords) <= KEYWORD_COUNTS_ARRAY_BITS:
+            self.masks = array('Q', bytes(8 << len(self.keywords)))
+        else:
+            self.masks = Counter()
+
+    def add(self, mask, count=1):
+        self.masks[mask & self.full_mask] += count
+
+    def merge(self, other):
+        """ 加上另一份(如并行搜索的一段或另一个文件的)计数 """
+        for mask, count in other.combinations():
+            self.masks[mask] += count
+
+    @property
+    def total(self):
+        return sum(self.masks.values()) if isinstance(self.masks, Counter) else sum(self.masks)
+
+    def combinations(self):
+        """ 出现过的命中组合 [(位掩码, 行数)]，行数多的在前 """
+        if isinstance(self.masks, Counter):
+            items = [(mask, count) for mask, count in self.masks.items() if count]
+        else:
+            items = [(mask, count) for mask, count in enumerate(self.masks) if count]
+        items.sort(key=lambda item: item[1], reverse=True)
+        return items
+
+    def matrix(self):
+        """ 同时命中两个关键词的行数矩阵，对角线上是各关键词的命中行数 """
+        size = len(self.keywords)
+        matrix = [[0] * size for _ in range(size)]
+        for mask, count in self.combinations():
+            bits = [i for i in range(size) if mask >> i & 1]
+            for i in bits:
+                row = matrix[i]
+                for j in bits:
+                    row[j] += count
+        return matrix
+
+
+def _lines_before(f, start, count, line_number=0):
+    """
+    返回偏移 start(须位于行首)之前的最多 count 行 [(行号, 偏移, 原始字节, None)]，按行号升序；
+    紧挨着 start 的一行行号为 line_number。只在从文件中间开始扫描时读取一次。
+    """
+    if count <= 0 or start <= 0:
+        return []
+    size = min(start, 64 * 1024)
+    while True:
+        f.seek(start - size)
+        data = f.read(size)
+        if data.count(b'\n') > count or size == start:
+            break
+        size = min(size * 4, start)
+    raws = data.splitlines(keepends=True)
+    if size < start:
+        # 第一行可能不完整
+        raws = raws[1:]
+    raws = raws[-count:]
+    offset = start - sum(map(len, raws))
+    lines = []
+    for i, raw in enumerate(raws):
+        lines.append((line_number - len(raws) + 1 + i, offset, raw, None))
+        offset += len(raw)
+    return lines
+
+
+class ContextWindow:
+    """
+    grep -A/-B/-C 式的上下文: 在扫描的同一遍中为每个匹配补上之前 before 行和之后
+    after 行。重叠或相邻的窗口合并，每行只输出一次；上下文行是 mask 为 0 的 Match，
+    和匹配一起按行号顺序输出，行号与扫描使用的行号一致。
+
+    之前的行来自有界的环形缓冲区: 逐行扫描时是最近读过的行；按块扫描时在块内直接
+    向前查找，块开头的匹配再用上一块末尾保存的几行。之后的行由继续进行的扫描提供。
+    不需要再次读取或定位文件，开销只与匹配数和块数成正比。
+    """
+
+    def __init__(self, before=0, after=0, path=None, last_line=0):
+        self.before = before
+        self.after = after
+        self.path = path
+        # 最近的若干行: (行号, 偏移, 原始字节, 已解码的内容或 None)
+        self.ring = deque(maxlen=before)
+        self.last_line = last_line          # 已输出的最后一行，不会再输出它之前的行
+        self.pending = 0                    # 上一个匹配之后还要输出的行数
+
+    def seed(self, lines):
+        """ 从文件中间开始扫描时，放入起点之前的几行(见 _lines_before) """
+        self.ring.extend(lines)
+
+    def _line(self, line_number, offset, raw, line, encoding, stats):
+        self.last_line = line_number
+        if line is None:
+            line = decode_line(raw, encoding, stats)
+        return Match(line_number, offset, len(raw), 0, line.rstrip('\r\n'), self.path)
+
+    def feed(self, line_number, offset, raw, line, encoding, stats):
+        """ 逐行扫描时不匹配的一行: 在上一个匹配之后的窗口中时返回上下文行，否则放入缓冲区 """
+        if self.pending:
+            self.pending -= 1
+            return self._line(line_number, offset, raw, line, encoding, stats)
+        if self.before:
+            self.ring.append((line_number, offset, raw, line))
+        return None
+
+    def matched(self, match, encoding, stats):
+        """ 逐行扫描时匹配的一行: 返回它之前尚未输出的上下文行 """
+        first = max(match.line_number - self.before, self.last_line + 1)
+        lines = [self._line(*entry, encoding, stats) for entry in self.ring
+                 if first <= entry[0] < match.line_number]
+        self.ring.clear()
+        self.last_line = match.line_number
+        self.pending = self.after
+        return lines
+
+    def block(self, block, base_offset, base_line, matches, encoding, stats):
+        """
+        按块扫描: 在块中依次的匹配(行号从 base_line + 1 开始计)之间插入上下文行。
+        块结束时输出剩余的之后的行，并保存块末尾的几行供下一块开头的匹配使用。
+        """
+        pos = 0                         # 下一个未输出的行在块中的位置
+        line_number = base_line + 1     # 该行的行号
+        for match in matches:
+            start = match.offset - base_offset
+            # 上一个匹配(可能在上一块中)之后的行
+            while self.pending and line_number < match.line_number:
+                end = block.find(b'\n', pos) + 1
+                yield self._line(line_number, base_offset + pos, block[pos:end], None, encoding,
+                                 stats)
+                self.pending -= 1
+                pos = end
+                line_number += 1
+            yield from self._before(block, base_offset, start, match.line_number, encoding, stats)
+            self.last_line = match.line_number
+            self.pending = self.after
+            yield match
+            pos = start + match.length
+            line_number = match.line_number + 1
+
+        size = len(block)
+        while self.pending and pos < size:
+            end = block.find(b'\n', pos) + 1 or size
+            yield self._line(line_number, base_offset + pos, block[pos:end], None, encoding, stats)
+            self.pending -= 1
+            pos = end
+            line_number += 1
+        if self.before:
+            self._keep_tail(block, base_offset, base_line)
+
+    def _before(self, block, base_offset, start, line_number, encoding, stats):
+        first = max(line_number - self.before, self.last_line + 1)
+        lines = []
+        pos = start
+        n = line_number - 1
+        while n >= first and pos > 0:
+            begin = block.rfind(b'\n', 0, pos - 1) + 1
+            lines.append((n, base_offset + begin, block[begin:pos], None))
+            pos = begin
+            n -= 1
+        if n >= first:
+            # 块开头之前的行来自上一块末尾保存的几行
+            lines.extend(entry for entry in reversed(self.ring) if first <= entry[0] <= n)
+        for entry in reversed(lines):
+            yield self._line(*entry, encoding, stats)
+
+    def _keep_tail(self, block, base_offset, base_line):
+        n = base_line + block.count(b'\n')
+        if not block.endswith(b'\n'):
+            n += 1
+        end = len(block)
+        tail = []
+        while len(tail) < self.before and end > 0:
+            begin = block.rfind(b'\n', 0, end - 1) + 1
+            tail.append((n, base_offset + begin, block[begin:end], None))
+            end = begin
+            n -= 1
+        self.ring.extend(reversed(tail))
+
+    def spill(self, data, pos, line_number, stop, match_line, encoding, stats):
+        """
+        分段搜索时段末尾匹配之后的行超出了本段: 继续从 data[pos:stop] 读取，
+        遇到匹配的行为止(它和之后的上下文由下一段输出)。line_number 为 pos 之前的行数。
+        """
+        while self.pending and pos < stop:
+            end = data.find(b'\n', pos, stop) + 1 or stop
+            raw = data[pos:end]
+            line_number += 1
+            line = decode_line(raw, encoding, stats)
+            if match_line(line):
+                return
+            self.pending -= 1
+            self.last_line = line_number
+            yield Match(line_number, pos, len(raw), 0, line.rstrip('\r\n'), self.path)
+            pos = end
+
+
+class ResultStore:
+    """
+    紧凑地保存搜索结果: 每条只记录行号、字节偏移、长度、命中位掩码和文件序号，
+    约 32 字节，行内容在需要时按偏移从文件中读取。
+
+    压缩文件无法按偏移随机读取，这类结果仍保存行内容。
+    """
+
+    # 文件被原地截断后，之前结果的行内容已无法读取
+    TRUNCATED_TEXT = '<文件已被截断，无法读取原内容>'
+
+    def __init__(self):
+        self.paths = []
+        self._file_ids = {}
+        self._encodings = {}
+        self._compressed = []
+        self._texts = {}            # 压缩文件中结果的行内容
+        self._files = {}            # 读取行内容时打开的文件(按文件序号)
+        self._truncated = set()     # 已被原地截断的文件序号
+        self._path_index = array('I')
+        self._line_numbers = array('Q')
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._masks = array('Q')
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        return Match(self._line_numbers[index], self._offsets[index], self._lengths[index],
+                     self._masks[index], self.text(index), self.path(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def set_encoding(self, path, encoding):
+        """ 记录文件编码，读取行内容时使用；未记录时自动检测 """
+        self._encodings[path] = encoding
+
+    def _file_id(self, path):
+        file_id = self._file_ids.get(path)
+        if file_id is None:
+            file_id = self._file_ids[path] = len(self.paths)
+            self.paths.append(path)
+            self._compressed.append(detect_compression(path) is not None)
+        return file_id
+
+    def append(self, match):
+        file_id = self._file_id(match.path)
+        if self._compressed[file_id]:
+            self._texts[len(self)] = match.text
+        self._path_index.append(file_id)
+        self._line_numbers.append(match.line_number)
+        self._offsets.append(match.offset)
+        self._lengths.append(match.length)
+        try:
+            self._masks.append(match.mask)
+        except OverflowError:
+            # 超过64个关键词时位掩码放不进 Q 类型
+            self._masks = list(self._masks)
+            self._masks.append(match.mask)
+
+    def extend(self, matches):
+        """ 批量追加，按列一次性写入数组 """
+        if not matches:
+            return
+        first = len(self)
+        line_numbers, offsets, lengths, masks, texts, paths = zip(*matches)
+        file_ids = [self._file_id(path) for path in paths]
+        for i, file_id in enumerate(file_ids):
+            if self._compressed[file_id]:
+                self._texts[first + i] = texts[i]
+        self._path_index.extend(file_ids)
+        self._line_numbers.extend(line_numbers)
+        self._offsets.extend(offsets)
+        self._lengths.extend(lengths)
+        try:
+            self._masks.extend(masks)
+        except OverflowError:
+            # 超过64个关键词时位掩码放不进 Q 类型
+            self._masks = list(self._masks)
+            self._masks.extend(masks)
+
+    def truncate(self, length):
+        """ 丢弃第 length 条之后的结果 """
+        for column in (self._path_index, self._line_numbers, self._offsets, self._lengths, self._masks):
+            del column[length:]
+        for index in [i for i in self._texts if i >= length]:
+            del self._texts[index]
+
+    def detach(self, path, f=None):
+        """
+        跟踪的文件被轮转或截断后调用: 之后追加的 path 的结果视为新文件。
+
+        之前的结果改为从轮转前打开的旧文件 f 中读取行内容(f 由本对象负责关闭)；
+        f 为空表示文件被原地截断，原内容已无法读取。
+        """
+        file_id = self._file_ids.pop(path, None)
+        if file_id is None:
+            if f is not None:
+                f.close()
+            return
+        old = self._files.pop(file_id, None)
+        if old is not None:
+            old.close()
+        if f is None:
+            self._truncated.add(file_id)
+        else:
+            self._files[file_id] = f
+
+    def path(self, index):
+        return self.paths[self._path_index[index]]
+
+    def line_number(self, index):
+        return self._line_numbers[index]
+
+    def mask(self, index):
+        return self._masks[index]
+
+    def text(self, index):
+        """ 读取第 index 条结果的行内容(不含换行符) """
+        text = self._texts.get(index)
+        if text is not None:
+            return text
+        file_id = self._path_index[index]
+        if file_id in self._truncated:
+            return self.TRUNCATED_TEXT
+        path = self.paths[file_id]
+        f = self._files.get(file_id)
+        if f is None:
+            f = self._files[file_id] = open(path, 'rb')
+        encoding = self._encodings.get(path)
+        if encoding is None:
+            encoding = self._encodings[path] = detect_encoding(path) or 'latin-1'
+        f.seek(self._offsets[index])
+        raw = f.read(self._lengths[index])
+        return raw.decode(encoding, 'replace').rstrip('\r\n')
+
+    def texts(self, start=0, stop=None):
+        """ 依次返回 [start, stop) 范围内结果的行内容 """
+        for index in range(start, len(self) if stop is None else min(stop, len(self))):
+            yield self.text(index)
+
+    def close(self):
+        """ 关闭读取行内容时打开的文件 """
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+class CachedSearch:
+    """ 一个(文件, 查询)已搜索到的位置和结果 """
+
+    def __init__(self, path, encoding):
+        self.covered = 0            # 已搜索到的偏移，总在完整的行之后
+        self.lines = 0              # covered 之前的行数
+        self.decode_errors = 0
+        self.head = None            # 文件头和 covered 之前一段字节的哈希，用于发现截断或轮转
+        self.tail = None
+        self.matches = ResultStore()
+        self.matches.set_encoding(path, encoding)
+
+    def is_valid(self, path):
+        """ 文件是否只在 covered 之后追加了内容 """
+        try:
+            if os.path.getsize(path) < self.covered:
+                return False
+            with open(path, 'rb') as f:
+                return (_hash_range(f, 0, min(self.covered, FINGERPRINT_HEAD_SIZE)) == self.head
+                        and _hash_range(f, max(self.covered - RESUME_TAIL_SIZE, 0), self.covered) == self.tail)
+        except OSError:
+            return False
+
+    def update(self, f, covered, lines, decode_errors):
+        self.covered = covered
+        self.lines = lines
+        self.decode_errors = decode_errors
+        self.head = _hash_range(f, 0, min(covered, FINGERPRINT_HEAD_SIZE))
+        self.tail = _hash_range(f, max(covered - RESUME_TAIL_SIZE, 0), covered)
+
+
+def _hash_range(f, start, stop):
+    f.seek(start)
+    return hashlib.sha1(f.read(stop - start)).hexdigest()
+
+
+class SearchCache:
+    """
+    记住最近搜索过的(文件, 查询)搜索到的位置和结果。
+
+    日志只在末尾追加时，再次搜索同一文件只需扫描新增的部分；文件变小、文件头
+    或已搜索部分末尾的内容变化(被截断或轮转)时作废，重新搜索整个文件。
+    """
+
+    def __init__(self, size=SEARCH_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+
+    def lookup(self, path, key):
+        """ 返回仍然有效的记录；记录失效时删除并返回 False，没有记录时返回 None """
+        key = (os.path.realpath(path), key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not entry.is_valid(path):
+            self._entries.pop(key).matches.close()
+            return False
+        self._entries.move_to_end(key)
+        return entry
+
+    def store(self, path, key, entry):
+        key = (os.path.realpath(path), key)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)[1].matches.close()
+
+    def clear(self):
+        for entry in self._entries.values():
+            entry.matches.close()
+        self._entries.clear()
+
+
+class LogSearcher:
+    """ 与界面无关的日志搜索引擎，按关键词过滤日志行 """
+
+    # 每处理多少行回调一次进度
+    progress_interval = 1000
+
+    def __init__(self, keywords, and_mode=True, case_sensitive=False, max_results=MAX_RESULTS,
+                 use_mmap=True, workers=None, use_index=True, cache=None, regex=False, query=None,
+                 before_context=0, after_context=0, record_start=None, time_window=None,
+                 histogram=False, keyword_counts=False):
+        self.keywords = list(keywords)
+        self.and_mode = and_mode
+        self.case_sensitive = case_sensitive
+        # 关键词为正则表达式，表达式有误时抛出 re.error
+        self.regex = regex
+        self.max_results = max_results
+        self.use_mmap = use_mmap
+        # 文件有最新的索引(见 log_index)时只读取候选行
+        self.use_index = use_index
+        # SearchCache: 再次搜索只在末尾追加了内容的文件时只扫描新增部分
+        self.cache = cache
+        # 并行搜索大文件时使用的进程数，1 表示不并行
+        self.workers = workers or os.cpu_count() or 1
+        # 布尔查询表达式(见 query 模块)，给出时代替 keywords 和 and_mode，
+        # keywords 改为表达式中不在 NOT 之下的关键词；表达式有误时抛出 QueryError
+        self.query = query
+        if query is not None:
+            from query import QueryMatcher
+            self.matcher = QueryMatcher(query, case_sensitive, regex)
+            self.keywords = self.matcher.keywords
+        else:
+            self.matcher = KeywordMatcher(self.keywords, and_mode, case_sensitive, regex)
+        # 每个匹配之前和之后附带输出的行数(见 ContextWindow)，max_results 只计匹配的行
+        self.before_context = before_context
+        self.after_context = after_context
+        # 多行记录模式(见 records 模块): 以匹配该正则表达式的行开始一条记录，按整条记录匹配，
+        # 此时不使用索引、增量搜索和上下文；表达式有误时抛出 re.error
+        self.record_start = record_start
+        if record_start is not None:
+            re.compile(record_start)
+        # 时间范围(见 time_window.TimeWindow): 在按时间顺序写入的文件中二分查找窗口的边界，
+        # 只扫描窗口内的部分
+        self.time_window = time_window
+        # 为真时在输出结果的同时按时间戳统计分布(见 histogram 模块)，结果在 stats.histogram 中
+        self.histogram = histogram
+        # 为真时统计各关键词的命中数及组合(见 KeywordCounts)，结果在 stats.keyword_counts 中；
+        # 达到 max_results 后不再输出结果，但仍扫描完整个文件以统计全部命中
+        self.keyword_counts = keyword_counts
+        self.stats = None
+        self._cancelled = False
+
+    def cancel(self):
+        """ 请求停止搜索，可从其他线程调用 """
+        self._cancelled = True
+
+    def __getstate__(self):
+        # 交给子进程时不带上结果缓存
+        state = self.__dict__.copy()
+        state['cache'] = None
+        return state
+
+    def keywords_for(self, mask):
+        """ 把命中位掩码还原为关键词列表 """
+        return [k for i, k in enumerate(self.keywords) if mask >> i & 1]
+
+    def context_window(self, path, last_line=0):
+        """ 需要上下文时返回新的 ContextWindow，否则返回 None """
+        if not (self.before_context or self.after_context) or self.record_start is not None:
+            return None
+        return ContextWindow(self.before_context, self.after_context, path, last_line)
+
+    def keyword_counter(self):
+        """ 需要统计关键词命中数时返回新的 KeywordCounts，否则返回 None """
+        return KeywordCounts(self.keywords) if self.keyword_counts else None
+
+    def time_histogram(self):
+        """ 需要统计结果的时间分布时返回新的 TimeHistogram，否则返回 None """
+        if not self.histogram:
+            return None
+        from histogram import TimeHistogram
+        return TimeHistogram()
+
+    def record_assembler(self, path, encoding):
+        """ 多行记录模式下返回新的 RecordAssembler，否则返回 None """
+        if self.record_start is None:
+            return None
+        from records import RecordAssembler, compile_record_start
+        return RecordAssembler(compile_record_start(self.record_start, encoding), self.matcher,
+                               encoding, path)
+
+    def search(self, path, encoding=None, progress=None):
+        """
+        搜索文件，以生成器方式依次返回 Match。
+
+        encoding 为空时自动检测；progress(stats) 在扫描过程中定期调用。
+        搜索结束后可从 self.stats 读取统计信息。设置了 cache 时，文件自上次
+        搜索后只在末尾追加了内容的，先返回上次的结果，再只扫描新增的部分。
+        """
+        stats = self.stats = SearchStats(path)
+        stats.histogram = self.time_histogram()
+        stats.keyword_counts = self.keyword_counter()
+        if encoding is None:
+            encoding = detect_encoding(path)
+            if encoding is None:
+                raise UnicodeError(f"无法以支持的编码格式打开文件 {path}")
+        stats.encoding = encoding
+        stats.compression = detect_compression(path)
+        context = self.context_window(path)
+        records = self.record_assembler(path, encoding)
+
+        with open(path, 'rb') as f:
+            if (self.query is not None and not self.matcher.estimated
+                    and stats.compression is None and stats.file_size > 0):
+                # 用文件样本统计各条件的命中率，据此决定求值顺序和预筛的字面量
+                self.matcher.estimate(read_samples(f, stats.file_size), encoding)
+                f.seek(0)
+
+            literals = None
+            if self.use_mmap and stats.file_size > 0:
+                literals = self.matcher.byte_literals(encoding)
+
+            window = None
+            if self.time_window is not None and stats.compression is None:
+                window = self._locate_window(f, stats)
+
+            scan = None
+            # 索引只给出候选行，无法提供上下文，也无法合成多行记录
+            if (literals is not None and stats.compression is None and self.use_index
+                    and context is None and records is None):
+                scan = self._scan_index(f, encoding, stats, progress)
+                if scan is not None and window is not None:
+                    scan = (match for match in scan if window[0] <= match.offset < window[1])
+
+            # 增量搜索: 从上次搜索到的位置继续
+            cached = None
+            cache_key = (tuple(self.keywords), self.and_mode, self.case_sensitive, self.regex,
+                         self.query, self.before_context, self.after_context, encoding)
+            # 多行记录可能跨越上次搜索的末尾，不做增量搜索；时间窗口每次都重新定位
+            if (scan is None and stats.compression is None and self.cache is not None
+                    and records is None and window is None):
+                cached = self.cache.lookup(path, cache_key)
+                if cached is False:
+                    stats.cache_reset = True
+                    cached = None
+                if cached is None:
+                    cached = CachedSearch(path, encoding)
+                stats.resumed_from = cached.covered
+                stats.decode_errors = cached.decode_errors
+            start = cached.covered if cached is not None else 0
+            base_line = cached.lines if cached is not None else 0
+            stop = stats.file_size
+            if window is not None and scan is None:
+                start, stop = stats.window = window
+                base_line = self._line_base(f, stats, start)
+            replay = len(cached.matches) if cached is not None else 0
+            if context is not None and start and not stats.relative_lines:
+                self._resume_context(context, f, start, base_line,
+                                     cached.matches if cached is not None else None, replay)
+
+            line_index = None
+            if scan is None and stats.compression is not None:
+                clipper = self.time_window.clipper() if self.time_window is not None else None
+                scan = self._scan_compressed(f, encoding, literals, stats, progress, context,
+                                             records, clipper)
+            elif scan is None:
+                # 有最新的行偏移索引时直接得到总行数，否则在扫描的同时记录
+                line_index = self._line_index(stats, start) if window is None else None
+                if records is not None and (not stats.file_size
+                                            or not self.use_mmap and window is None):
+                    # 多行记录模式总是按块扫描，不使用内存映射时从文件按块读取；
+                    # 按时间范围搜索时已经映射了文件，仍按映射扫描窗口内的部分
+                    scan = self._scan_stream(f, f, encoding, literals, stats, progress,
+                                             records=records)
+                elif literals is None and records is None:
+                    scan = self._scan_lines(f, encoding, stats, progress, start=start,
+                                            stop=stop, line_index=line_index, context=context)
+                elif self.workers > 1 and stop - start >= PARALLEL_MIN_SIZE:
+                    scan = self._scan_parallel(f, encoding, literals, stats, progress, start,
+                                               line_index, context, stop)
+                else:
+                    scan = self._scan_mmap(f, encoding, literals, stats, progress, start, stop,
+                                           line_index=line_index, context=context,
+                                           records=records)
+
+            def scanned():
+                for match in scan:
+                    if base_line:
+                        match = match._replace(line_number=match.line_number + base_line)
+                    # 达到上限后只统计关键词命中数，结果不会保存到缓存中
+                    if cached is not None and not stats.limit_reached:
+                        cached.matches.append(match)
+                    yield match
+
+            records = scanned()
+            if replay:
+                records = itertools.chain(itertools.islice(cached.matches, replay), records)
+            completed = False
+            try:
+                yield from self._limited(records, stats, self.max_results)
+                if stats.limit_reached and stats.keyword_counts is not None:
+                    self._count_rest(records, stats.keyword_counts)
+                completed = not stats.cancelled and not stats.limit_reached
+            finally:
+                scan.close()
+                stats.lines_scanned += base_line
+                stats.bytes_scanned = max(stats.bytes_scanned, start)
+                if completed and self.time_window is None:
+                    stats.total_lines = stats.lines_scanned
+                    if line_index is not None:
+                        self._save_line_index(f, line_index, stats)
+                if cached is not None:
+                    if completed:
+                        self._remember(f, path, cache_key, cached, stats, start)
+                    else:
+                        # 没有搜索完，下次仍从原来的位置继续
+                        cached.matches.truncate(replay)
+                stats.elapsed = time.monotonic() - stats.started
+
+    def _limited(self, records, stats, limit):
+        """
+        依次输出结果直到 stats.result_count 达到 limit，只有匹配的行计数。
+
+        有上下文时去掉重复的行(分段并行或增量搜索时窗口可能跨越边界)，
+        达到上限后和 grep -m 一样仍输出最后一个匹配之后的 after_context 行，其中匹配的行
+        也作为上下文输出。stats.keyword_counts 不为空时统计输出的匹配，以及达到上限后
+        读到但没有作为匹配输出的行(其余的由调用方用 _count_rest 统计)。
+        """
+        after = self.after_context
+        context = self.before_context or after
+        add_time = stats.histogram.add if stats.histogram is not None else None
+        add_mask = stats.keyword_counts.add if stats.keyword_counts is not None else None
+        last_line = last_match = -sys.maxsize
+        for match in records:
+            if context:
+                if match.line_number <= last_line:
+                    continue
+                if stats.limit_reached:
+                    if match.mask and add_mask is not None:
+                        add_mask(match.mask)
+                    if match.line_number > last_match + after:
+                        return
+                    match = match._replace(mask=0)
+                last_line = match.line_number
+            yield match
+            if match.mask:
+                last_match = match.line_number
+                stats.result_count += 1
+                if add_time is not None:
+                    add_time(match.text)
+                if add_mask is not None:
+                    add_mask(match.mask)
+                if limit and stats.result_count >= limit:
+                    stats.limit_reached = True
+            if stats.limit_reached and match.line_number >= last_match + after:
+                return
+
+    @staticmethod
+    def _count_rest(records, keyword_counts):
+        """ 达到结果数上限后继续读完 records，只统计匹配行的关键词命中 """
+        add_mask = keyword_counts.add
+        for match in records:
+            if match.mask:
+                add_mask(match.mask)
+
+    def _resume_context(self, context, f, start, base_line, matches, replay):
+        """ 增量搜索: 放入 start 之前的几行，并接上上次最后一个匹配之后还没输出的行 """
+        context.seed(_lines_before(f, start, self.before_context))
+        context.last_line = -self.before_context
+        if not replay:
+            return
+        last = matches.line_number(replay - 1)
+        context.last_line = last - base_line
+        for index in range(replay - 1, max(replay - self.after_context - 2, -1), -1):
+            if matches.mask(index):
+                context.pending = max(0, matches.line_number(index) + self.after_context - last)
+                break
+
+    def search_files(self, paths, encoding=None, progress=None):
+        """
+        按顺序输出多个文件的匹配结果，Match.path 标明来源文件。
+
+        只有一个文件时等同于 search()(大文件仍会分段并行)；多个文件时每个文件
+        交给进程池中的一个进程搜索，同时在途的文件数有上限。max_results 对所有
+        文件合计生效。搜索结束后 self.stats 为汇总统计，self.file_stats 为各文件的统计。
+        progress(stats) 在每个文件搜索完成后调用。
+        """
+        paths = list(paths)
+        self.file_stats = []
+        if len(paths) == 1:
+            try:
+                yield from self.search(paths[0], encoding, progress)
+            finally:
+                self.file_stats.append(self.stats)
+            return
+
+        total = SearchStats(None, sum(os.path.getsize(p) for p in paths if os.path.isfile(p)))
+        total.histogram = self.time_histogram()
+        # 各文件的关键词命中数由子进程统计(包括超出上限的部分)，这里只合并
+        keyword_counts = self.keyword_counter()
+        try:
+            for matches, stats in self._search_each(paths, encoding):
+                count = total.result_count
+                if not total.limit_reached:
+                    yield from self._limited(matches, total, self.max_results)
+                stats.result_count = total.result_count - count
+                if keyword_counts is not None and stats.keyword_counts is not None:
+                    keyword_counts.merge(stats.keyword_counts)
+                self.file_stats.append(stats)
+                total.lines_scanned += stats.lines_scanned
+                total.bytes_scanned += stats.bytes_scanned
+                total.decode_errors += stats.decode_errors
+                total.truncated_records += stats.truncated_records
+                total.relative_lines = total.relative_lines or stats.relative_lines
+                self.stats = total
+                if progress is not None:
+                    progress(total)
+                if total.limit_reached and keyword_counts is None:
+                    break
+        finally:
+            total.keyword_counts = keyword_counts
+            total.cancelled = self._cancelled
+            total.elapsed = time.monotonic() - total.started
+            self.stats = total
+
+    def _search_each(self, paths, encoding):
+        """ 依次返回各文件的(匹配列表, 统计)，可用多个进程时并发搜索 """
+        if self.workers <= 1:
+            for path in paths:
+                if self._cancelled:
+                    return
+                yield _search_file(self, path, encoding)
+            return
+
+        pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append(pool.submit(_search_file, self, path, encoding))
+                if len(pending) >= self.workers * 2:
+                    result = self._wait(pending.popleft())
+                    if result is None:
+                        return
+                    yield result
+            while pending:
+                result = self._wait(pending.popleft())
+                if result is None:
+                    return
+                yield result
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _wait(self, future):
+        """ 等待子进程的结果，期间响应取消请求；已取消时返回 None """
+        while not self._cancelled:
+            try:
+                return future.result(timeout=0.1)
+            except FutureTimeoutError:
+                continue
+        return None
+
+    def _remember(self, f, path, cache_key, cached, stats, start):
+        """ 记录搜索到的位置: 最后一行可能还没写完，不算在内，下次重新搜索 """
+        size = stats.file_size
+        covered = size
+        lines = stats.lines_scanned
+        if size > start:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[size - 1:size] != b'\n':
+                    covered = mm.rfind(b'\n', start, size) + 1 or start
+                    lines -= 1
+        count = len(cached.matches)
+        while count and cached.matches._offsets[count - 1] >= covered:
+            count -= 1
+        cached.matches.truncate(count)
+        if covered == 0:
+            return
+        cached.update(f, covered, lines, stats.decode_errors)
+        self.cache.store(path, cache_key, cached)
+
+    def _locate_window(self, f, stats):
+        """ 在文件中二分查找时间窗口，返回要扫描的字节范围(开始, 结束) """
+        if not stats.file_size:
+            return 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return self.time_window.locate(mm, 0, stats.file_size)
+
+    def _line_base(self, f, stats, start):
+        """
+        偏移 start 之前的行数。窗口之前的部分较小时直接数换行符，行偏移索引覆盖了 start
+        时(文件之后只在末尾追加了内容也可以)从最近的检查点数起；否则不为了行号读取窗口
+        之前的部分，行号改为从窗口开始处计(stats.relative_lines)。
+        """
+        from line_index import LINE_INDEX_MIN_SIZE, load_line_index
+        if start < LINE_INDEX_MIN_SIZE:
+            f.seek(0)
+            return f.read(start).count(b'\n')
+        index = load_line_index(stats.path)
+        if index is not None and start <= index.size and index.covers(f):
+            return index.line_number_at(f, start) - 1
+        stats.relative_lines = True
+        return 0
+
+    def _line_index(self, stats, start):
+        """
+        读取较大文件的行偏移索引(见 line_index)，索引最新时得到总行数并返回 None；
+        否则从头扫描时返回一个新索引，扫描中记录检查点。
+        """
+        from line_index import LINE_INDEX_MIN_SIZE, LineIndex, load_line_index
+        if stats.file_size < LINE_INDEX_MIN_SIZE:
+            return None
+        index = load_line_index(stats.path)
+        if index is not None and index.is_fresh(stats.path):
+            stats.total_lines = index.lines
+            return None
+        return LineIndex() if start == 0 else None
+
+    def _save_line_index(self, f, line_index, stats):
+        line_index.finish(stats.bytes_scanned, stats.lines_scanned)
+        try:
+            line_index.save(stats.path, f)
+        except OSError:
+            # 索引目录不可写时只是下次没有索引可用
+            pass
+
+    def _scan_index(self, f, encoding, stats, progress):
+        """ 文件有最新的索引时返回只读取候选行的扫描，否则返回 None """
+        from log_index import open_index, search_index
+        index = open_index(stats.path)
+        if index is None:
+            return None
+        try:
+            if not index.is_fresh():
+                stats.index_stale = True
+                return None
+            if index.encoding != encoding:
+                return None
+            scan = search_index(index, self, f, encoding, stats, progress)
+        finally:
+            index.close()
+        stats.index_used = scan is not None
+        return scan
+
+    def _scan_compressed(self, f, encoding, literals, stats, progress, context=None,
+                         records=None, clipper=None):
+        """
+        压缩文件: 后台线程解压，主线程按块匹配，不在磁盘上生成解压后的文件。
+        clipper(time_window.WindowClipper)不为空时只匹配时间窗口内的部分，窗口结束后停止解压。
+        """
+        stream = PrefetchReader(open_decompressed(f, stats.compression))
+        try:
+            if literals is None and records is None:
+                reader = io.BufferedReader(stream, DECOMPRESS_BLOCK_SIZE)
+                yield from self._scan_lines(reader, encoding, stats, progress, f, context=context,
+                                            clipper=clipper)
+            else:
+                yield from self._scan_stream(stream, f, encoding, literals, stats, progress,
+                                             context, records, clipper)
+        finally:
+            stream.close()
+
+    def _scan_lines(self, f, encoding, stats, progress, compressed=None, start=0, stop=None,
+                    line_index=None, context=None, clipper=None):
+        """
+        逐行解码并匹配，适用于任意文件。
+
+        f 是解压后的数据流时，compressed 为底层的压缩文件，进度按已读取的压缩数据计算。
+        start 为开始扫描的偏移(须位于行首)，行号相对于 start 计算；到 stop 为止
+        (文件仍在增长时，stop 处未写完的行仍完整读取)。line_index 不为空时顺带记录行偏移。
+        context(ContextWindow)不为空时同时输出上下文行。clipper 不为空时跳过时间窗口外的行。
+        """
+        match_line = self.matcher.match
+        if start:
+            f.seek(start)
+        offset = start
+        line_number = 0
+        next_checkpoint = line_index.next_checkpoint if line_index is not None else float('inf')
+        spilled = 0     # stop 之后作为上下文输出的行数
+        for raw in f:
+            if self._cancelled:
+                stats.cancelled = True
+                break
+            if stop is not None and offset >= stop:
+                # 和 _scan_mmap 一样，最后一个匹配之后的行超出 stop 时继续输出，遇到匹配的行为止
+                if context is None or not context.pending:
+                    break
+                line = decode_line(raw, encoding, stats)
+                if match_line(line):
+                    break
+                spilled += 1
+                yield context.feed(line_number + spilled, offset, raw, line, encoding, stats)
+                offset += len(raw)
+                continue
+            if offset >= next_checkpoint:
+                next_checkpoint = line_index.checkpoint(offset, line_number)
+            if clipper is not None:
+                # 每行作为一块: 窗口之前的行跳过，遇到窗口之后的行时结束
+                lo, hi = clipper.clip(raw)
+                if hi < len(raw):
+                    break
+                if lo:
+                    line_number += 1
+                    offset += len(raw)
+                    continue
+            line_number += 1
+
+            line = decode_line(raw, encoding, stats)
+            mask = match_line(line)
+            offset += len(raw)
+            if mask:
+                match = Match(line_number, offset - len(raw), len(raw), mask, line.rstrip('\r\n'),
+                              stats.path)
+                if context is not None:
+                    yield from context.matched(match, encoding, stats)
+                yield match
+            elif context is not None:
+                match = context.feed(line_number, offset - len(raw), raw, line, encoding, stats)
+                if match is not None:
+                    yield match
+
+            if progress is not None and line_number % self.progress_interval == 0:
+                stats.lines_scanned = line_number
+                stats.bytes_scanned = offset if compressed is None else compressed.tell()
+                progress(stats)
+
+        stats.lines_scanned = line_number
+        stats.bytes_scanned = offset if compressed is None else compressed.tell()
+
+    def _scan_stream(self, stream, raw, encoding, literals, stats, progress, context=None,
+                     records=None, clipper=None):
+        """
+        从解压后的数据流中按块读取完整的行，逐块做字节级查找(或合成多行记录)。
+        clipper 不为空时每块只匹配时间窗口内的部分。
+        """
+        carry = b''
+        offset = 0
+        line_number = 0
+        while True:
+            if self._cancelled:
+                stats.cancelled = True
+                break
+
+            data = stream.read(DECOMPRESS_BLOCK_SIZE)
+            if data:
+                # 不完整的最后一行留到下一块
+                data = carry + data
+                cut = data.rfind(b'\n') + 1
+                if cut == 0:
+                    carry = data
+                    continue
+                block, carry = data[:cut], data[cut:]
+            elif carry:
+                block, carry = carry, b''
+            else:
+                break
+
+            if clipper is None:
+                yield from self._scan_block(block, offset, line_number, encoding, literals, stats,
+                                            context, records)
+            else:
+                lo, hi = clipper.clip(block)
+                if lo < hi:
+                    yield from self._scan_block(block[lo:hi], offset + lo,
+                                                line_number + block.count(b'\n', 0, lo),
+                                                encoding, literals, stats, context, records)
+                if clipper.done:
+                    line_number += block.count(b'\n', 0, hi)
+                    offset += hi
+                    stats.lines_scanned = line_number
+                    stats.bytes_scanned = raw.tell()
+                    break
+
+            line_number += block.count(b'\n')
+            offset += len(block)
+            stats.lines_scanned = line_number
+            stats.bytes_scanned = raw.tell()
+            if progress is not None:
+                progress(stats)
+
+            if not block.endswith(b'\n'):
+                # 最后一行没有换行符
+                stats.lines_scanned += 1
+
+        if records is not None and not stats.cancelled:
+            yield from records.finish(stats)
+
+    def _scan_mmap(self, f, encoding, literals, stats, progress, start=0, stop=None,
+                   line_index=None, context=None, records=None):
+        """
+        内存映射文件后按块在原始字节中查找关键词，只解码可能匹配的行。
+
+        literals 是编码后的关键词，命中行必然包含其中之一；找到的候选行
+        解码后再交给 matcher 做最终判断。start/stop 限定扫描范围(须位于行首)，
+        行号相对于 start 计算。line_index 不为空时顺带记录行偏移。context 不为空时
+        同时输出上下文行，最后一个匹配之后的行超出 stop 时继续读取到下一个匹配为止。
+        records(RecordAssembler)不为空时按多行记录匹配，stop 须位于记录开始处。
+        """
+        size = stats.file_size
+        stop = size if stop is None else stop
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start
+            line_number = 0     # 从 start 到 pos 之间的行数
+            while pos < stop:
+                if self._cancelled:
+                    stats.cancelled = True
+                    break
+
+                # 块边界对齐到换行符之后，保证每块都是完整的行
+                end = min(pos + SCAN_BLOCK_SIZE, stop)
+                if end < stop:
+                    newline = mm.rfind(b'\n', pos, end)
+                    if newline < 0:
+                        newline = mm.find(b'\n', end)
+                    end = stop if newline < 0 else newline + 1
+                block = mm[pos:end]
+
+                yield from self._scan_block(block, pos, line_number, encoding, literals, stats,
+                                            context, records)
+
+                if line_index is not None:
+                    line_number += line_index.add_block(block, pos)
+                else:
+                    line_number += block.count(b'\n')
+                pos = end
+                stats.lines_scanned = line_number
+                stats.bytes_scanned = pos
+                if progress is not None:
+                    progress(stats)
+
+            if pos == size and pos > start and mm[size - 1:size] != b'\n':
+                # 最后一行没有换行符
+                stats.lines_scanned += 1
+            elif context is not None and pos == stop < len(mm) and not stats.cancelled:
+                yield from context.spill(mm, pos, line_number, len(mm), self.matcher.match,
+                                         encoding, stats)
+            if records is not None and not stats.cancelled:
+                yield from records.finish(stats)
+
+    def _scan_parallel(self, f, encoding, literals, stats, progress, start=0, line_index=None,
+                       context=None, stop=None):
+        """
+        把文件的 [start, stop) 切成多段交给进程池并行搜索，按文件顺序合并结果，行号相对于 start。
+
+        每段最多返回 max_results 条，合并时再按全局上限截断；同时在途的段数
+        有上限，避免已完成但还没轮到输出的结果堆积在内存中。line_index 不为空时
+        各段同时记录行偏移，合并时接在一起。context 交给第一段，其余各段自行读取
+        段首之前的几行；跨段重复的上下文行在合并后去掉(见 _limited)。
+        """
+        ranges = split_ranges(f, stats.file_size if stop is None else stop, start)
+        if self.record_start is not None:
+            from records import align_ranges, compile_record_start
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ranges = align_ranges(mm, ranges, compile_record_start(self.record_start, encoding))
+        # 使用 spawn 启动子进程，避免在有界面线程的进程里 fork
+        pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        pending = deque()
+        line_number = 0
+        try:
+            for start, stop in ranges:
+                pending.append(pool.submit(_search_chunk, self, stats.path, encoding, literals,
+                                           start, stop, self.max_results, line_index is not None,
+                                           context))
+                context = None
+                if len(pending) < self.workers * 2:
+                    continue
+                line_number = yield from self._merge_chunk(pending.popleft(), line_number, stats,
+                                                           progress, line_index)
+                if stats.cancelled:
+                    return
+            while pending:
+                line_number = yield from self._merge_chunk(pending.popleft(), line_number, stats,
+                                                           progress, line_index)
+                if stats.cancelled:
+                    return
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _merge_chunk(self, future, line_number, stats, progress, line_index=None):
+        """ 等待一段的结果，修正行号后依次输出，返回累计行数 """
+        result = self._wait(future)
+        if result is None:
+            stats.cancelled = True
+            return line_number
+        matches, lines, stop, decode_errors, truncated_records, chunk_index, overflow = result
+        for match in matches:
+            yield match._replace(line_number=match.line_number + line_number)
+        if overflow is not None and stats.keyword_counts is not None:
+            # 这一段超出结果数上限、没有返回的匹配
+            stats.keyword_counts.merge(overflow)
+        if line_index is not None and chunk_index is not None:
+            line_index.extend(chunk_index, line_number)
+        stats.lines_scanned = line_number = line_number + lines
+        stats.bytes_scanned = stop
+        stats.decode_errors += decode_errors
+        stats.truncated_records += truncated_records
+        if progress is not None:
+            progress(stats)
+        return line_number
+
+    def _scan_block(self, block, base_offset, base_line, encoding, literals, stats, context=None,
+                    records=None):
+        """ 在一块完整的行中查找匹配；context 不为空时同时输出上下文行，records 不为空时按记录匹配 """
+        if records is not None:
+            return records.block(block, base_offset, base_line, literals, stats)
+        matches = self._block_matches(block, base_offset, base_line, encoding, literals, stats)
+        if context is None:
+            return matches
+        return context.block(block, base_offset, base_line, matches, encoding, stats)
+
+    def _block_matches(self, block, base_offset, base_line, encoding, literals, stats):
+        """ 在一块完整的行中查找候选行并逐一确认 """
+        haystack = block.lower() if self.matcher.fold_case else block
+        block_size = len(block)
+
+        # 收集包含任一关键词的行的起止位置
+        candidates = {}
+        for literal in literals:
+            i = haystack.find(literal)
+            while i >= 0:
+                start = haystack.rfind(b'\n', 0, i) + 1
+                end = haystack.find(b'\n', i + len(literal))
+                end = block_size if end < 0 else end + 1
+                candidates[start] = end
+                # 同一行只需找到一次
+                i = haystack.find(literal, end)
+
+        match_line = self.matcher.match
+        line_number = base_line
+        counted = 0
+        for start in sorted(candidates):
+            end = candidates[start]
+            line = decode_line(block[start:end], encoding, stats)
+            mask = match_line(line)
+            if mask:
+                line_number += block.count(b'\n', counted, start)
+                counted = start
+                yield Match(line_number + 1, base_offset + start, end - start, mask,
+                            line.rstrip('\r\n'), stats.path)
+
+
+# 子进程入口: 搜索文件中 [start, stop) 这一段
+def _search_chunk(searcher, path, encoding, literals, start, stop, limit, checkpoints=False,
+                  context=None):
+    # 文件可能仍在增长，只搜索到 stop 为止；checkpoints 为真时同时记录这一段的行偏移
+    line_index = None
+    if checkpoints:
+        from line_index import LineIndex
+        line_index = LineIndex(start)
+    stats = SearchStats(path, stop)
+    with open(path, 'rb') as f:
+        if context is None and start:
+            # 段首之前的行号为 0、-1、...，不受上一段输出的影响
+            context = searcher.context_window(path, -searcher.before_context)
+            if context is not None:
+                context.seed(_lines_before(f, start, searcher.before_context))
+        scan = searcher._scan_mmap(f, encoding, literals, stats, None, start, stop, line_index,
+                                   context, searcher.record_assembler(path, encoding))
+        stats.keyword_counts = overflow = searcher.keyword_counter()
+        matches = list(searcher._limited(scan, stats, limit))
+        if overflow is not None:
+            # 超出上限的匹配不返回，只把关键词命中数交给主进程；返回的匹配由主进程统计
+            if stats.limit_reached:
+                searcher._count_rest(scan, overflow)
+            for match in matches:
+                if match.mask:
+                    overflow.add(match.mask, -1)
+    return (matches, stats.lines_scanned, stop, stats.decode_errors, stats.truncated_records,
+            line_index, overflow)
+
+
+# 子进程入口: 完整搜索一个文件，出错时记录在统计信息中
+def _search_file(searcher, path, encoding):
+    # 已经在进程池中，文件内部不再分段并行；时间分布由主进程合并结果时统计。
+    # 不使用进程池时 searcher 就是调用方的对象，结束后恢复
+    searcher.workers = 1
+    histogram, searcher.histogram = searcher.histogram, False
+    matches = []
+    try:
+        matches.extend(searcher.search(path, encoding))
+        stats = searcher.stats
+    except (OSError, UnicodeError) as e:
+        stats = searcher.stats if searcher.stats and searcher.stats.path == path else None
+        if stats is None:
+            stats = SearchStats(path, 0)
+        stats.error = str(e)
+    finally:
+        searcher.histogram = histogram
+    return matches, stats
+
+
+# 关键词命中统计: 各关键词的命中行数、两两同时命中的行数和最常见的命中组合
+def format_keyword_counts(counts, result_count, max_combinations=10):
+    total = counts.total
+    keywords = counts.keywords
+    header = f"关键词命中统计(共 {total} 行匹配"
+    if total > result_count:
+        header += f"，其中 {total - result_count} 行超出结果数上限没有输出"
+    lines = [header + "):"]
+    matrix = counts.matrix()
+    width = max(_text_width(k) for k in keywords) if keywords else 0
+    for i, keyword in enumerate(keywords):
+        lines.append(f"  {_pad(keyword, width)}  {matrix[i][i]} 行")
+    if len(keywords) > 1:
+        lines.append("同时命中的行数:")
+        columns = [max(_text_width(k), len(str(max(matrix[i])))) for i, k in enumerate(keywords)]
+        lines.append("  " + " " * width + "".join("  " + _pad(k, columns[i], right=True)
+                                                  for i, k in enumerate(keywords)))
+        for i, keyword in enumerate(keywords):
+            lines.append("  " + _pad(keyword, width) + "".join(
+                "  " + str(matrix[i][j]).rjust(columns[j]) for j in range(len(keywords))))
+        lines.append("最常见的命中组合:")
+        for mask, count in counts.combinations()[:max_combinations]:
+            names = [k for i, k in enumerate(keywords) if mask >> i & 1]
+            lines.append(f"  {' + '.join(names) or '(不含关键词)'}: {count} 行")
+    return lines
+
+
+# 文本在等宽字体中的显示宽度，中日韩文字占两格
+def _text_width(text):
+    return sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+
+
+def _pad(text, width, right=False):
+    padding = " " * max(0, width - _text_width(text))
+    return padding + text if right else text + padding
+
+
+# 单个文件的搜索报告: 文件名、大小、耗时、吞吐量和结果数
+def format_file_stats(stats):
+    name = os.path.basename(stats.path) if stats.path else '合计'
+    if stats.error:
+        return f"{name}: 出错 - {stats.error}"
+    return (f"{name}: {stats.file_size / 1024 / 1024:.2f} MB，耗时 {stats.elapsed:.2f} 秒，"
+            f"{stats.throughput:.1f} MB/s，{stats.result_count} 个结果")
+
+
+# 进度说明: 已处理的数据量和百分比、速度、预计剩余时间
+def format_progress(progress):
+    done, total = progress.bytes_done, progress.bytes_total
+    text = f"已扫描 {done / 1024 / 1024:.1f} / {total / 1024 / 1024:.1f} MB"
+    if total > 0:
+        text += f" ({done / total * 100:.0f}%)"
+    scanned = done - progress.skipped
+    if progress.elapsed > 0 and scanned > 0:
+        rate = scanned / progress.elapsed
+        text += f"，{rate / 1024 / 1024:.1f} MB/s"
+        if done < total:
+            text += f"，预计还需 {format_duration((total - done) / rate)}"
+    return text
+
+
+def format_duration(seconds):
+    if seconds < 1:
+        return "不到 1 秒"
+    if seconds < 60:
+        return f"{seconds:.0f} 秒"
+    if seconds < 3600:
+        return f"{seconds // 60:.0f} 分 {seconds % 60:.0f} 秒"
+    return f"{seconds // 3600:.0f} 小时 {seconds % 3600 // 60:.0f} 分"
+
+
+# 便捷函数: 按关键词搜索单个文件
+def search_file(path, keywords, and_mode=True, case_sensitive=False, max_results=None, encoding=None):
+    searcher = LogSearcher(keywords, and_mode, case_sensitive, max_results)
+    return searcher.search(path, encoding)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog='log-search',
+        description='按关键词过滤日志文件(与图形界面使用相同的匹配规则)')
+    parser.add_argument('file', help='日志文件或目录路径')
+    parser.add_argument('keywords', nargs='*', help='关键词，可写多个')
+    parser.add_argument('-f', '--file', dest='more_files', action='append', default=[],
+                        help='同时搜索的其他文件或目录，可重复使用')
+    parser.add_argument('--include', action='append', default=[],
+                        help='搜索目录时只包含匹配该通配符的文件(如 "*.log*")，可重复使用')
+    parser.add_argument('--exclude', action='append', default=[],
+                        help='搜索目录时排除匹配该通配符的文件，可重复使用')
+    parser.add_argument('-k', '--keywords', dest='keyword_text', action='append', default=[],
+                        help='关键词输入，和界面一样用空格或|分隔多个关键词，可重复使用')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--and', dest='and_mode', action='store_true', default=True,
+                      help='与模式: 必须包含所有关键词(默认)')
+    mode.add_argument('--or', dest='and_mode', action='store_false',
+                      help='或模式: 包含任一关键词即可')
+    parser.add_argument('-q', '--query',
+                        help='布尔查询表达式，支持 AND/OR/NOT、括号和引号短语，'
+                             '如 "(timeout OR refused) AND NOT healthcheck"；'
+                             '同时指定的关键词按 --and/--or 与表达式组合')
+    parser.add_argument('-c', '--case-sensitive', action='store_true', help='区分大小写')
+    parser.add_argument('-E', '--regex', action='store_true',
+                        help='关键词是正则表达式(Python re 语法)，每个表达式都要/任一匹配')
+    parser.add_argument('-n', '--line-number', action='store_true', help='输出行号')
+    parser.add_argument('-A', '--after-context', type=int, default=0, metavar='NUM',
+                        help='同时输出每个匹配之后的 NUM 行')
+    parser.add_argument('-B', '--before-context', type=int, default=0, metavar='NUM',
+                        help='同时输出每个匹配之前的 NUM 行')
+    parser.add_argument('-C', '--context', type=int, default=0, metavar='NUM',
+                        help='同时输出每个匹配前后的 NUM 行，不连续的部分之间用 -- 分隔')
+    parser.add_argument('-R', '--records', action='store_true',
+                        help='多行记录模式: 以时间戳开头的行开始一条记录，之后的续行(如异常堆栈)'
+                             '归入这条记录，按整条记录匹配和输出')
+    parser.add_argument('--record-start', metavar='REGEX',
+                        help='多行记录模式下记录开始行的正则表达式(从行首匹配)，'
+                             '指定时自动启用 -R，默认匹配 2024-05-01 12:00:00 这样的时间戳')
+    parser.add_argument('--since', metavar='TIME',
+                        help='只搜索这个时间及之后的日志，如 "2024-05-01 14:02" 或 14:02(使用日志中的日期)；'
+                             '日志须按时间顺序写入，在文件中二分查找边界后只扫描这一段')
+    parser.add_argument('--until', metavar='TIME',
+                        help='只搜索到这个时间为止(包含这一分钟或这一秒)的日志，格式同 --since')
+    parser.add_argument('-m', '--max-results', type=int, default=0,
+                        help='最多输出多少条结果，0表示不限制(默认)')
+    parser.add_argument('-e', '--encoding', help='文件编码，默认自动检测')
+    parser.add_argument('--no-mmap', dest='use_mmap', action='store_false',
+                        help='逐行解码搜索，不使用内存映射的字节级扫描')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='并行搜索的进程数，默认等于CPU核数，1表示不并行')
+    index = parser.add_mutually_exclusive_group()
+    index.add_argument('--build-index', action='store_true',
+                       help='为文件建立索引(保存在 ~/.log_search_tool/index)，之后的搜索只读取候选行；'
+                            '不指定关键词时只建立索引')
+    index.add_argument('--remove-index', action='store_true',
+                       help='删除文件的索引；不指定关键词时只删除索引')
+    parser.add_argument('--no-index', dest='use_index', action='store_false',
+                        help='不使用索引，总是扫描整个文件')
+    parser.add_argument('--histogram', action='store_true',
+                        help='在标准错误上输出结果按行首时间戳的分布，粒度(秒、分钟、小时或天)自动选择')
+    parser.add_argument('--keyword-stats', action='store_true',
+                        help='在标准错误上输出各关键词的命中行数和同时命中的组合；'
+                             '达到 -m 的上限后仍扫描完文件，统计全部命中')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='把结果写入文件而不是标准输出，扩展名为 .gz 时压缩')
+    parser.add_argument('--format', choices=['txt', 'jsonl', 'csv'],
+                        help='-o 的文件格式: txt 与标准输出相同，jsonl/csv 带文件、行号和偏移；'
+                             '默认按扩展名判断')
+    parser.add_argument('--gzip', action='store_true', default=None,
+                        help='用 gzip 压缩 -o 的文件(扩展名不是 .gz 时)')
+    parser.add_argument('--progress', action='store_true',
+                        help='在标准错误上显示进度、速度和预计剩余时间')
+    parser.add_argument('-F', '--follow', action='store_true',
+                        help='搜索完成后继续跟踪文件新增的内容(类似 tail -F)，按 Ctrl+C 结束')
+    return parser
+
+
+def main(argv=None):
+    """ 命令行入口，返回值与 grep 一致: 0 有结果，1 无结果，2 出错 """
+    args = build_arg_parser().parse_args(argv)
+
+    keywords = list(args.keywords)
+    for text in args.keyword_text:
+        keywords.extend(parse_keywords(text, args.regex))
+    if not keywords and not args.query and not args.build_index and not args.remove_index:
+        print("请至少指定一个关键词", file=sys.stderr)
+        return 2
+    before_context = args.before_context or args.context
+    after_context = args.after_context or args.context
+    if min(before_context, after_context) < 0:
+        print("上下文行数不能为负数", file=sys.stderr)
+        return 2
+    record_start = args.record_start
+    if args.records and record_start is None:
+        from records import RECORD_START
+        record_start = RECORD_START
+    if record_start is not None and (before_context or after_context or args.follow):
+        print("多行记录模式不能与 -A/-B/-C 或 --follow 同时使用", file=sys.stderr)
+        return 2
+    time_window = None
+    if args.since or args.until:
+        from time_window import TimeWindow
+        try:
+            time_window = TimeWindow(args.since, args.until)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        if args.until and args.follow:
+            print("--until 不能与 --follow 同时使用", file=sys.stderr)
+            return 2
+    if args.output and args.follow:
+        print("-o 不能与 --follow 同时使用", file=sys.stderr)
+        return 2
+
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(errors='replace')
+
+    paths = list(iter_log_files([args.file] + args.more_files, args.include, args.exclude))
+    if not paths:
+        print("没有找到要搜索的文件", file=sys.stderr)
+        return 2
+
+    if args.build_index:
+        from log_index import build_index, format_index_info
+        for path in paths:
+            try:
+                info = build_index(path, args.encoding, args.jobs)
+            except KeyboardInterrupt:
+                return 130
+            except (OSError, UnicodeError) as e:
+                print(f"建立索引失败: {e}", file=sys.stderr)
+                return 2
+            print(format_index_info(info), file=sys.stderr)
+        if not keywords and not args.query:
+            return 0
+
+    if args.remove_index:
+        from log_index import remove_index
+        for path in paths:
+            try:
+                removed = remove_index(path)
+            except OSError as e:
+                print(f"删除索引失败: {e}", file=sys.stderr)
+                return 2
+            print(f"{path}: {'已删除索引' if removed else '没有索引'}", file=sys.stderr)
+        if not keywords and not args.query:
+            return 0
+
+    # 搜索多个文件时和 grep 一样在每行前加上文件名
+    show_path = len(paths) > 1
+
+    query = None
+    if args.query:
+        from query import QueryError, combine_query, parse_query
+        query = combine_query(keywords, args.query, args.and_mode)
+        try:
+            parse_query(query)
+        except QueryError as e:
+            print(f"查询表达式有误: {e}", file=sys.stderr)
+            return 2
+    try:
+        searcher = LogSearcher(keywords, args.and_mode, args.case_sensitive, args.max_results,
+                               args.use_mmap, args.jobs, args.use_index, regex=args.regex,
+                               query=query, before_context=before_context,
+                               after_context=after_context, record_start=record_start,
+                               time_window=time_window, histogram=args.histogram,
+                               keyword_counts=args.keyword_stats)
+    except re.error as e:
+        print(f"正则表达式有误: {e}", file=sys.stderr)
+        return 2
+
+    # 和 grep 一样，匹配的行用 ':'、上下文行用 '-' 分隔前缀，不连续的部分之间输出 --
+    context = before_context or after_context
+    last = None
+    writer = None
+    if args.output:
+        from export import open_export
+        try:
+            writer = open_export(args.output, args.format, args.gzip, searcher.keywords,
+                                 show_path, args.line_number, bool(context))
+        except OSError as e:
+            print(f"无法写入 {args.output}: {e}", file=sys.stderr)
+            return 2
+
+    def write(match):
+        nonlocal last
+        if context:
+            if last is not None and (match.path != last.path
+                                     or match.line_number != last.line_number + 1):
+                sys.stdout.write("--\n")
+            last = match
+        sep = ":" if match.mask else "-"
+        prefix = f"{match.path}{sep}" if show_path else ""
+        if args.line_number:
+            prefix += f"{match.line_number}{sep}"
+        sys.stdout.write(prefix + match.text + "\n")
+
+    progress = None
+    if args.progress:
+        last_report = 0.0
+
+        def report_progress(stats):
+            nonlocal last_report
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                sys.stderr.write(f"\r\033[K{format_progress(stats.snapshot())}")
+                sys.stderr.flush()
+
+        progress = report_progress
+
+    reported = {}
+    try:
+        if writer is not None:
+            # 结果直接写入文件，不保留在内存中
+            with writer:
+                for match in searcher.search_files(paths, args.encoding, progress):
+                    writer.write(match)
+        else:
+            for match in searcher.search_files(paths, args.encoding, progress):
+                write(match)
+                reported[match.path] = match.offset
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # 输出端已关闭(如 | head)，静默退出
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, UnicodeError) as e:
+        print(f"读取文件时出错: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if args.progress:
+            sys.stderr.write("\r\033[K")
+
+    stats = searcher.stats
+    stale = [s.path for s in searcher.file_stats if s.index_stale]
+    if stale:
+        print(f"{', '.join(stale)} 的索引已过期，已改为扫描，可用 --build-index 重新建立", file=sys.stderr)
+    if show_path:
+        for file_stats in searcher.file_stats:
+            print(format_file_stats(file_stats), file=sys.stderr)
+        print(f"共搜索 {len(searcher.file_stats)} 个文件，耗时 {stats.elapsed:.2f} 秒，"
+              f"{stats.throughput:.1f} MB/s，共找到 {stats.result_count} 个结果", file=sys.stderr)
+        if stats.decode_errors:
+            print(f"有 {stats.decode_errors} 行含无法解码的字节，已替换显示", file=sys.stderr)
+    else:
+        print(f"使用 {stats.encoding} 编码，共找到 {stats.result_count} 个结果", file=sys.stderr)
+        if stats.decode_errors:
+            print(f"有 {stats.decode_errors} 行含无法按 {stats.encoding} 解码的字节，已替换显示", file=sys.stderr)
+    if time_window is not None:
+        for file_stats in searcher.file_stats:
+            if file_stats.window is not None:
+                start, stop = file_stats.window
+                print(f"{file_stats.path}: 时间范围 {time_window} 位于 {start / 1024 / 1024:.1f} MB "
+                      f"至 {stop / 1024 / 1024:.1f} MB，只扫描了这一段", file=sys.stderr)
+        if stats.relative_lines:
+            print("没有最新的行偏移索引，行号从时间范围的开始处计；不限时间范围完整搜索一次后"
+                  "会记录行偏移", file=sys.stderr)
+    if writer is not None:
+        print(f"已把 {writer.count} 个结果写入 {args.output}", file=sys.stderr)
+    if stats.keyword_counts is not None:
+        for line in format_keyword_counts(stats.keyword_counts, stats.result_count):
+            print(line, file=sys.stderr)
+    if stats.histogram is not None:
+        from histogram import format_histogram
+        for line in format_histogram(stats.histogram):
+            print(line, file=sys.stderr)
+    if stats.truncated_records:
+        from records import RECORD_MAX_SIZE
+        print(f"有 {stats.truncated_records} 条记录超过 {RECORD_MAX_SIZE // 1024} KB，"
+              f"只匹配和输出了开头部分", file=sys.stderr)
+    if stats.limit_reached:
+        if stats.keyword_counts is not None:
+            # 达到上限后仍扫描完文件以统计全部命中
+            print(f"已达到最大结果数限制({args.max_results})，不再输出结果，继续统计关键词命中。",
+                  file=sys.stderr)
+        else:
+            print(f"已达到最大结果数限制({args.max_results})，搜索已停止。", file=sys.stderr)
+    elif args.follow:
+        return follow_output(searcher, reported, write)
+    return 0 if stats.result_count else 1
+
+
+def follow_output(searcher, reported, write):
+    """ --follow: 输出各文件新增内容中的匹配，直到按 Ctrl+C 或达到结果数限制 """
+    from log_follow import follow, followers_for
+
+    def replaced(path, old_file):
+        if old_file is None:
+            print(f"{path} 已被截断，从头开始跟踪", file=sys.stderr)
+        else:
+            old_file.close()
+            print(f"{path} 已被轮转，开始跟踪新文件", file=sys.stderr)
+
+    max_results = searcher.max_results
+    count = searcher.stats.result_count
+    try:
+        followers = followers_for(searcher, searcher.file_stats, reported)
+        if not followers:
+            print("没有可以跟踪的文件(压缩文件不跟踪)", file=sys.stderr)
+            return 0 if count else 1
+        sys.stdout.flush()
+        for matches in follow(followers, on_replace=replaced):
+            for match in matches:
+                write(match)
+                if not match.mask:
+                    continue
+                count += 1
+                if max_results and count >= max_results:
+                    print(f"已达到最大结果数限制({max_results})，停止跟踪。", file=sys.stderr)
+                    return 0
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except OSError as e:
+        print(f"跟踪文件时出错: {e}", file=sys.stderr)
+        return 2
+    return 0 if count else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
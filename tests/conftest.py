@@ -0,0 +1,54 @@
+import os
+import sys
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+# 模块都在仓库根目录下
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ['INFO', 'DEBUG', 'WARN', 'ERROR', 'error', 'Error', 'timeout', 'db', 'login',
+         'payment', 'user=42', '用户', '连接', '失败', '成功', 'ok', 'retry']
+
+
+def make_lines(count=6000, seed=7):
+    """
+    按时间顺序写入的日志: 每行以时间戳开头，约 2% 的行后面跟着几行异常堆栈(续行
+    没有时间戳)，时间跨度约两个小时
+    """
+    rng = random.Random(seed)
+    when = datetime(2024, 5, 1, 23, 0, 0)
+    lines = ['header line without timestamp']
+    for _ in range(count):
+        when += timedelta(milliseconds=rng.randint(0, 2400))
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 8)))
+        lines.append(f"{when:%Y-%m-%d %H:%M:%S}.{when.microsecond // 1000:03d} {words}")
+        if rng.random() < 0.02:
+            lines.append('Traceback (most recent call last):')
+            lines.append(f'  File "app.py", line {rng.randint(1, 999)}, in handler')
+            lines.append(rng.choice(['ZeroDivisionError: division by zero',
+                                     'KeyError: user', 'TimeoutError: db timeout']))
+    return lines
+
+
+@pytest.fixture(scope='session')
+def log_lines():
+    return make_lines()
+
+
+@pytest.fixture(scope='session')
+def log_file(tmp_path_factory, log_lines):
+    path = tmp_path_factory.mktemp('logs') / 'app.log'
+    path.write_text('\n'.join(log_lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """ 让小文件也切成多段并行搜索 """
+    import search
+    split_ranges = search.split_ranges
+    monkeypatch.setattr(search, 'PARALLEL_MIN_SIZE', 1)
+    monkeypatch.setattr(search, 'split_ranges',
+                        lambda f, size, start=0: split_ranges(f, size, start, chunk_size=16 * 1024))
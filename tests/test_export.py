@@ -0,0 +1,72 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from search import Match
+from export import export_format, open_export
+
+MATCHES = [
+    Match(3, 40, 20, 0b01, 'error "quoted", 用户', 'a.log'),
+    Match(4, 60, 10, 0, 'context', 'a.log'),
+    Match(9, 150, 12, 0b11, 'error timeout', 'a.log'),
+    Match(1, 0, 8, 0b10, 'timeout', 'b.log'),
+]
+
+
+@pytest.mark.parametrize('name, result', [
+    ('out.txt', ('txt', False)),
+    ('out.JSONL', ('jsonl', False)),
+    ('out.csv.gz', ('csv', True)),
+    ('out.gz', ('txt', True)),
+    ('matches', ('txt', False)),
+])
+def test_export_format(name, result):
+    assert export_format(name) == result
+
+
+def read_export(path):
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', ['out.txt', 'out.txt.gz'])
+def test_export_text(tmp_path, name):
+    path = tmp_path / name
+    with open_export(str(path), context=True) as writer:
+        for match in MATCHES:
+            writer.write(match)
+    assert writer.count == 3
+    assert read_export(path) == ('a.log:3:error "quoted", 用户\na.log-4-context\n--\n'
+                                 'a.log:9:error timeout\n--\nb.log:1:timeout\n')
+
+
+def test_export_jsonl(tmp_path):
+    path = tmp_path / 'out.jsonl.gz'
+    with open_export(str(path), keywords=['error', 'timeout']) as writer:
+        for match in MATCHES:
+            writer.write(match)
+    rows = [json.loads(line) for line in read_export(path).splitlines()]
+    assert rows == [{'path': m.path, 'line': m.line_number, 'offset': m.offset,
+                     'length': m.length, 'match': bool(m.mask),
+                     'keywords': [k for i, k in enumerate(['error', 'timeout']) if m.mask >> i & 1],
+                     'text': m.text} for m in MATCHES]
+
+
+def test_export_csv(tmp_path):
+    path = tmp_path / 'out.dat'
+    with open_export(str(path), 'csv', keywords=['error', 'timeout']) as writer:
+        for match in MATCHES:
+            writer.write(match)
+    rows = list(csv.reader(read_export(path).splitlines()))
+    assert rows[0] == ['path', 'line', 'offset', 'length', 'match', 'keywords', 'text']
+    assert rows[1] == ['a.log', '3', '40', '20', '1', 'error', 'error "quoted", 用户']
+    assert rows[2][4:6] == ['0', ''] and rows[3][5] == 'error|timeout'
+    assert len(rows) == len(MATCHES) + 1
+
+
+def test_export_invalid_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_export(str(tmp_path / 'out.txt'), 'xml')
@@ -0,0 +1,96 @@
+from collections import Counter
+
+import pytest
+
+from search import LogSearcher, main
+from histogram import HISTOGRAM_MAX_BUCKETS, TimeHistogram, format_histogram, text_seconds
+
+
+def histogram_of(path, keywords, **options):
+    """ 搜索时统计的分布和匹配行 """
+    searcher = LogSearcher(keywords, max_results=0, workers=1, use_index=False, histogram=True,
+                           **options)
+    texts = [m.text for m in searcher.search(path) if m.mask]
+    return searcher.stats.histogram, texts
+
+
+def reference_counts(texts, step):
+    """ 逐行解析时间戳的参考计数: ({时间段开始的秒数: 匹配数}, 没有时间戳的匹配数) """
+    seconds = [text_seconds(text) for text in texts]
+    return (Counter(s - s % step for s in seconds if s is not None),
+            sum(s is None for s in seconds))
+
+
+def bucket_counts(histogram):
+    return {histogram.bucket_range(i)[0]: count for i, count in enumerate(histogram.counts) if count}
+
+
+@pytest.mark.parametrize('keywords', [['error'], ['Error'], ['timeout', 'login'], ['用户', 'db']])
+def test_histogram_counts(log_file, keywords):
+    histogram, texts = histogram_of(log_file, keywords)
+    # 约两个小时的日志超过了按秒计数的时间段数，改为按分钟
+    assert histogram.step == 60 and len(histogram.counts) <= HISTOGRAM_MAX_BUCKETS
+    counts, untimed = reference_counts(texts, histogram.step)
+    assert bucket_counts(histogram) == counts
+    assert histogram.untimed == untimed and histogram.total + untimed == len(texts)
+
+
+def test_histogram_context_and_records(log_file):
+    # 上下文行不计入；多行记录按首行的时间戳计入
+    histogram, texts = histogram_of(log_file, ['KeyError'], before_context=3)
+    assert histogram.untimed == len(texts) and not histogram.total
+    from records import RECORD_START
+    histogram, texts = histogram_of(log_file, ['KeyError'], record_start=RECORD_START)
+    assert not histogram.untimed and bucket_counts(histogram) == reference_counts(texts, 60)[0]
+
+
+def stamp(day, hour=0, minute=0, second=0):
+    return f"2024-05-{day:02d} {hour:02d}:{minute:02d}:{second:02d} error"
+
+
+def test_histogram_coarsening():
+    histogram = TimeHistogram()
+    texts = [stamp(1, 10, 0, s) for s in range(0, 60, 7)]
+    for text in texts:
+        histogram.add(text)
+    assert histogram.step == 1 and histogram.resolution == '秒'
+
+    # 跨度依次超过 HISTOGRAM_MAX_BUCKETS 秒、分钟、小时后改用更粗的粒度，已有的计数合并
+    for more, step in [(stamp(1, 10, 30), 60), (stamp(3, 10, 0), 3600), (stamp(20), 3600),
+                       (stamp(2, 9, 59), 3600), ('2024-09-01 00:00:00 x', 86400)]:
+        texts.append(more)
+        histogram.add(more)
+        assert histogram.step == step and len(histogram.counts) <= HISTOGRAM_MAX_BUCKETS
+        assert bucket_counts(histogram) == reference_counts(texts, step)[0]
+    # 比起点更早的时间戳
+    texts.append(stamp(1, 0, 0))
+    histogram.add(stamp(1, 0, 0))
+    histogram.add('no timestamp')
+    assert bucket_counts(histogram) == reference_counts(texts, 86400)[0]
+    assert histogram.total == len(texts) and histogram.untimed == 1
+
+
+@pytest.mark.parametrize('max_bars', [1, 7, 24, 200])
+def test_histogram_rebin(log_file, max_bars):
+    histogram, texts = histogram_of(log_file, ['error', 'timeout'], and_mode=False)
+    step, bars = histogram.rebin(max_bars)
+    assert len(bars) <= max_bars and sum(bars) == histogram.total
+    factor = step // histogram.step
+    seconds = [s for s in map(text_seconds, texts) if s is not None]
+    for i, count in enumerate(bars):
+        # 合并后的柱条覆盖的时间段，与行首时间戳落在其中的匹配数一致
+        start, end = histogram.bucket_range(i, factor)
+        assert end - start == step
+        assert count == sum(start <= s < end for s in seconds)
+
+
+def test_cli_histogram(log_file, capsys):
+    # 异常堆栈中的 ...Error 行没有时间戳
+    assert main(['--histogram', log_file, 'error']) == 0
+    err = capsys.readouterr().err.splitlines()
+    histogram, _ = histogram_of(log_file, ['error'])
+    lines = format_histogram(histogram)
+    assert err[-len(lines):] == lines
+    assert lines[0].startswith('匹配数按时间的分布')
+    assert lines[-1] == f"另有 {histogram.untimed} 个结果的行首没有时间戳"
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines[1:-1]) == histogram.total
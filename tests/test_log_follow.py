@@ -0,0 +1,101 @@
+import pytest
+
+from search import LogSearcher
+from log_follow import followers_for
+
+
+def start_following(path, keywords, **options):
+    """ 先完整搜索一次，再从搜索到的位置开始跟踪: 返回(首次的结果, follower) """
+    searcher = LogSearcher(keywords, max_results=0, workers=1, use_index=False, **options)
+    matches = list(searcher.search_files([str(path)]))
+    reported = {m.path: m.offset for m in matches}
+    follower, = followers_for(searcher, searcher.file_stats, reported)
+    return matches, follower
+
+
+def read(follower, on_replace=None):
+    return [(m.line_number, m.text) for block in follower.read(on_replace) for m in block]
+
+
+def append(path, text):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+@pytest.mark.parametrize('keywords, literals', [
+    pytest.param(['error'], True, id='bytes'),
+    # 非 ASCII 的大小写字母无法字节级预筛，改为逐行解码
+    pytest.param(['error', 'Ωmega'], False, id='lines'),
+])
+def test_follow_append(tmp_path, log_lines, keywords, literals):
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines[:1000]) + '\n', encoding='utf-8')
+    matches, follower = start_following(path, keywords, and_mode=False)
+    assert (follower.literals is not None) == literals
+    assert len(matches) > 10 and read(follower) == []
+
+    # 完整的行立即读取，没有换行符的最后一行等写完再读
+    append(path, '\n'.join(log_lines[1000:2000]) + '\n' + 'tail error')
+    reference = [(i, line) for i, line in enumerate(log_lines[:2000], 1) if 'error' in line.lower()]
+    assert read(follower) == reference[len(matches):]
+    assert read(follower) == []
+    append(path, ' finished\nnext error\n')
+    assert read(follower) == [(2001, 'tail error finished'), (2002, 'next error')]
+    assert (follower.rotations, follower.truncations) == (0, 0)
+    follower.close()
+
+
+def test_follow_search_ended_mid_line(tmp_path):
+    path = tmp_path / 'app.log'
+    path.write_text('1 error\n2 ok\n3 error started', encoding='utf-8')
+    matches, follower = start_following(path, ['error'])
+    assert [m.text for m in matches] == ['1 error', '3 error started']
+    # 首次搜索已返回的最后一行写完后不再重复返回
+    append(path, ' and finished\n4 waiting')
+    assert read(follower) == []
+    append(path, ' for an error\n')
+    assert read(follower) == [(4, '4 waiting for an error')]
+    follower.close()
+
+
+def test_follow_rotation(tmp_path):
+    path = tmp_path / 'app.log'
+    path.write_text('1 error\n2 ok\n', encoding='utf-8')
+    _, follower = start_following(path, ['error'])
+    old_file = open(path, 'a', encoding='utf-8')
+    path.rename(tmp_path / 'app.log.1')
+    # 改名后新文件创建之前，旧文件仍可继续写入
+    old_file.write('3 error before rotation\n')
+    old_file.flush()
+    assert read(follower) == [(3, '3 error before rotation')]
+    old_file.write('4 error at rotation\n5 error without newline')
+    old_file.close()
+    path.write_text('new 1 ok\nnew 2 error\n', encoding='utf-8')
+
+    replaced = []
+    assert read(follower, lambda p, f: replaced.append((p, f))) == [
+        (4, '4 error at rotation'), (5, '5 error without newline'), (2, 'new 2 error')]
+    assert [p for p, _ in replaced] == [str(path)] and follower.rotations == 1
+    # 旧文件交给调用方，之前结果的行内容仍可从中读取
+    old = replaced[0][1]
+    old.seek(0)
+    assert old.read().startswith(b'1 error\n')
+    old.close()
+    append(path, 'new 3 error\n')
+    assert read(follower) == [(3, 'new 3 error')]
+    follower.close()
+
+
+def test_follow_truncation(tmp_path, log_lines):
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines[:500]) + '\n', encoding='utf-8')
+    _, follower = start_following(path, ['error'])
+    with open(path, 'r+', encoding='utf-8') as f:
+        f.truncate(0)
+        f.write('after 1 error\nafter 2 ok\n')
+    replaced = []
+    assert read(follower, lambda p, f: replaced.append((p, f))) == [(1, 'after 1 error')]
+    assert replaced == [(str(path), None)] and follower.truncations == 1
+    append(path, 'after 3 error\n')
+    assert read(follower) == [(3, 'after 3 error')]
+    follower.close()
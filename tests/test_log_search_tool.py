@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+pytest.importorskip('PyQt5')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from search import LogSearcher, Match
+from histogram import text_seconds
+
+
+@pytest.fixture(scope='module')
+def app():
+    from PyQt5.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+def search_matches(path, keywords, **options):
+    searcher = LogSearcher(keywords, max_results=0, workers=1, use_index=False, histogram=True,
+                           **options)
+    return list(searcher.search(path)), searcher.stats.histogram
+
+
+def shown_texts(model):
+    return [model.store.text(model._store_row(row)) for row in range(model.rowCount())]
+
+
+def test_time_filter(app, log_file):
+    from log_search_tool import ResultListModel
+    matches, histogram = search_matches(log_file, ['error', 'timeout'], and_mode=False,
+                                        after_context=1)
+    model = ResultListModel()
+    model.append(matches[:100])
+    model.append(matches[100:])
+    step, bars = histogram.rebin(30)
+    for i, count in enumerate(bars):
+        start, end = histogram.bucket_range(i, step // histogram.step)
+        model.set_time_filter(start, end)
+        # 只显示柱条时间段内的匹配行，上下文行和没有时间戳的行不显示
+        assert model.rowCount() == count
+        assert shown_texts(model) == [m.text for m in matches
+                                      if m.mask and start <= (text_seconds(m.text) or -1) < end]
+    model.set_time_filter(None)
+    assert model.rowCount() == len(matches) and model.time_filter is None
+
+
+def test_time_filter_append(app, log_file):
+    # 筛选期间加入的结果(跟踪新增内容)只显示落在该时间段内的
+    from log_search_tool import ResultListModel
+    model = ResultListModel()
+    model.append([Match(1, 0, 10, 1, '2024-05-01 10:00:05 error', log_file)])
+    start = text_seconds('2024-05-01 10:00:00')
+    model.set_time_filter(start, start + 60)
+    model.append([Match(2, 0, 10, 1, '2024-05-01 10:00:30 error', log_file),
+                  Match(3, 0, 10, 0, '2024-05-01 10:00:31 context', log_file),
+                  Match(4, 0, 10, 1, '2024-05-01 10:01:00 error', log_file),
+                  Match(5, 0, 10, 1, 'no timestamp error', log_file)])
+    assert model.rowCount() == 2 and [model._store_row(row) for row in range(2)] == [0, 1]
+    model.set_time_filter(None)
+    assert model.rowCount() == 5
+
+
+def test_follow_updates_histogram(app, log_file):
+    # 跟踪到的结果计入时间分布；停止跟踪时不取消正在使用的筛选
+    from log_search_tool import LogSearchTool
+    searcher = LogSearcher(['error'], max_results=0, workers=1, use_index=False, histogram=True)
+    matches = list(searcher.search(log_file))
+    histogram = searcher.stats.histogram
+    total, untimed = histogram.total, histogram.untimed
+    window = LogSearchTool()
+    window.on_search_results(matches)
+    # 开始跟踪时发送的汇总(following)，followed 为 None
+    summary = {'files': [log_file], 'stats': searcher.stats, 'file_stats': [searcher.stats],
+               'error': None, 'followed': None, 'plan': None}
+    window.on_search_finished(summary)
+    assert window.histogram_view.histogram is histogram
+
+    last = next(m.text for m in reversed(matches) if text_seconds(m.text) is not None)
+    start, end = histogram.bucket_range((text_seconds(last) - histogram.origin) // histogram.step)
+    window.filter_results_by_time(start, end)
+    rows = window.result_model.rowCount()
+    assert rows == histogram.counts[-1]
+    window.on_search_results([Match(7000, 0, 10, 1, text, log_file) for text in (
+        last, '2024-05-01 22:00:00 error earlier', 'no timestamp error')])
+    assert histogram.total == total + 2 and histogram.untimed == untimed + 1
+    assert window.result_model.rowCount() == rows + 1
+
+    window.on_search_finished(dict(summary, followed=3))
+    assert window.result_model.time_filter == (start, end)
+    assert window.result_model.rowCount() == rows + 1
+    assert window.show_all_button.isEnabled()
+    window.result_model.store.close()
@@ -0,0 +1,716 @@
+import re
+import bz2
+import gzip
+import json
+import lzma
+from datetime import datetime
+
+import pytest
+
+from search import (SAMPLE_COUNT, SAMPLE_SIZE, LogSearcher, ResultStore, SearchCache,
+                    detect_compression, detect_encoding, iter_log_files, main)
+from time_window import TimeWindow
+from records import RECORD_START
+
+
+def run(path, keywords=(), and_mode=True, case_sensitive=False, **options):
+    options.setdefault('max_results', 0)
+    options.setdefault('workers', 1)
+    options.setdefault('use_index', False)
+    searcher = LogSearcher(list(keywords), and_mode, case_sensitive, **options)
+    return [(m.line_number, m.offset, m.mask, m.text) for m in searcher.search(path)]
+
+
+def lines_of(matches):
+    return [(line_number, text) for line_number, _, mask, text in matches if mask]
+
+
+# 逐行的参考实现
+def expected(lines, test):
+    return [(i, line) for i, line in enumerate(lines, 1) if test(line)]
+
+
+def contains(keywords, and_mode=True):
+    keywords = [k.lower() for k in keywords]
+    combine = all if and_mode else any
+    return lambda line: combine(k in line.lower() for k in keywords)
+
+
+SCAN_MODES = [
+    pytest.param({}, id='mmap'),
+    pytest.param({'use_mmap': False}, id='lines'),
+]
+
+
+@pytest.mark.parametrize('options', SCAN_MODES)
+@pytest.mark.parametrize('keywords, and_mode', [
+    (['error'], True),
+    (['error', 'timeout'], True),
+    (['error', '用户'], False),
+    (['连接', '失败'], True),
+    (['user=42', 'retry', 'Traceback'], False),
+])
+def test_keywords(log_file, log_lines, options, keywords, and_mode):
+    matches = run(log_file, keywords, and_mode, **options)
+    assert lines_of(matches) == expected(log_lines, contains(keywords, and_mode))
+
+
+def test_case_sensitive(log_file, log_lines):
+    matches = run(log_file, ['Error'], case_sensitive=True)
+    assert lines_of(matches) == expected(log_lines, lambda line: 'Error' in line)
+
+
+def test_max_results(log_file, log_lines):
+    matches = run(log_file, ['error'], max_results=10)
+    assert lines_of(matches) == expected(log_lines, contains(['error']))[:10]
+
+
+@pytest.fixture
+def gbk_file(tmp_path):
+    # 連 在 GBK 中为 df 42，第二个字节是 ASCII 的 B
+    path = tmp_path / 'gbk.log'
+    path.write_bytes('header\n連線 失败\nERROR here\n連x ok\n'.encode('gbk'))
+    return str(path)
+
+
+@pytest.mark.parametrize('keywords, lines', [
+    (['error', '連線'], [2, 3]),
+    (['連'], [2, 4]),
+])
+def test_gbk_case_folding(gbk_file, keywords, lines):
+    matches = run(gbk_file, keywords, False)
+    assert [line_number for line_number, *_ in matches] == lines
+    assert run(gbk_file, keywords, False, use_mmap=False) == matches
+
+
+def test_gbk_records(tmp_path):
+    path = tmp_path / 'gbk.log'
+    path.write_bytes('2024-05-01 10:00:00 連線 失败\n  at db\n2024-05-01 10:00:01 ERROR here\n'
+                     '2024-05-01 10:00:02 ok\n'.encode('gbk'))
+    for options in ({}, {'use_mmap': False}):
+        matches = run(str(path), ['error', '連線'], False, record_start=RECORD_START, **options)
+        assert [(n, text) for n, _, _, text in matches] == [
+            (1, '2024-05-01 10:00:00 連線 失败\n  at db'), (3, '2024-05-01 10:00:01 ERROR here')]
+
+
+@pytest.mark.parametrize('options, lines', [
+    pytest.param({'keywords': ['Error', '連線'], 'and_mode': False}, [2, 3, 4, 5], id='or'),
+    pytest.param({'keywords': ['ok', '連線失败']}, [5], id='and'),
+    pytest.param({'query': 'OK AND 連線失败'}, [5], id='query'),
+])
+def test_gbk_mixed_case_keywords(tmp_path, options, lines):
+    # 有大小写的关键词使数据按块转为小写，不能因此漏掉 GBK 的汉字
+    path = tmp_path / 'gbk.log'
+    path.write_bytes('header\n連線 失败\nERROR here\nerror 連線\n連線失败 OK\n'.encode('gbk'))
+    matches = run(str(path), **options)
+    assert [line_number for line_number, *_ in matches] == lines
+    assert run(str(path), use_mmap=False, **options) == matches
+
+
+def test_time_window_line_numbers_after_append(tmp_path, log_lines, monkeypatch):
+    # 行偏移索引保存后文件又追加了内容，窗口之前的行数仍从索引的检查点数起
+    import log_index
+    import line_index
+    monkeypatch.setattr(log_index, 'INDEX_DIR', str(tmp_path / 'index'))
+    monkeypatch.setattr(line_index, 'INDEX_DIR', str(tmp_path / 'index'))
+    monkeypatch.setattr(line_index, 'LINE_INDEX_MIN_SIZE', 1024)
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines) + '\n', encoding='utf-8')
+    run(str(path), ['error'])
+    assert line_index.load_line_index(str(path)) is not None
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('2024-05-02 02:00:00 error appended\n')
+
+    searcher = LogSearcher(['timeout'], max_results=0, workers=1, use_index=False,
+                           time_window=TimeWindow('23:20', '23:40'))
+    matches = list(searcher.search(str(path)))
+    assert matches and not searcher.stats.relative_lines
+    for match in matches:
+        assert log_lines[match.line_number - 1] == match.text
+
+
+def test_cli_index(log_file, tmp_path, monkeypatch, capsys):
+    import log_index
+    monkeypatch.setattr(log_index, 'INDEX_DIR', str(tmp_path / 'index'))
+    assert main(['--build-index', log_file]) == 0
+    assert log_index.open_index(log_file) is not None
+    assert main(['--remove-index', log_file]) == 0
+    assert log_index.open_index(log_file) is None
+    capsys.readouterr()
+    assert main(['--remove-index', log_file]) == 0
+    assert '没有索引' in capsys.readouterr().err
+
+
+def test_cli_keyword_stats(log_file, log_lines, capsys):
+    assert main(['-m', '5', '--keyword-stats', '--or', log_file, 'error', 'timeout']) == 0
+    err = capsys.readouterr().err
+    assert '继续统计' in err and '搜索已停止' not in err
+    total = len(expected(log_lines, contains(['error', 'timeout'], False)))
+    assert f"共 {total} 行匹配" in err
+
+
+def test_cli(log_file, log_lines, capsys):
+    assert main(['-n', '--or', log_file, 'ZeroDivisionError', 'KeyError']) == 0
+    out = capsys.readouterr().out.splitlines()
+    test = contains(['ZeroDivisionError', 'KeyError'], False)
+    assert out == [f"{i}:{line}" for i, line in expected(log_lines, test)]
+    assert main([log_file, 'no-such-keyword']) == 1
+    assert main([log_file]) == 2
+
+
+def padded_lines(count, width=64):
+    """ count 行等长(含换行符 width 字节)的 ASCII 行 """
+    return [f"{i:08d} {'x' * (width - 10)}\n".encode('ascii') for i in range(count)]
+
+
+@pytest.mark.parametrize('sample', [SAMPLE_COUNT // 2, SAMPLE_COUNT - 1])
+def test_detect_encoding_samples(tmp_path, sample):
+    # 文件头是纯 ASCII，GBK 只出现在中间或末尾的一块样本里
+    lines = padded_lines(SAMPLE_SIZE * SAMPLE_COUNT * 2 // 64)
+    size = len(lines) * 64
+    first = sample * ((size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)) // 64 + 2
+    for i in range(first, first + 20):
+        text = '用户登录失败'.encode('gbk')
+        lines[i] = text + b'-' * (63 - len(text)) + b'\n'
+    path = tmp_path / 'app.log'
+    path.write_bytes(b''.join(lines))
+    assert detect_encoding(str(path)) == 'gbk'
+
+
+def test_detect_encoding_gbk(tmp_path):
+    path = tmp_path / 'gbk.log'
+    path.write_bytes('\n'.join(f"{i} 用户 连接失败" for i in range(500)).encode('gbk'))
+    assert detect_encoding(str(path)) == 'gbk'
+
+
+def test_detect_encoding_stray_bytes(tmp_path):
+    # 个别坏字节不会把整个文件判成 latin-1，这些行解码时替换并计数
+    lines = [f"{i} 用户 连接失败".encode('utf-8') for i in range(500)]
+    for i in (100, 300):
+        lines[i] += b' \xff\xfe'
+    path = tmp_path / 'app.log'
+    path.write_bytes(b'\n'.join(lines) + b'\n')
+    assert detect_encoding(str(path)) == 'utf-8'
+    for options in ({}, {'use_mmap': False}):
+        searcher = LogSearcher(['连接'], max_results=0, workers=1, use_index=False, **options)
+        matches = list(searcher.search(str(path)))
+        assert len(matches) == 500 and searcher.stats.encoding == 'utf-8'
+        assert searcher.stats.decode_errors == 2
+        assert [m.line_number for m in matches if '\ufffd' in m.text] == [101, 301]
+
+
+@pytest.mark.parametrize('keywords, and_mode', [
+    (['error', 'db'], False),
+    (['error', 'timeout'], True),
+    (['连接', '失败'], True),
+])
+def test_parallel(log_file, parallel, keywords, and_mode):
+    reference = run(log_file, keywords, and_mode, use_mmap=False)
+    assert run(log_file, keywords, and_mode, workers=2) == reference
+    assert run(log_file, keywords, and_mode, workers=2, max_results=25) == reference[:25]
+
+
+@pytest.fixture
+def log_dir(tmp_path, log_lines):
+    """ 轮转的日志目录: 各文件依次是 log_lines 的一段 """
+    root = tmp_path / 'logs'
+    parts = {
+        'app.log': log_lines[:2000],
+        'app.log.2': log_lines[2000:4000],
+        'app.log.10': log_lines[4000:],
+        'sub/worker.log': log_lines[:300],
+        'sub/notes.txt': ['error in notes'],
+        '.cache/old.log': ['error in a hidden directory'],
+    }
+    for name, lines in parts.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return root
+
+
+def test_iter_log_files(log_dir):
+    logs = [str(log_dir / name) for name in ('app.log', 'app.log.2', 'app.log.10', 'sub/worker.log')]
+    assert list(iter_log_files([str(log_dir)], ['*.log', '*.log.*'])) == logs
+    assert list(iter_log_files([str(log_dir)], ['*.log*'], ['*.10'])) == logs[:2] + logs[3:]
+    assert len(list(iter_log_files([str(log_dir)]))) == 5
+    # 明确指定的文件不受 include 限制，重复的只出现一次
+    notes = str(log_dir / 'sub' / 'notes.txt')
+    assert list(iter_log_files([notes, str(log_dir), logs[0]], ['*.txt'])) == [notes, logs[0]]
+
+
+def file_matches(paths, keywords, **options):
+    """ 逐个文件单独搜索的结果: [(文件, 行号, 内容)] """
+    return [(path, n, text) for path in paths for n, _, mask, text in run(path, keywords, **options)
+            if mask]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_search_files(log_dir, workers):
+    paths = list(iter_log_files([str(log_dir)], ['*.log*']))
+    reference = file_matches(paths, ['timeout', 'db'])
+    searcher = LogSearcher(['timeout', 'db'], max_results=0, workers=workers, use_index=False)
+    matches = list(searcher.search_files(paths))
+    assert [(m.path, m.line_number, m.text) for m in matches] == reference
+    assert [s.path for s in searcher.file_stats] == paths
+    assert searcher.stats.result_count == len(reference)
+
+    # 结果数上限对所有文件合计生效
+    searcher = LogSearcher(['timeout', 'db'], max_results=150, workers=workers, use_index=False)
+    matches = list(searcher.search_files(paths))
+    assert [(m.path, m.line_number, m.text) for m in matches] == reference[:150]
+    assert searcher.stats.limit_reached and len({m.path for m in matches}) > 1
+
+
+def test_search_files_error(log_dir, log_file):
+    # 列出后被删除的文件记录在它自己的统计中，其他文件照常搜索
+    paths = [log_file, str(log_dir / 'deleted.log'), str(log_dir / 'app.log')]
+    searcher = LogSearcher(['retry'], max_results=0, workers=1, use_index=False)
+    matches = list(searcher.search_files(paths))
+    assert [(m.path, m.line_number, m.text) for m in matches] == file_matches(paths[::2], ['retry'])
+    assert [bool(s.error) for s in searcher.file_stats] == [False, True, False]
+
+
+def test_cli_files(log_dir, capsys):
+    paths = list(iter_log_files([str(log_dir)], ['*.log*']))
+    assert main(['-n', '--include', '*.log*', str(log_dir), 'KeyError']) == 0
+    captured = capsys.readouterr()
+    assert captured.out.splitlines() == [
+        f"{path}:{n}:{text}" for path, n, text in file_matches(paths, ['KeyError'])]
+    assert '共搜索 4 个文件' in captured.err
+
+    missing = str(log_dir / 'deleted.log')
+    assert main(['--include', '*.log*', '-f', str(log_dir), missing, 'KeyError']) == 0
+    captured = capsys.readouterr()
+    assert 'deleted.log: 出错' in captured.err and captured.out.count('KeyError') > 1
+
+
+def compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data)
+    if compression == 'bz2':
+        return bz2.compress(data)
+    if compression == 'xz':
+        return lzma.compress(data)
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSIONS = [('gzip', '.gz'), ('bz2', '.bz2'), ('xz', '.xz'), ('zstd', '.zst')]
+
+
+@pytest.mark.parametrize('compression, ext', COMPRESSIONS)
+@pytest.mark.parametrize('options', SCAN_MODES + [
+    pytest.param({'before_context': 1, 'after_context': 2}, id='context'),
+])
+def test_compressed(log_file, tmp_path, compression, ext, options):
+    path = tmp_path / f'app.log.1{ext}'
+    with open(log_file, 'rb') as f:
+        path.write_bytes(compress(f.read(), compression))
+    searcher = LogSearcher(['timeout', '成功'], max_results=0, workers=1, use_index=False, **options)
+    matches = [(m.line_number, m.offset, m.mask, m.text) for m in searcher.search(str(path))]
+    assert searcher.stats.compression == compression
+    assert matches == run(log_file, ['timeout', '成功'], **options)
+
+
+@pytest.mark.parametrize('compression, ext', COMPRESSIONS)
+def test_detect_compression(log_file, tmp_path, compression, ext):
+    # 按魔数而不是扩展名判断
+    with open(log_file, 'rb') as f:
+        data = f.read()
+    packed = tmp_path / 'app.log'
+    packed.write_bytes(compress(data, compression))
+    plain = tmp_path / f'plain{ext}'
+    plain.write_bytes(data)
+    assert detect_compression(str(packed)) == compression
+    assert detect_compression(str(plain)) is None
+    assert run(str(packed), ['KeyError']) == run(str(plain), ['KeyError']) == run(log_file, ['KeyError'])
+
+
+def test_corrupt_gzip(log_file, tmp_path):
+    broken = tmp_path / 'broken.log.gz'
+    broken.write_bytes(b'\x1f\x8b\x08\x00' + b'not gzip data' * 10)
+    with pytest.raises(OSError, match='解压失败'):
+        run(str(broken), ['error'])
+    # 多个文件时损坏的文件只记录错误，不中断其他文件
+    searcher = LogSearcher(['KeyError'], max_results=0, workers=1, use_index=False)
+    matches = list(searcher.search_files([str(broken), log_file]))
+    assert matches and searcher.file_stats[0].error and not searcher.file_stats[1].error
+
+
+def test_result_store(log_file, tmp_path):
+    packed = tmp_path / 'app.log.gz'
+    with open(log_file, 'rb') as f:
+        packed.write_bytes(gzip.compress(f.read()))
+    gbk = tmp_path / 'gbk.log'
+    gbk.write_bytes('连接 error\nok\n用户 Error 失败\n'.encode('gbk'))
+    searcher = LogSearcher(['error', '失败'], and_mode=False, max_results=0, workers=1,
+                           use_index=False)
+    matches = list(searcher.search_files([log_file, str(gbk), str(packed)]))
+    store = ResultStore()
+    store.extend(matches[:10])
+    for match in matches[10:]:
+        store.append(match)
+    assert len(store) == len(matches) and list(store) == matches
+    for i, match in enumerate(matches):
+        assert store.text(i) == match.text and store.path(i) == match.path
+        assert store.line_number(i) == match.line_number and store.mask(i) == match.mask
+    # 关闭读取行内容时打开的文件后仍可再次读取
+    store.close()
+    assert store.text(0) == matches[0].text and store.text(len(store) - 1) == matches[-1].text
+    store.close()
+
+
+def test_result_store_detach(tmp_path):
+    path = tmp_path / 'app.log'
+    path.write_text('old error 1\nold ok\nold error 2\n', encoding='utf-8')
+    searcher = LogSearcher(['error'], max_results=0, workers=1, use_index=False)
+    store = ResultStore()
+    store.extend(list(searcher.search(str(path))))
+    assert list(store.texts()) == ['old error 1', 'old error 2']
+
+    # 轮转: 旧文件改名后在原路径创建新文件，之前的结果改从轮转前打开的旧文件读取
+    old_file = open(path, 'rb')
+    path.rename(tmp_path / 'app.log.1')
+    path.write_text('new error 1\n', encoding='utf-8')
+    store.detach(str(path), old_file)
+    store.extend(list(searcher.search(str(path))))
+    assert list(store.texts()) == ['old error 1', 'old error 2', 'new error 1']
+    assert store.paths == [str(path), str(path)]
+
+    # 原地截断: 之前的结果已无法读取
+    path.write_text('short error\n', encoding='utf-8')
+    store.detach(str(path))
+    store.extend(list(searcher.search(str(path))))
+    assert list(store.texts()) == ['old error 1', 'old error 2', ResultStore.TRUNCATED_TEXT,
+                                   'short error']
+    store.close()
+    assert old_file.closed
+
+
+@pytest.fixture
+def indexed_log(tmp_path, log_lines, monkeypatch):
+    """ 建立了索引的日志副本，索引保存在临时目录中 """
+    import log_index
+    import line_index
+    monkeypatch.setattr(log_index, 'INDEX_DIR', str(tmp_path / 'index'))
+    monkeypatch.setattr(line_index, 'INDEX_DIR', str(tmp_path / 'index'))
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines) + '\n', encoding='utf-8')
+    log_index.build_index(str(path), workers=1)
+    return path
+
+
+INDEX_SEARCHES = [
+    pytest.param({'keywords': ['ZeroDivisionError', 'division']}, id='and'),
+    pytest.param({'keywords': ['KeyError', 'TimeoutError'], 'and_mode': False}, id='or'),
+    pytest.param({'keywords': ['Traceback', 'ZeroDivisionError'], 'and_mode': False,
+                  'case_sensitive': True}, id='case'),
+    pytest.param({'query': 'KeyError OR (TimeoutError AND NOT db)'}, id='query'),
+]
+
+
+@pytest.mark.parametrize('options', INDEX_SEARCHES)
+def test_index(indexed_log, options):
+    searcher = LogSearcher(max_results=0, workers=1, **{'keywords': [], **options})
+    matches = [(m.line_number, m.offset, m.mask, m.text) for m in searcher.search(str(indexed_log))]
+    assert searcher.stats.index_used
+    assert matches and matches == run(str(indexed_log), **options)
+
+
+@pytest.mark.parametrize('options', INDEX_SEARCHES)
+def test_index_stale(indexed_log, options):
+    # 文件追加内容后索引过期，改为扫描，新增的行也能找到
+    with open(indexed_log, 'a', encoding='utf-8') as f:
+        f.write('2024-05-02 02:00:00 KeyError TimeoutError ZeroDivisionError division Traceback handler\n')
+    searcher = LogSearcher(max_results=0, workers=1, **{'keywords': [], **options})
+    matches = [(m.line_number, m.offset, m.mask, m.text) for m in searcher.search(str(indexed_log))]
+    assert searcher.stats.index_stale and not searcher.stats.index_used
+    assert matches == run(str(indexed_log), **options)
+    assert matches[-1][3].startswith('2024-05-02 02:00:00')
+
+
+def cached_search(cache, path, keywords, **options):
+    """ 用 cache 搜索，返回(结果, 统计) """
+    options.setdefault('use_index', False)
+    searcher = LogSearcher(keywords, max_results=0, workers=1, cache=cache, **options)
+    matches = [(m.line_number, m.offset, m.mask, m.text) for m in searcher.search(str(path))]
+    return matches, searcher.stats
+
+
+@pytest.mark.parametrize('options', [
+    pytest.param({}, id='mmap'),
+    pytest.param({'use_mmap': False}, id='lines'),
+    pytest.param({'before_context': 2, 'after_context': 2}, id='context'),
+])
+def test_search_cache_append(tmp_path, log_lines, options):
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines[:3000]) + '\n', encoding='utf-8')
+    cache = SearchCache()
+    keywords = ['error', 'timeout']
+    matches, stats = cached_search(cache, path, keywords, **options)
+    assert stats.resumed_from == 0 and matches == run(str(path), keywords, **options)
+
+    # 追加的最后一行还没写完: 下次从这一行的开头重新搜索
+    size = path.stat().st_size
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\n'.join(log_lines[3000:4500]) + '\n' + log_lines[4500][:30])
+    matches, stats = cached_search(cache, path, keywords, **options)
+    assert stats.resumed_from == size and not stats.cache_reset
+    assert matches == run(str(path), keywords, **options)
+
+    size = path.stat().st_size - 30
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(log_lines[4500][30:] + '\n' + '\n'.join(log_lines[4501:]) + '\n')
+    matches, stats = cached_search(cache, path, keywords, **options)
+    assert stats.resumed_from == size
+    assert matches == run(str(path), keywords, **options)
+    assert lines_of(matches) == expected(log_lines, contains(keywords))
+
+
+def test_search_cache_reset(tmp_path, log_lines):
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines[:3000]) + '\n', encoding='utf-8')
+    cache = SearchCache()
+    cached_search(cache, path, ['error'])
+
+    # 原地截断后写入更少的内容
+    with open(path, 'r+', encoding='utf-8') as f:
+        f.truncate(0)
+        f.write('\n'.join(log_lines[3000:3100]) + '\n')
+    matches, stats = cached_search(cache, path, ['error'])
+    assert stats.cache_reset and stats.resumed_from == 0
+    assert matches == run(str(path), ['error'])
+
+    # 轮转: 原路径换成一个更大的新文件(新的 inode)
+    cached_search(cache, path, ['error'])
+    path.rename(tmp_path / 'app.log.1')
+    path.write_text('\n'.join(log_lines[3100:]) + '\n', encoding='utf-8')
+    matches, stats = cached_search(cache, path, ['error'])
+    assert stats.cache_reset and stats.resumed_from == 0
+    assert lines_of(matches) == expected(log_lines[3100:], contains(['error']))
+
+
+@pytest.mark.parametrize('options', [
+    pytest.param({'keywords': ['error', 'db']}, id='keywords'),
+    pytest.param({'keywords': ['error'], 'case_sensitive': True}, id='case'),
+    pytest.param({'keywords': ['error'], 'after_context': 1}, id='context'),
+    pytest.param({'keywords': ['error'], 'encoding': 'latin-1'}, id='encoding'),
+])
+def test_search_cache_key(tmp_path, log_lines, options):
+    # 关键词或选项不同的搜索不使用之前的结果
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(log_lines) + '\n', encoding='utf-8')
+    cache = SearchCache()
+    cached_search(cache, path, ['error'])
+    options = dict(options)
+    keywords = options.pop('keywords')
+    encoding = options.pop('encoding', None)
+    searcher = LogSearcher(keywords, max_results=0, workers=1, use_index=False, cache=cache,
+                           **options)
+    matches = list(searcher.search(str(path), encoding))
+    assert searcher.stats.resumed_from == 0 and not searcher.stats.cache_reset
+    reference = LogSearcher(keywords, max_results=0, workers=1, use_index=False, **options)
+    assert matches == list(reference.search(str(path), encoding))
+    # 相同的搜索仍然使用各自的结果
+    assert cached_search(cache, path, ['error'])[1].resumed_from == path.stat().st_size
+
+
+@pytest.mark.parametrize('options', SCAN_MODES)
+def test_regex(log_file, log_lines, options):
+    pattern = r'user=\d+ .*(retry|失败)'
+    matches = run(log_file, [pattern], regex=True, **options)
+    regex = re.compile(pattern, re.IGNORECASE)
+    assert lines_of(matches) == expected(log_lines, lambda line: regex.search(line))
+
+
+def test_regex_and(log_file, log_lines, parallel):
+    patterns = [r'\btime\w+', r'user=4\d', r'(成功|失败)$']
+    matches = run(log_file, patterns, regex=True)
+    regexes = [re.compile(p, re.IGNORECASE) for p in patterns]
+    assert lines_of(matches) == expected(log_lines, lambda line: all(r.search(line) for r in regexes))
+    assert run(log_file, patterns, regex=True, use_mmap=False) == matches
+    assert run(log_file, patterns, regex=True, workers=2) == matches
+
+
+QUERIES = [
+    ('(timeout OR "user=42") AND NOT ok AND 用户',
+     lambda line: ('timeout' in line or 'user=42' in line) and 'ok' not in line and '用户' in line),
+    # 省略运算符时按 AND 处理，NOT NOT 抵消
+    ('login db NOT NOT retry', lambda line: 'login' in line and 'db' in line and 'retry' in line),
+    ('"division by zero" OR (KeyError AND NOT "error: user")',
+     lambda line: 'division by zero' in line or ('keyerror' in line and 'error: user' not in line)),
+]
+
+
+@pytest.mark.parametrize('options', SCAN_MODES)
+@pytest.mark.parametrize('query, test', QUERIES)
+def test_query(log_file, log_lines, options, query, test):
+    matches = run(log_file, query=query, **options)
+    assert matches and lines_of(matches) == expected(log_lines, lambda line: test(line.lower()))
+
+
+def test_query_parallel(log_file, parallel):
+    query = 'login AND NOT (db OR error)'
+    assert run(log_file, query=query, workers=2) == run(log_file, query=query)
+
+
+@pytest.mark.parametrize('query', ['', 'error AND', '(error OR db', 'error)', '"open', 'NOT'])
+def test_query_errors(log_file, query, capsys):
+    from query import QueryError, parse_query
+    with pytest.raises(QueryError):
+        parse_query(query)
+    if query:
+        assert main(['-q', query, log_file]) == 2
+        assert '查询表达式有误' in capsys.readouterr().err
+
+
+def context_lines(lines, hits, before, after):
+    """ grep -B/-A 输出的行号: 匹配行及其前后的行，按顺序去重 """
+    return sorted({n for i in hits for n in range(i - before, i + after + 1) if 1 <= n <= len(lines)})
+
+
+def test_context(log_file, log_lines, parallel):
+    keywords = ['ZeroDivisionError']
+    hits = {i for i, _ in expected(log_lines, contains(keywords))}
+    shown = context_lines(log_lines, hits, 2, 1)
+    matches = run(log_file, keywords, before_context=2, after_context=1)
+    assert [(n, text) for n, _, _, text in matches] == [(n, log_lines[n - 1]) for n in shown]
+    assert {n for n, _, mask, _ in matches if mask} == hits
+    assert run(log_file, keywords, before_context=2, after_context=1, use_mmap=False) == matches
+    assert run(log_file, keywords, before_context=2, after_context=1, workers=2) == matches
+
+
+def test_context_max_results(log_file, log_lines):
+    # 与 grep -m 一样，最后一个匹配之后的行仍然输出，其中的匹配行作为上下文
+    hits = [i for i, _ in expected(log_lines, contains(['timeout']))]
+    matches = run(log_file, ['timeout'], after_context=3, max_results=5)
+    assert [n for n, _, mask, _ in matches if mask] == hits[:5]
+    assert matches[-1][0] == hits[4] + 3
+
+
+def test_cli_context(log_file, log_lines, capsys):
+    assert main(['-n', '-C', '1', log_file, 'KeyError']) == 0
+    hits = {i for i, _ in expected(log_lines, contains(['KeyError']))}
+    out = []
+    last = None
+    for n in context_lines(log_lines, hits, 1, 1):
+        if last is not None and n != last + 1:
+            out.append('--')
+        out.append(f"{n}{':' if n in hits else '-'}{log_lines[n - 1]}")
+        last = n
+    assert capsys.readouterr().out.splitlines() == out
+
+
+def records_of(lines):
+    """ 按行首的时间戳把续行并入前面的记录: [(首行行号, 记录文本)] """
+    records = []
+    for i, line in enumerate(lines, 1):
+        if records and not re.match(RECORD_START, line):
+            records[-1] = (records[-1][0], records[-1][1] + '\n' + line)
+        else:
+            records.append((i, line))
+    return records
+
+
+@pytest.mark.parametrize('options', [
+    pytest.param({}, id='mmap'),
+    pytest.param({'use_mmap': False}, id='stream'),
+    pytest.param({'workers': 2}, id='parallel'),
+])
+def test_records(log_file, log_lines, parallel, options):
+    keywords = ['payment', 'KeyError']
+    matches = run(log_file, keywords, record_start=RECORD_START, **options)
+    test = contains(keywords)
+    assert lines_of(matches) == [r for r in records_of(log_lines) if test(r[1])]
+
+
+def test_cli_records(log_file, log_lines, capsys):
+    assert main(['-R', '-n', log_file, 'payment', 'ZeroDivisionError']) == 0
+    test = contains(['payment', 'ZeroDivisionError'])
+    out = capsys.readouterr().out
+    assert out == ''.join(f"{i}:{text}\n" for i, text in records_of(log_lines) if test(text))
+    assert main(['-R', '-C', '1', log_file, 'payment']) == 2
+
+
+TIMESTAMP = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})')
+
+
+def line_times(lines):
+    """ 每行所属的时间: 没有时间戳的行归入前面最近的带时间戳的行 """
+    current = None
+    for line in lines:
+        m = TIMESTAMP.match(line)
+        if m:
+            current = datetime.strptime(m.group(1), '%Y-%m-%d %H:%M:%S')
+        yield current
+
+
+def window_lines(lines, window):
+    """ 时间窗口内的行 """
+    first = next(t for t in line_times(lines) if t is not None)
+    start, end = window.resolve(first)
+    return [line for line, when in zip(lines, line_times(lines))
+            if when is not None and (start is None or when >= start) and (end is None or when < end)]
+
+
+TIME_WINDOWS = [
+    ('23:30', '23:45'),         # 只有时间时使用日志中的日期
+    ('2024-05-02 00:05', None), # 跨过午夜
+    (None, '23:10:30'),
+]
+
+
+@pytest.mark.parametrize('options', SCAN_MODES)
+@pytest.mark.parametrize('since, until', TIME_WINDOWS)
+def test_time_window(log_file, log_lines, options, since, until):
+    window = TimeWindow(since, until)
+    matches = run(log_file, ['error'], time_window=window, **options)
+    assert [text for _, text in lines_of(matches)] == [
+        line for line in window_lines(log_lines, window) if 'error' in line.lower()]
+
+
+@pytest.mark.parametrize('since, until', TIME_WINDOWS)
+def test_time_window_compressed(log_file, log_lines, tmp_path, since, until):
+    # 压缩文件无法二分查找，边解压边跳过窗口之前的部分，窗口结束后停止
+    path = tmp_path / 'app.log.gz'
+    with open(log_file, 'rb') as f:
+        path.write_bytes(gzip.compress(f.read()))
+    window = TimeWindow(since, until)
+    matches = run(str(path), ['timeout'], time_window=window)
+    assert [text for _, text in lines_of(matches)] == [
+        line for line in window_lines(log_lines, window) if 'timeout' in line.lower()]
+
+
+def test_time_window_line_numbers(log_file, log_lines):
+    # 小文件直接数出窗口之前的行数，行号与整个文件一致
+    matches = run(log_file, ['timeout'], time_window=TimeWindow('23:20', '23:40'))
+    assert matches
+    for line_number, _, _, text in matches:
+        assert log_lines[line_number - 1] == text
+
+
+def test_cli_time_window(log_file, log_lines, capsys):
+    assert main(['--since', '23:30', '--until', '23:45', log_file, 'error']) == 0
+    window = TimeWindow('23:30', '23:45')
+    assert capsys.readouterr().out.splitlines() == [
+        line for line in window_lines(log_lines, window) if 'error' in line.lower()]
+    assert main(['--since', '25:00', log_file, 'error']) == 2
+    assert main(['--until', '23:45', '--follow', log_file, 'error']) == 2
+
+
+def test_cli_export(log_file, log_lines, tmp_path, capsys):
+    output = tmp_path / 'out.txt'
+    assert main(['-n', '-C', '1', log_file, 'KeyError']) == 0
+    printed = capsys.readouterr().out
+    assert main(['-n', '-C', '1', '-o', str(output), log_file, 'KeyError']) == 0
+    assert output.read_text(encoding='utf-8') == printed
+    assert capsys.readouterr().out == ''
+
+    output = tmp_path / 'out.jsonl.gz'
+    assert main(['-o', str(output), log_file, 'retry']) == 0
+    with gzip.open(output, 'rt', encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert [(row['line'], row['text']) for row in rows] == expected(log_lines, contains(['retry']))
+    assert all(row['match'] and row['keywords'] == ['retry'] for row in rows)
+    assert main(['-o', str(output), '--follow', log_file, 'retry']) == 2
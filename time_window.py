@@ -0,0 +1,189 @@
+"""
+按时间范围搜索按时间顺序写入的日志
+
+    window = TimeWindow('14:02', '14:10')
+    searcher = LogSearcher(['error'], time_window=window)
+    for match in searcher.search('app.log'):
+        print(match.line_number, match.text)
+
+行首带有时间戳(2024-05-01 14:02:03、[2024-05-01T14:02:03 等)的日志按时间顺序
+写入，因此可以在字节偏移上二分查找时间窗口的边界: 定位到中点、跳到下一个行首、
+解析时间戳，几十次探测就能找到边界，之后只扫描窗口内的这一段。没有时间戳的行
+(如异常堆栈的续行)归入前面最近的带时间戳的行。
+
+压缩文件无法随机定位，仍然按块解压，但只匹配窗口内的部分，窗口结束后不再解压。
+"""
+import re
+from datetime import datetime, timedelta
+
+# 行首的时间戳，与 records.RECORD_START 的默认格式一致
+TIMESTAMP_RE = re.compile(rb'^\[?(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})',
+                          re.MULTILINE)
+
+# 用户输入的时间: 日期[ 时:分[:秒]] 或 时:分[:秒]
+DATE_TIME_INPUT = re.compile(
+    r'(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?')
+TIME_INPUT = re.compile(r'(\d{1,2}):(\d{2})(?::(\d{2}))?')
+
+
+def parse_time(text):
+    """
+    解析用户输入的时间，返回 (时间, 精度, 是否有日期)，格式有误时抛出 ValueError。
+
+    精度是输入的最小单位: 14:10 表示 14:10:00 到 14:10:59 这一分钟，作为结束时间时
+    包含这一分钟。没有日期时时间为 datetime.time，搜索时使用日志中的日期。
+    """
+    text = text.strip()
+    m = DATE_TIME_INPUT.fullmatch(text)
+    if m:
+        year, month, day, hour, minute, second = m.groups()
+        if hour is None:
+            precision = timedelta(days=1)
+        elif second is None:
+            precision = timedelta(minutes=1)
+        else:
+            precision = timedelta(seconds=1)
+        try:
+            value = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+                             int(second or 0))
+        except ValueError:
+            raise ValueError(f"无效的时间: {text}") from None
+        return value, precision, True
+    m = TIME_INPUT.fullmatch(text)
+    if m:
+        hour, minute, second = m.groups()
+        try:
+            value = datetime(2000, 1, 1, int(hour), int(minute), int(second or 0)).time()
+        except ValueError:
+            raise ValueError(f"无效的时间: {text}") from None
+        return value, timedelta(minutes=1) if second is None else timedelta(seconds=1), False
+    raise ValueError(f"无法识别的时间 '{text}'，请使用 2024-05-01 14:02、14:02 或 14:02:30 这样的格式")
+
+
+def line_time(data, pos=0, stop=None):
+    """
+    返回 pos 处或之后第一个行首带时间戳的行: (行首偏移, datetime)，
+    到 stop 为止都没有时返回 (stop, None)。pos 不在行首时从下一行开始。
+    """
+    stop = len(data) if stop is None else stop
+    if pos > 0 and data[pos - 1:pos] != b'\n':
+        pos = data.find(b'\n', pos, stop) + 1
+        if pos == 0:
+            return stop, None
+    while pos < stop:
+        m = TIMESTAMP_RE.search(data, pos, stop)
+        if m is None:
+            break
+        try:
+            return m.start(), datetime(*map(int, m.groups()))
+        except ValueError:
+            # 形似时间戳但不是有效的日期时间
+            pos = m.end()
+    return stop, None
+
+
+def lower_bound(data, target, start=0, stop=None):
+    """
+    二分查找 data[start:stop] 中第一个时间戳不早于 target 的行，返回其行首偏移，
+    没有时返回 stop。start 须位于行首；之前的带时间戳的行及其续行都早于 target。
+    """
+    stop = len(data) if stop is None else stop
+    low, high = start, stop
+    while low < high:
+        mid = (low + high) // 2
+        offset, when = line_time(data, mid, stop)
+        if when is None or when >= target:
+            high = mid
+        else:
+            # mid 到 offset 之间探测到的都是这一行
+            low = offset + 1
+    return line_time(data, low, stop)[0]
+
+
+class TimeWindow:
+    """
+    时间范围 [start, end]，任一端为空表示不限；参数是用户输入的文本(见 parse_time)，
+    格式有误时抛出 ValueError。只有时间没有日期时使用日志中第一个时间戳的日期，
+    结束时间早于开始时间(如 23:50 到 00:10)时算作次日。
+    """
+
+    def __init__(self, start=None, end=None):
+        self.start_text = start
+        self.end_text = end
+        self._start = parse_time(start) if start else None
+        self._end = parse_time(end) if end else None
+        if self._start and self._end and self._start[2] and self._end[2]:
+            if self._end[0] + self._end[1] <= self._start[0]:
+                raise ValueError("结束时间早于开始时间")
+
+    def __str__(self):
+        return f"{self.start_text or '开头'} 至 {self.end_text or '末尾'}"
+
+    def resolve(self, first):
+        """
+        返回实际的 (开始, 结束) datetime，结束不包含在内，不限的一端为 None。
+        first 为日志中第一个时间戳，没有时间戳(为 None)时返回 None。
+        """
+        if first is None:
+            return None
+        start = end = None
+        if self._start is not None:
+            value, _, dated = self._start
+            start = value if dated else datetime.combine(first.date(), value)
+        if self._end is not None:
+            value, precision, dated = self._end
+            end = (value if dated else datetime.combine(first.date(), value)) + precision
+            if not dated and start is not None and end <= start:
+                end += timedelta(days=1)
+        return start, end
+
+    def locate(self, data, start=0, stop=None):
+        """
+        在 data[start:stop](start 须位于行首)中二分查找窗口对应的字节范围，返回
+        (开始偏移, 结束偏移)。没有时间戳时返回空的范围。
+        """
+        stop = len(data) if stop is None else stop
+        bounds = self.resolve(line_time(data, start, stop)[1])
+        if bounds is None:
+            return stop, stop
+        low = start if bounds[0] is None else lower_bound(data, bounds[0], start, stop)
+        high = stop if bounds[1] is None else lower_bound(data, bounds[1], low, stop)
+        return low, high
+
+    def clipper(self):
+        """ 按块扫描(压缩文件)时使用的 WindowClipper """
+        return WindowClipper(self)
+
+
+class WindowClipper:
+    """
+    依次给出各块(以完整的行结束)中位于时间窗口内的部分。窗口开始之前的块整块跳过，
+    窗口结束后 done 为真，调用方不必再读取后面的数据。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.bounds = None
+        self.started = False
+        self.done = False
+
+    def clip(self, block):
+        """ 返回块中窗口内的部分 [lo, hi) """
+        size = len(block)
+        if self.bounds is None:
+            first = line_time(block)[1]
+            if first is None:
+                # 还没有遇到时间戳
+                return size, size
+            self.bounds = self.window.resolve(first)
+        start, end = self.bounds
+        lo = 0
+        if not self.started:
+            lo = 0 if start is None else lower_bound(block, start)
+            if lo == size:
+                return size, size
+            self.started = True
+        hi = size if end is None else lower_bound(block, end, lo)
+        if hi < size:
+            self.done = True
+        return lo, hi